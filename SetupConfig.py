@@ -42,8 +42,8 @@ ext_modules=[
                         [os.path.join('cheetah', 'c', '_namemapper.c')]),
            #  Extension("Cheetah._verifytype", 
            #             [os.path.join('cheetah', 'c', '_verifytype.c')]),
-           #  Extension("Cheetah._filters", 
-           #             [os.path.join('cheetah', 'c', '_filters.c')]),
+             Extension("Cheetah._filters", 
+                        [os.path.join('cheetah', 'c', '_filters.c')]),
            #  Extension('Cheetah._template',
            #             [os.path.join('cheetah', 'c', '_template.c')]),
              ]
@@ -52,6 +52,7 @@ ext_modules=[
 scripts = ('bin/cheetah-compile',
            'bin/cheetah',
            'bin/cheetah-analyze',
+           'bin/cheetah-benchmark',
         )
 
 data_files = ['recursive: cheetah *.tmpl *.txt LICENSE README TODO CHANGES',]
@@ -0,0 +1,565 @@
+#!/usr/bin/env python
+'''
+A benchmark harness for compiling and rendering templates.
+
+Every scenario builds its templates and data from fixed inputs, so two runs
+on the same machine measure exactly the same work.  Results are written as
+JSON, one entry per scenario with per-call timing percentiles and allocation
+counts, and two result files can be compared to spot regressions:
+
+    cheetah-benchmark run -o before.json
+    ... change something ...
+    cheetah-benchmark run -o after.json
+    cheetah-benchmark compare before.json after.json
+
+The compiler settings used for every template can be given as a JSON object
+with --compiler-settings, e.g. '{"optimizeGeneratedCode": true}', which makes
+it easy to measure the effect of the optional code generation features.
+'''
+import gc
+import os
+import sys
+import time
+import shutil
+import tempfile
+import platform
+from timeit import default_timer as timer
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from Cheetah.Version import Version
+from Cheetah.Template import Template
+from Cheetah import NameMapper
+from Cheetah import Filters
+
+FORMAT_VERSION = 1
+PERCENTILES = (50, 90, 99)
+DEFAULT_THRESHOLD = 0.10
+
+class Error(Exception):
+    pass
+
+##################################################
+## SCENARIOS
+
+class Scenario(object):
+    """A named piece of work to be timed.
+
+    setup() is called once, outside of the timed region, and must return a
+    callable that performs a single iteration of the work.  teardown() is
+    called once all iterations are done.
+    """
+    kind = None
+    name = None
+    description = None
+    number = 10
+    repeat = 20
+
+    def __init__(self, compilerSettings=None):
+        self.compilerSettings = compilerSettings or {}
+
+    def compile(self, source, **kw):
+        return Template.compile(source=source,
+                                compilerSettings=self.compilerSettings,
+                                useCache=False, **kw)
+
+    def setup(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+class CompileScenario(Scenario):
+    kind = 'compile'
+    number = 1
+    repeat = 10
+
+    def source(self):
+        raise NotImplementedError
+
+    def setup(self):
+        source = self.source()
+        def run():
+            klass = self.compile(source)
+            # don't let the benchmark itself fill up sys.modules
+            sys.modules.pop(klass.__module__, None)
+        return run
+
+class RenderScenario(Scenario):
+    kind = 'render'
+    template = None
+
+    def searchList(self):
+        return []
+
+    def setup(self):
+        klass = self.compile(self.template)
+        instance = klass(searchList=self.searchList())
+        return instance.respond
+
+def _rows(count):
+    return [{'id': i,
+             'name': 'row %d' % i,
+             'price': i * 1.25,
+             'tags': ['a', 'b', 'c'][:i % 4],
+             'active': bool(i % 3),
+             } for i in range(count)]
+
+class SmallCompile(CompileScenario):
+    name = 'compile-small'
+    description = 'A short page with a few placeholders and directives'
+
+    def source(self):
+        return ('<h1>$title</h1>\n'
+                '#for $item in $items\n'
+                '  #if $item.active\n'
+                '<li>$item.name: $item.price</li>\n'
+                '  #end if\n'
+                '#end for\n')
+
+class LargeCompile(CompileScenario):
+    name = 'compile-large'
+    description = 'A long template mixing text, placeholders and directives'
+
+    def source(self):
+        block = ('<div class="section">\n'
+                 '  <h2>$section%(i)d.title</h2>\n'
+                 '  #set $total%(i)d = 0\n'
+                 '  #for $row in $section%(i)d.rows\n'
+                 '    #set $total%(i)d += $row.price\n'
+                 '    #if $row.active\n'
+                 '  <p>${row.name} costs $row.price</p>\n'
+                 '    #else\n'
+                 '  <p class="inactive">$row.name</p>\n'
+                 '    #end if\n'
+                 '  #end for\n'
+                 '  <p>Total: $total%(i)d</p>\n'
+                 '</div>\n')
+        return ''.join([block % {'i': i} for i in range(50)])
+
+class DeepInheritanceCompile(CompileScenario):
+    name = 'compile-deep-inheritance'
+    description = 'A chain of 10 templates, each extending the previous one'
+    depth = 10
+
+    def setup(self):
+        def run():
+            baseclass = Template
+            for level in range(self.depth):
+                source = '#def level%d\nlevel %d\n' % (level, level)
+                if level:
+                    source += '$level%d()\n' % (level - 1)
+                source += '#end def\n$level%d()\n' % level
+                baseclass = self.compile(source, baseclass=baseclass)
+                sys.modules.pop(baseclass.__module__, None)
+        return run
+
+class ManyDefsCompile(CompileScenario):
+    name = 'compile-many-defs'
+    description = 'A template defining 200 methods'
+
+    def source(self):
+        return ''.join(['#def method%d($arg, $flag=False)\n'
+                        '#if $flag\n$arg.upper()#else\n$arg#end if\n'
+                        '#end def\n' % i for i in range(200)])
+
+class LoopRender(RenderScenario):
+    name = 'render-loop'
+    description = 'Nested #for loops over 500 rows'
+    template = ('<table>\n'
+                '#for $row in $rows\n'
+                '<tr id="$row.id">\n'
+                '  <td>$row.name</td><td>$row.price</td>\n'
+                '  #for $tag in $row.tags\n'
+                '  <td>$tag</td>\n'
+                '  #end for\n'
+                '  #if $row.active\n<td>active</td>\n#end if\n'
+                '</tr>\n'
+                '#end for\n'
+                '</table>\n')
+
+    def searchList(self):
+        return [{'rows': _rows(500)}]
+
+class FilterRender(RenderScenario):
+    name = 'render-filter'
+    description = 'Placeholders passing through the WebSafe filter'
+    template = ('#filter WebSafe\n'
+                '#for $row in $rows\n'
+                '<p title="$row.title">$row.body $row.id</p>\n'
+                '#end for\n'
+                '#end filter\n')
+
+    def searchList(self):
+        return [{'rows': [{'id': i,
+                           'title': 'Q&A <%d>' % i,
+                           'body': u'caf\xe9 & "friends" <b>%d</b>' % i,
+                           } for i in range(500)]}]
+
+class DeepSearchListRender(RenderScenario):
+    name = 'render-deep-searchlist'
+    description = 'Placeholders found at the end of a 25-deep searchList'
+    template = ''.join(['$value%d $shared%d\n' % (i, i % 5) for i in range(100)])
+
+    def searchList(self):
+        namespaces = [{'unused%d' % i: i} for i in range(24)]
+        last = {}
+        for i in range(100):
+            last['value%d' % i] = i
+        for i in range(5):
+            last['shared%d' % i] = 'found'
+        namespaces.append(last)
+        return namespaces
+
+class _CacheRender(RenderScenario):
+    template = ('#cache timer="1h", test=$refresh\n'
+                '#for $row in $rows\n'
+                '<li>$row.name: $row.price</li>\n'
+                '#end for\n'
+                '#end cache\n')
+    refresh = False
+
+    def searchList(self):
+        return [{'rows': _rows(200), 'refresh': self.refresh}]
+
+class CacheHitRender(_CacheRender):
+    name = 'render-cache-hit'
+    description = 'A #cache region that is served from the cache'
+
+class CacheMissRender(_CacheRender):
+    name = 'render-cache-miss'
+    description = 'A #cache region that is refreshed on every render'
+    refresh = True
+
+class IncludeRender(RenderScenario):
+    name = 'render-include'
+    description = 'A fresh instance including 20 template files per render'
+
+    def setup(self):
+        self.tempDir = tempfile.mkdtemp()
+        includes = []
+        for i in range(20):
+            path = os.path.join(self.tempDir, 'part%d.tmpl' % i)
+            fp = open(path, 'w')
+            try:
+                fp.write('<div id="part%d">$title #for $i in $range(5)#$i #end for#</div>\n' % i)
+            finally:
+                fp.close()
+            includes.append('#include "%s"\n' % path.replace('\\', '/'))
+        klass = self.compile(''.join(includes))
+        searchList = [{'title': 'included'}]
+        def run():
+            return klass(searchList=searchList).respond()
+        return run
+
+    def teardown(self):
+        shutil.rmtree(self.tempDir, True)
+
+class CallCaptureRender(RenderScenario):
+    name = 'render-call-capture'
+    description = 'Output routed through #call and #capture'
+    template = ('#def wrap($body, $tag="p")\n<$tag>$body</$tag>#end def\n'
+                '#for $row in $rows\n'
+                '#call $wrap\n$row.name $row.price#end call\n'
+                '#capture captured\n$row.id: $row.name#end capture\n'
+                '$captured.strip()\n'
+                '#end for\n')
+
+    def searchList(self):
+        return [{'rows': _rows(200)}]
+
+SCENARIOS = [SmallCompile,
+             LargeCompile,
+             DeepInheritanceCompile,
+             ManyDefsCompile,
+             LoopRender,
+             FilterRender,
+             DeepSearchListRender,
+             CacheHitRender,
+             CacheMissRender,
+             IncludeRender,
+             CallCaptureRender,
+             ]
+
+def scenarioNames():
+    return [scenario.name for scenario in SCENARIOS]
+
+def getScenario(name):
+    for scenario in SCENARIOS:
+        if scenario.name == name:
+            return scenario
+    raise Error('unknown scenario %r, choose from: %s'
+                % (name, ', '.join(scenarioNames())))
+
+##################################################
+## MEASUREMENT
+
+def percentile(values, pct):
+    """Returns the pct-th percentile of values, interpolating linearly
+    between the closest ranks.
+    """
+    if not values:
+        raise ValueError('percentile() of an empty sequence')
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+def _countAllocations(func):
+    """Returns the number of objects allocated by one call to func that were
+    still alive, or only reclaimable by the cyclic garbage collector, when it
+    returned.
+
+    CPython 2 has no allocation tracer, so this uses the collector's own
+    counter of container objects with collection disabled.  Where
+    sys.getallocatedblocks() exists the count of memory blocks is used
+    instead, as it also covers strings and numbers.
+    """
+    gc.collect()
+    wasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        if hasattr(sys, 'getallocatedblocks'):
+            before = sys.getallocatedblocks()
+            func()
+            return sys.getallocatedblocks() - before
+        before = gc.get_count()[0]
+        func()
+        return gc.get_count()[0] - before
+    finally:
+        if wasEnabled:
+            gc.enable()
+
+def measure(func, number=10, repeat=20, warmup=2):
+    """Calls func number*repeat times and returns a dict of timing
+    statistics, in seconds per call, and allocation counts.
+    """
+    for i in xrange(warmup):
+        func()
+    allocations = _countAllocations(func)
+
+    times = []
+    collections = 0
+    for i in xrange(repeat):
+        gcCount = gc.get_count()[1]
+        start = timer()
+        for j in xrange(number):
+            func()
+        times.append((timer() - start) / number)
+        # gen1's counter is bumped by every gen0 collection
+        collections += max(gc.get_count()[1] - gcCount, 0)
+
+    gc.collect()
+    retainedBefore = len(gc.get_objects())
+    for i in xrange(number):
+        func()
+    gc.collect()
+    retained = len(gc.get_objects()) - retainedBefore
+
+    result = {'number': number,
+              'repeat': repeat,
+              'min': min(times),
+              'max': max(times),
+              'mean': sum(times) / len(times),
+              'allocations': allocations,
+              'gcCollections': collections,
+              'retainedObjects': retained,
+              }
+    for pct in PERCENTILES:
+        result['p%d' % pct] = percentile(times, pct)
+    return result
+
+def runScenario(scenarioClass, compilerSettings=None,
+                number=None, repeat=None, warmup=2):
+    """Runs one scenario.  number and repeat default to the values the
+    scenario class gives for them.
+    """
+    scenario = scenarioClass(compilerSettings)
+    func = scenario.setup()
+    try:
+        result = measure(func, number=number or scenario.number,
+                         repeat=repeat or scenario.repeat, warmup=warmup)
+    finally:
+        scenario.teardown()
+    result['kind'] = scenario.kind
+    result['description'] = scenario.description
+    return result
+
+def environment():
+    return {'cheetahVersion': Version,
+            'python': platform.python_version(),
+            'implementation': getattr(platform, 'python_implementation',
+                                      lambda: 'CPython')(),
+            'platform': platform.platform(),
+            'cNameMapper': NameMapper.C_VERSION,
+            'cFilters': Filters.C_VERSION,
+            }
+
+def run(names=None, compilerSettings=None, log=None, **measureKws):
+    """Runs the named scenarios, or all of them, and returns the results as
+    a JSON-serializable dict.
+    """
+    scenarios = [getScenario(name) for name in (names or scenarioNames())]
+    results = {}
+    for scenarioClass in scenarios:
+        if log:
+            log('%s ...' % scenarioClass.name)
+        results[scenarioClass.name] = runScenario(
+            scenarioClass, compilerSettings, **measureKws)
+    return {'formatVersion': FORMAT_VERSION,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': environment(),
+            'compilerSettings': compilerSettings or {},
+            'results': results,
+            }
+
+##################################################
+## COMPARISON
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, stat='p50'):
+    """Compares the results of two runs scenario by scenario.
+
+    Returns a list of dicts, one per scenario present in both runs, sorted by
+    name.  'status' is 'slower' or 'faster' when the chosen statistic changed
+    by more than threshold (a fraction), and 'same' otherwise.
+    """
+    rows = []
+    base = baseline['results']
+    cur = current['results']
+    for name in sorted(base):
+        if name not in cur:
+            continue
+        before = base[name][stat]
+        after = cur[name][stat]
+        if before:
+            ratio = after / before
+        else:
+            ratio = 1.0
+        if ratio > 1 + threshold:
+            status = 'slower'
+        elif ratio < 1 - threshold:
+            status = 'faster'
+        else:
+            status = 'same'
+        rows.append({'name': name,
+                     'baseline': before,
+                     'current': after,
+                     'ratio': ratio,
+                     'status': status,
+                     'allocationsBaseline': base[name].get('allocations'),
+                     'allocationsCurrent': cur[name].get('allocations'),
+                     })
+    return rows
+
+def formatComparison(rows, stat='p50'):
+    lines = ['%-28s %12s %12s %8s  %s' % ('scenario', 'baseline', 'current',
+                                          'ratio', 'status'),
+             ]
+    for row in rows:
+        lines.append('%-28s %10.3fms %10.3fms %7.2fx  %s'
+                     % (row['name'], row['baseline'] * 1000,
+                        row['current'] * 1000, row['ratio'], row['status']))
+    lines.append('(%s per call)' % stat)
+    return '\n'.join(lines)
+
+def formatResults(data):
+    lines = ['%-28s %10s %10s %10s %8s' % ('scenario', 'p50', 'p90', 'p99',
+                                           'allocs'),
+             ]
+    for name in sorted(data['results']):
+        result = data['results'][name]
+        lines.append('%-28s %8.3fms %8.3fms %8.3fms %8d'
+                     % (name, result['p50'] * 1000, result['p90'] * 1000,
+                        result['p99'] * 1000, result['allocations']))
+    return '\n'.join(lines)
+
+def load(path):
+    fp = open(path)
+    try:
+        data = json.load(fp)
+    finally:
+        fp.close()
+    if data.get('formatVersion') != FORMAT_VERSION:
+        raise Error('%s is not a benchmark result file (format version %s)'
+                    % (path, FORMAT_VERSION))
+    return data
+
+def dump(data, path):
+    fp = open(path, 'w')
+    try:
+        json.dump(data, fp, indent=2, sort_keys=True)
+        fp.write('\n')
+    finally:
+        fp.close()
+
+##################################################
+## COMMAND-LINE INTERFACE
+
+USAGE = '''%prog run [options] [scenario ...]
+       %prog compare [options] baseline.json current.json
+       %prog list'''
+
+def main(argv=None):
+    from optparse import OptionParser
+    if argv is None:
+        argv = sys.argv[1:]
+    op = OptionParser(usage=USAGE)
+    op.add_option('-o', '--output', dest='output', default=None,
+            help='Write the results as JSON to this file (default: stdout)')
+    op.add_option('-n', '--number', dest='number', type='int', default=None,
+            help='Calls per timing sample (default: set by each scenario)')
+    op.add_option('-r', '--repeat', dest='repeat', type='int', default=None,
+            help='Timing samples per scenario (default: set by each scenario)')
+    op.add_option('--compiler-settings', dest='compilerSettings', default=None,
+            help='Compiler settings for every template, as a JSON object')
+    op.add_option('-t', '--threshold', dest='threshold', type='float',
+            default=DEFAULT_THRESHOLD,
+            help='Relative change reported by compare (default: 0.10)')
+    op.add_option('--stat', dest='stat', default='p50',
+            help='Statistic used by compare (default: p50)')
+    opts, args = op.parse_args(argv)
+
+    if not args:
+        op.print_help()
+        return 2
+    command, args = args[0], args[1:]
+
+    if command == 'list':
+        for scenario in SCENARIOS:
+            print '%-28s %s' % (scenario.name, scenario.description)
+        return 0
+
+    elif command == 'run':
+        settings = None
+        if opts.compilerSettings:
+            settings = json.loads(opts.compilerSettings)
+        def log(msg):
+            sys.stderr.write(msg + '\n')
+        data = run(args, compilerSettings=settings, log=log,
+                   number=opts.number, repeat=opts.repeat)
+        if opts.output:
+            dump(data, opts.output)
+            print formatResults(data)
+        else:
+            print json.dumps(data, indent=2, sort_keys=True)
+        return 0
+
+    elif command == 'compare':
+        if len(args) != 2:
+            op.error('compare needs a baseline and a current result file')
+        rows = compare(load(args[0]), load(args[1]),
+                       threshold=opts.threshold, stat=opts.stat)
+        print formatComparison(rows, opts.stat)
+        for row in rows:
+            if row['status'] == 'slower':
+                return 1
+        return 0
+
+    op.error('unknown command %r' % command)
+
+if __name__ == '__main__':
+    sys.exit(main())
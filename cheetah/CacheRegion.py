@@ -24,7 +24,19 @@ try:
 except ImportError:
     from md5 import md5
 
+import os
+import random
 import time
+import weakref
+try:
+    from threading import Lock
+except ImportError:
+    class Lock:
+        def acquire(self):
+            pass
+        def release(self):
+            pass
+
 import Cheetah.CacheStore
 
 class CacheItem(object):
@@ -34,13 +46,19 @@ class CacheItem(object):
         - cacheID (string)
         - refreshTime (timestamp or None) : last time the cache was refreshed
         - data (string) : the content of the cache
+
+    The lease methods let the renderers sharing an item agree that only one of
+    them refreshes it.  A lease is a key added to the cacheStore next to the
+    data, so it works across processes with any store that implements add().
     '''
+    pollInterval = 0.05
     
     def __init__(self, cacheItemID, cacheStore):
         self._cacheItemID = cacheItemID
         self._cacheStore = cacheStore
         self._refreshTime = None
         self._expiryTime = 0
+        self._staleTime = 0
 
     def hasExpired(self):
         return (self._expiryTime and time.time() > self._expiryTime)
@@ -48,12 +66,40 @@ class CacheItem(object):
     def setExpiryTime(self, time):
         self._expiryTime = time
 
+    def setExpiryInterval(self, interval, jitter=0):
+        """Sets the expiry time to interval seconds from now, shortened by a
+        random fraction of up to `jitter` of the interval so that items
+        cached at the same moment don't all expire at the same moment.
+        """
+        if jitter:
+            interval = interval * (1 - jitter * random.random())
+        self._expiryTime = time.time() + interval
+
     def getExpiryTime(self):
         return self._expiryTime
 
+    def setStaleTime(self, staleTime):
+        """Keeps the data in the cacheStore for staleTime seconds after the
+        item has expired, so it can be served while the item is refreshed.
+        """
+        self._staleTime = staleTime
+
     def setData(self, data):
         self._refreshTime = time.time()
-        self._cacheStore.set(self._cacheItemID, data, self._expiryTime)
+        exptime = self._expiryTime
+        if exptime and self._staleTime:
+            exptime += self._staleTime
+        self._cacheStore.set(self._cacheItemID, data, exptime)
+
+    def storeDeferredData(self, data, lease=None):
+        """Stores the output of a #cache region that was deferred by the
+        'asyncPlaceholders' setting, once it has been resolved, releases the
+        lease if the region had one and returns data.
+        """
+        self.setData(data)
+        if lease is not None:
+            self.releaseLease(lease)
+        return data
 
     def getRefreshTime(self):
         return self._refreshTime
@@ -66,6 +112,63 @@ class CacheItem(object):
         """Can be overridden to implement edge-caching"""
         return self.getData() or ""
 
+    def lookupOutput(self):
+        """Returns the output if this item has been rendered and its data is
+        still in the cacheStore, otherwise None.
+        """
+        if not self._refreshTime:
+            return None
+        try:
+            return self.renderOutput()
+        except KeyError:
+            return None
+
+    def _leaseKey(self):
+        return self._cacheItemID + ':lease'
+
+    def acquireLease(self, leaseTime):
+        """Tries to become the one renderer that refreshes this item, for at
+        most leaseTime seconds.  Returns a token to pass to releaseLease(), or
+        None if another renderer holds the lease.
+        """
+        token = '%s:%s' % (os.getpid(), random.random())
+        try:
+            self._cacheStore.add(self._leaseKey(), token,
+                                 time.time() + leaseTime)
+        except Cheetah.CacheStore.Error:
+            return None
+        return token
+
+    def releaseLease(self, token):
+        try:
+            if self._cacheStore.get(self._leaseKey()) == token:
+                self._cacheStore.delete(self._leaseKey())
+        except KeyError:
+            pass
+
+    def isLeased(self):
+        try:
+            self._cacheStore.get(self._leaseKey())
+        except KeyError:
+            return False
+        return True
+
+    def waitForOutput(self, timeout):
+        """Returns the data in the cacheStore, stale or not, for use by the
+        renderers that didn't get the lease.  If there is none it waits up to
+        timeout seconds for the lease holder to store it and returns None if
+        it doesn't, so the caller can render the item itself.
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return self._cacheStore.get(self._cacheItemID)
+            except KeyError:
+                pass
+            if not self.isLeased() or time.time() >= deadline:
+                return None
+            time.sleep(self.pollInterval)
+
     def clear(self):
         self._cacheStore.delete(self._cacheItemID)
         self._refreshTime = None
@@ -84,6 +187,12 @@ class _CacheDataStoreWrapper(object):
     def set(self, key, val, time=0):        
         self._dataStore.set(self._keyPrefix+key, val, time=time)
 
+    def fullKey(self, key):
+        return self._keyPrefix+key
+
+    def add(self, key, val, time=0):
+        self._dataStore.add(self._keyPrefix+key, val, time=time)
+
 class CacheRegion(object):
     '''
     A `CacheRegion` stores some `CacheItem` instances.
@@ -92,8 +201,8 @@ class CacheRegion(object):
     If you need a more advanced data store, create a cacheStore class that works
     with Cheetah's CacheStore protocol and provide it as the cacheStore argument
     to __init__.  For example you could use
-    Cheetah.CacheStore.MemcachedCacheStore, a wrapper around the Python
-    memcached API (http://www.danga.com/memcached).
+    Cheetah.CacheStore.MemcachedCacheStore, which keeps the data in memcached
+    servers (http://www.danga.com/memcached).
     '''
     _cacheItemClass = CacheItem
     
@@ -131,6 +240,94 @@ class CacheRegion(object):
         if cacheItemID not in self._cacheItems:
             cacheItem = self._cacheItemClass(
                 cacheItemID=cacheItemID, cacheStore=self._wrappedCacheDataStore)
-            self._cacheItems[cacheItemID] = cacheItem
+            # setdefault() is atomic, so threads sharing the region end up
+            # with the same item
+            self._cacheItems.setdefault(cacheItemID, cacheItem)
             self._isNew = False
         return self._cacheItems[cacheItemID]
+
+    def getCacheItemKeys(self):
+        """ Returns the keys the data of this region's cacheItems are stored
+            under in the cacheStore.
+        """
+        return [self._wrappedCacheDataStore.fullKey(cacheItemID)
+                for cacheItemID in self._cacheItems.keys()]
+
+class CacheRegionRegistry(object):
+    '''
+    A thread-safe table of `CacheRegion` instances that are shared by all
+    instances of a template class, keyed by the class and the region ID.
+    The classes are referenced weakly, so the regions of a template class
+    that is recompiled or otherwise discarded go away with it.
+
+    Templates with _CHEETAH_shareCacheRegions set use the process-wide
+    registry in Template._CHEETAH_cacheRegionRegistry, so a #cache region
+    rendered by one instance is served from the cache to the instances
+    created for later requests.  The registry also provides the store used
+    by those templates unless they set _CHEETAH_cacheStore.  By default that
+    is an LRUMemoryCacheStore holding at most DEFAULT_MAX_ENTRIES items, as
+    the data a discarded class cached isn't removed from the store when its
+    regions go away; pass a cacheStore to change it.
+    '''
+    DEFAULT_MAX_ENTRIES = 10000
+
+    def __init__(self, cacheStore=None):
+        if cacheStore is None:
+            cacheStore = Cheetah.CacheStore.LRUMemoryCacheStore(
+                maxEntries=self.DEFAULT_MAX_ENTRIES)
+        self._cacheStore = cacheStore
+        self._regions = weakref.WeakKeyDictionary() # class -> {regionID: region}
+        self._lock = Lock()
+
+    def cacheStore(self):
+        return self._cacheStore
+
+    def getCacheRegion(self, templateClass, regionID, factory=None):
+        """ Returns the region for the given template class and region ID.
+
+            If there isn't one yet it is created by calling factory(), or None
+            is returned if no factory is given.
+        """
+        self._lock.acquire()
+        try:
+            regions = self._regions.get(templateClass)
+            if regions is None:
+                if factory is None:
+                    return None
+                regions = self._regions[templateClass] = {}
+            region = regions.get(regionID)
+            if region is None and factory is not None:
+                region = regions[regionID] = factory()
+            return region
+        finally:
+            self._lock.release()
+
+    def getCacheRegions(self, templateClass):
+        """ Returns a dictionary of the regions of one template class, keyed
+            by region ID.
+        """
+        self._lock.acquire()
+        try:
+            return dict(self._regions.get(templateClass, {}))
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        " drop all the regions and the data cached in them "
+        self._lock.acquire()
+        try:
+            regions = []
+            for classRegions in self._regions.values():
+                regions.extend(classRegions.values())
+            self._regions = weakref.WeakKeyDictionary()
+        finally:
+            self._lock.release()
+        for region in regions:
+            region.clear()
+
+    def __len__(self):
+        self._lock.acquire()
+        try:
+            return sum([len(regions) for regions in self._regions.values()])
+        finally:
+            self._lock.release()
@@ -14,7 +14,31 @@ get(key, val)
 delete(key)
   deletes or raises a KeyError
 '''
+import re
+import socket
+import sys
 import time
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+try:
+    from threading import Lock, local
+except ImportError:
+    class Lock:
+        def acquire(self):
+            pass
+        def release(self):
+            pass
+    class local(object):
+        pass
+
+from Cheetah.Version import Version
 
 class Error(Exception):
     pass
@@ -43,14 +67,21 @@ class MemoryCacheStore(AbstractCacheStore):
     def set(self, key, val, time=0):
         self._data[key] = (val, time)
 
+    def _has(self, key):
+        try:
+            self.get(key)
+        except KeyError:
+            return False
+        return True
+
     def add(self, key, val, time=0):
-        if key in self._data:
+        if self._has(key):
             raise Error('a value for key %r is already in the cache'%key)
         self._data[key] = (val, time)
 
     def replace(self, key, val, time=0):
-        if key in self._data:
-            raise Error('a value for key %r is already in the cache'%key)
+        if not self._has(key):
+            raise Error('there is no value for key %r in the cache'%key)
         self._data[key] = (val, time)
 
     def delete(self, key):
@@ -65,42 +96,513 @@ class MemoryCacheStore(AbstractCacheStore):
             return val
 
     def clear(self):
-        self._data.clear()        
-                  
+        self._data.clear()
+
+class LRUMemoryCacheStore(AbstractCacheStore):
+    '''
+    An in-memory store with optional limits on the number of entries and on
+    the total size of the values.  When a limit is exceeded the least
+    recently used entries are evicted.
+
+    Expired entries are removed when they are read and by a sweep over the
+    whole store, done by set() at most once every sweepInterval seconds, so
+    entries that are never read again don't accumulate.  The size of a value
+    is its len() if it is a string and 0 otherwise, and values bigger than
+    maxBytes aren't stored at all.
+
+    It is safe to share between threads, e.g. as the cacheStore of a
+    Cheetah.CacheRegion.CacheRegionRegistry.
+    '''
+    def __init__(self, maxEntries=None, maxBytes=None, sweepInterval=60):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.sweepInterval = sweepInterval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = {} # key -> [prev, next, key, val, exptime, size]
+        # a circular doubly linked list, most recently used entry first
+        self._root = root = []
+        root[:] = [root, root, None, None, 0, 0]
+        self._size = 0
+        self._lastSweep = time.time()
+        self._lock = Lock()
+
+    def _sizeOf(self, val):
+        if isinstance(val, basestring):
+            return len(val)
+        return 0
+
+    def _link(self, entry):
+        root = self._root
+        first = root[1]
+        entry[0] = root
+        entry[1] = first
+        first[0] = root[1] = entry
+
+    def _unlink(self, entry):
+        prev, next = entry[0], entry[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _isExpired(self, entry, now):
+        return entry[4] and now > entry[4]
+
+    ## the following methods don't lock, the calling code is responsible
+    ## for concurrency locking
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._unlink(entry)
+        self._size -= entry[5]
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is not None and self._isExpired(entry, time.time()):
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def _store(self, key, val, exptime):
+        if key in self._data:
+            self._remove(key)
+        size = self._sizeOf(val)
+        if self.maxBytes is not None and size > self.maxBytes:
+            # don't flush the whole store for a value that can't be kept
+            self.evictions += 1
+            return
+        entry = [None, None, key, val, exptime, size]
+        self._data[key] = entry
+        self._link(entry)
+        self._size += entry[5]
+
+        now = time.time()
+        if (self.sweepInterval is not None
+            and now - self._lastSweep >= self.sweepInterval):
+            self._sweep(now)
+        root = self._root
+        while ((self.maxEntries is not None and len(self._data) > self.maxEntries)
+               or (self.maxBytes is not None and self._size > self.maxBytes)):
+            # the least recently used entry is the last one in the list
+            self._remove(root[0][2])
+            self.evictions += 1
+
+    def _sweep(self, now):
+        for key, entry in self._data.items():
+            if self._isExpired(entry, now):
+                self._remove(key)
+                self.expirations += 1
+        self._lastSweep = now
+
+    ## the public API
+
+    def set(self, key, val, time=0):
+        self._lock.acquire()
+        try:
+            self._store(key, val, time)
+        finally:
+            self._lock.release()
+
+    def add(self, key, val, time=0):
+        self._lock.acquire()
+        try:
+            if self._lookup(key) is not None:
+                raise Error('a value for key %r is already in the cache'%key)
+            self._store(key, val, time)
+        finally:
+            self._lock.release()
+
+    def replace(self, key, val, time=0):
+        self._lock.acquire()
+        try:
+            if self._lookup(key) is None:
+                raise Error('there is no value for key %r in the cache'%key)
+            self._store(key, val, time)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._remove(key)
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            self._unlink(entry)
+            self._link(entry)
+            self.hits += 1
+            return entry[3]
+        finally:
+            self._lock.release()
+
+    def sweep(self):
+        """Removes all the expired entries now.
+        """
+        self._lock.acquire()
+        try:
+            self._sweep(time.time())
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            root = self._root
+            root[0] = root[1] = root
+            self._size = 0
+        finally:
+            self._lock.release()
+
+    def size(self):
+        """Returns the total size of the values held in the store.
+        """
+        return self._size
+
+    def stats(self):
+        return {'entries': len(self._data),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                }
+
+
+class _MemcachedConnection(object):
+    """A connection to a memcached server, speaking its text protocol.
+    """
+    def __init__(self, address, timeout):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(address)
+        except:
+            self._socket.close()
+            raise
+        self._buffer = ''
+
+    def send(self, data):
+        self._socket.sendall(data)
+
+    def _fill(self):
+        chunk = self._socket.recv(4096)
+        if not chunk:
+            raise socket.error('connection closed by the memcached server')
+        self._buffer += chunk
+
+    def readline(self):
+        while '\r\n' not in self._buffer:
+            self._fill()
+        line, self._buffer = self._buffer.split('\r\n', 1)
+        return line
+
+    def read(self, length):
+        """Reads a data block of the given length and its trailing \\r\\n.
+        """
+        while len(self._buffer) < length + 2:
+            self._fill()
+        data = self._buffer[:length]
+        self._buffer = self._buffer[length+2:]
+        return data
+
+    def close(self):
+        self._socket.close()
+
+class _MemcachedServer(object):
+    """A memcached server and a pool of the idle connections to it.
+
+    A server that fails is considered dead for deadRetry seconds, during
+    which acquire() returns None rather than trying to connect again.
+    """
+    def __init__(self, server, maxIdle, timeout, deadRetry):
+        host, port = server, 11211
+        if ':' in server:
+            host, port = server.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.maxIdle = maxIdle
+        self.timeout = timeout
+        self.deadRetry = deadRetry
+        self._deadUntil = 0
+        self._idle = []
+        self._lock = Lock()
+
+    def acquire(self):
+        if self._deadUntil and time.time() < self._deadUntil:
+            return None
+        self._lock.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+        finally:
+            self._lock.release()
+        try:
+            return _MemcachedConnection(self.address, self.timeout)
+        except socket.error:
+            self.markDead()
+            return None
+
+    def release(self, conn):
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self.maxIdle:
+                self._idle.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def markDead(self):
+        self._deadUntil = time.time() + self.deadRetry
+
+    def closeAll(self):
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for conn in idle:
+            conn.close()
+
+_FLAG_PICKLE = 1 << 0
+_FLAG_COMPRESSED = 1 << 3
+_FLAG_TEXT = 1 << 4
+
+# memcached keys can't be longer than this or contain whitespace or control
+# characters
+_MAX_KEY_LENGTH = 250
+_invalidKeyCharsRE = re.compile(r'[\x00-\x20\x7f]')
+
+class _Missing(object):
+    pass
+
 class MemcachedCacheStore(AbstractCacheStore):
-    servers = ('127.0.0.1:11211')
-    def __init__(self, servers=None, debug=False):
+    '''
+    A store that keeps the data in one or more memcached servers, talking to
+    them over pooled connections that are safe to share between threads.
+    Keys are spread over the servers by their crc32 hash.
+
+    The keys are prefixed with a namespace, 'cheetah-<version>' by default,
+    so that the data cached by different versions of Cheetah doesn't mix.
+    Keys that memcached would refuse are replaced by their md5 digest.
+
+    Strings longer than compressThreshold bytes are stored zlib compressed.
+    Unicode strings are stored as utf-8 and any other values are pickled,
+    using the same flags as the python-memcached client.
+
+    getMulti() and prefetch() fetch many keys in one round trip per server;
+    see Template.prefetchCache().  Prefetched values that haven't been used
+    within prefetchLifetime seconds are discarded.  A server that can't be reached is treated
+    as empty for deadRetry seconds.
+    '''
+    servers = ['127.0.0.1:11211']
+
+    def __init__(self, servers=None, debug=False, namespace=None,
+                 compressThreshold=None, maxIdleConnections=10,
+                 socketTimeout=3, deadRetry=30, prefetchLifetime=1):
         if servers is None:
             servers = self.servers
-        from memcache import Client as MemcachedClient
-        self._client = MemcachedClient(servers, debug)
+        if isinstance(servers, basestring):
+            servers = [servers]
+        if namespace is None:
+            namespace = 'cheetah-' + Version
+        self.debug = debug
+        self.namespace = namespace
+        self.compressThreshold = compressThreshold
+        self.prefetchLifetime = prefetchLifetime
+        self._servers = [_MemcachedServer(server, maxIdleConnections,
+                                          socketTimeout, deadRetry)
+                         for server in servers]
+        self._local = local()
+
+    def _key(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        key = '%s:%s' % (self.namespace, key)
+        if len(key) > _MAX_KEY_LENGTH or _invalidKeyCharsRE.search(key):
+            key = '%s:%s' % (self.namespace, md5(key).hexdigest())
+        return key
+
+    def _serverFor(self, key):
+        if len(self._servers) == 1:
+            return self._servers[0]
+        return self._servers[(zlib.crc32(key) & 0xffffffff) % len(self._servers)]
+
+    def _encode(self, val):
+        flags = 0
+        if isinstance(val, unicode):
+            val = val.encode('utf-8')
+            flags |= _FLAG_TEXT
+        elif not isinstance(val, str):
+            val = pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+            flags |= _FLAG_PICKLE
+        if (self.compressThreshold is not None
+            and len(val) > self.compressThreshold):
+            compressed = zlib.compress(val)
+            if len(compressed) < len(val):
+                val = compressed
+                flags |= _FLAG_COMPRESSED
+        return flags, val
+
+    def _decode(self, flags, val):
+        if flags & _FLAG_COMPRESSED:
+            val = zlib.decompress(val)
+        if flags & _FLAG_TEXT:
+            val = val.decode('utf-8')
+        elif flags & _FLAG_PICKLE:
+            val = pickle.loads(val)
+        return val
+
+    def _call(self, server, func):
+        """Runs func(connection) with a connection to the server.  Returns
+        _Missing if the server can't be reached.
+        """
+        conn = server.acquire()
+        if conn is None:
+            return _Missing
+        released = False
+        try:
+            try:
+                result = func(conn)
+            except socket.error, e:
+                server.markDead()
+                if self.debug:
+                    sys.stderr.write('MemcachedCacheStore: %s:%s: %s\n'
+                                     % (server.address + (e,)))
+                return _Missing
+            server.release(conn)
+            released = True
+            return result
+        finally:
+            if not released:
+                # it may be halfway through a reply, so it can't be reused
+                conn.close()
+
+    def _prefetched(self):
+        """Returns the values prefetch() fetched for the current thread, if
+        it was called less than prefetchLifetime seconds ago.
+        """
+        prefetched = getattr(self._local, 'prefetched', None)
+        if (prefetched and
+            time.time() - self._local.prefetchTime > self.prefetchLifetime):
+            self._local.prefetched = prefetched = None
+        return prefetched
+
+    def _forget(self, key):
+        prefetched = self._prefetched()
+        if prefetched:
+            prefetched.pop(key, None)
+
+    def _store(self, cmd, key, val, time):
+        self._forget(key)
+        mkey = self._key(key)
+        flags, data = self._encode(val)
+        command = '%s %s %d %d %d\r\n%s\r\n' % (
+            cmd, mkey, flags, int(time or 0), len(data), data)
+        def store(conn):
+            conn.send(command)
+            return conn.readline()
+        return self._call(self._serverFor(mkey), store)
 
     def set(self, key, val, time=0):
-        self._client.set(key, val, time)
+        self._store('set', key, val, time)
 
     def add(self, key, val, time=0):
-        res = self._client.add(key, val, time)        
-        if not res:
+        if self._store('add', key, val, time) != 'STORED':
             raise Error('a value for key %r is already in the cache'%key)
-        self._data[key] = (val, time)
 
     def replace(self, key, val, time=0):
-        res = self._client.replace(key, val, time)        
-        if not res:
-            raise Error('a value for key %r is already in the cache'%key)
-        self._data[key] = (val, time)
+        if self._store('replace', key, val, time) != 'STORED':
+            raise Error('there is no value for key %r in the cache'%key)
 
     def delete(self, key):
-        res = self._client.delete(key, time=0)        
-        if not res:
+        self._forget(key)
+        mkey = self._key(key)
+        def delete(conn):
+            conn.send('delete %s\r\n' % mkey)
+            return conn.readline()
+        if self._call(self._serverFor(mkey), delete) != 'DELETED':
             raise KeyError(key)
-        
+
     def get(self, key):
-        val = self._client.get(key)
-        if val is None:
-            raise KeyError(key)
+        prefetched = self._prefetched()
+        if prefetched and key in prefetched:
+            val = prefetched.pop(key)
         else:
-            return val
+            val = self.getMulti([key]).get(key, _Missing)
+        if val is _Missing:
+            raise KeyError(key)
+        return val
+
+    def getMulti(self, keys):
+        """Returns a dictionary of the values of those keys that are in the
+        cache, fetching them with one request per server.
+        """
+        keysByServer = {}
+        mkeys = {}
+        for key in keys:
+            mkey = self._key(key)
+            mkeys[mkey] = key
+            keysByServer.setdefault(self._serverFor(mkey), []).append(mkey)
+
+        result = {}
+        def getMulti(conn):
+            conn.send('get %s\r\n' % ' '.join(serverKeys))
+            while True:
+                line = conn.readline()
+                if line == 'END':
+                    break
+                # VALUE <key> <flags> <bytes>
+                parts = line.split()
+                if len(parts) != 4 or parts[0] != 'VALUE':
+                    raise socket.error('unexpected reply %r' % line)
+                data = conn.read(int(parts[3]))
+                if parts[1] in mkeys:
+                    result[mkeys[parts[1]]] = self._decode(int(parts[2]), data)
+        for server, serverKeys in keysByServer.items():
+            self._call(server, getMulti)
+        return result
+
+    def prefetch(self, keys):
+        """Fetches the values of the keys in one go, so the following get()
+        calls for them in the current thread don't go to the servers.  Each
+        prefetched value is only served once, and not at all after
+        prefetchLifetime seconds or discardPrefetched(), so a value that a
+        render didn't use isn't served stale by a later one.
+        """
+        result = self.getMulti(keys)
+        prefetched = {}
+        for key in keys:
+            prefetched[key] = result.get(key, _Missing)
+        self._local.prefetched = prefetched
+        self._local.prefetchTime = time.time()
+
+    def discardPrefetched(self):
+        """Discards the current thread's prefetched values that haven't been
+        used.
+        """
+        self._local.prefetched = None
 
     def clear(self):
-        self._client.flush_all()        
+        self.discardPrefetched()
+        def flushAll(conn):
+            conn.send('flush_all\r\n')
+            return conn.readline()
+        for server in self._servers:
+            self._call(server, flushAll)
+
+    def disconnect(self):
+        """Closes the idle connections.
+        """
+        for server in self._servers:
+            server.closeAll()
@@ -15,13 +15,14 @@ Last Revision Date: $Date: 2007/10/02 01:22:04 $
 __author__ = "Tavis Rudd <tavis@damnsimple.com> and Mike Orr <sluggoster@gmail.com>"
 __revision__ = "$Revision: 1.26 $"[11:-2]
 
-import getopt, glob, os, pprint, re, shutil, sys
+import getopt, glob, marshal, os, pprint, re, shutil, sys, time, traceback
 import cPickle as pickle
 from optparse import OptionParser
 
 from Cheetah.Version import Version
 from Cheetah.Template import Template, DEFAULT_COMPILER_SETTINGS
 from Cheetah.Utils.Misc import mkdirsWithPyInitFiles
+from Cheetah.CompileManifest import CompileManifest, fileDigest
 
 optionDashesRE = re.compile(  R"^-{1,2}"  )
 moduleNameRE = re.compile(  R"^[a-zA-Z_][a-zA-Z_0-9]*$"  )
@@ -52,6 +53,41 @@ class Bundle:
         return "<Bundle %r>" % self.__dict__
 
 
+##################################################
+## WORKER POOL FUNCTIONS
+## used by CheetahWrapper._runWorkerPool()
+
+_workerWrapper = None
+
+def _initWorker(wrapper):
+    global _workerWrapper
+    _workerWrapper = wrapper
+    # the parent reports the progress of the workers
+    wrapper.opts.verbose = False
+
+def _runWorkerTask(task):
+    """Compile or fill one bundle in a worker process.  Returns the tuple
+       (index, elapsed, error, result), where error is a formatted traceback
+       or None.
+    """
+    index, b, toArchive = task
+    wrapper = _workerWrapper
+    started = time.time()
+    error = result = None
+    try:
+        if toArchive:
+            moduleName, code, pysrc = wrapper._compileArchiveBundle(b)
+            # code objects can't be pickled, so send them marshalled
+            result = moduleName, marshal.dumps(code), pysrc
+        else:
+            wrapper._compileOrFillBundle(b)
+    except KeyboardInterrupt:
+        raise
+    except:
+        error = traceback.format_exc()
+    return index, time.time() - started, error, result
+
+
 ##################################################
 ## USAGE FUNCTION & MESSAGES
 
@@ -101,6 +137,7 @@ Run "cheetah options" for the list of valid options.
 class CheetahWrapper(object):
     MAKE_BACKUPS = True
     BACKUP_SUFFIX = ".bak"
+    MANIFEST_FILE = ".cheetah-%s-manifest"
     _templateClass = None
     _compilerSettings = None    
 
@@ -172,6 +209,9 @@ class CheetahWrapper(object):
         pao('--print-settings', action='store_true', dest='print_settings', help='Print out the list of available compiler settings')
         pao("--templateAPIClass", action="store", dest="templateClassName", default=None, help='Name of a subclass of Cheetah.Template.Template to use for compilation, e.g. MyTemplateClass')
         pao("--parallel", action="store", type="int", dest="parallel", default=1, help='Compile/fill templates in parallel, e.g. --parallel=4')
+        pao("--archive", action="store", dest="archive", default=None, help='Pack the compiled templates into one archive FILE instead of writing .py files, see Cheetah.TemplateArchive (compile only)')
+        pao("--incremental", action="store_true", dest="incremental", default=False, help='Only compile/fill the templates that changed since the last --incremental run, and the templates that depend on them')
+        pao("--manifest", action="store", dest="manifest", default=None, help='Keep the record of the last --incremental run in FILE (defaults to .cheetah-compile-manifest or .cheetah-fill-manifest in the output directory), implies --incremental')
         pao('--shbang', dest='shbang', default='#!/usr/bin/env python', help='Specify the shbang to place at the top of compiled templates, e.g. --shbang="#!/usr/bin/python2.6"')
         pao('--encoding', dest='encoding', default=None, help='Specify the encoding of source files (e.g. \'utf-8\' to force input files to be interpreted as UTF-8)')
 
@@ -339,47 +379,247 @@ you do have write permission to and re-run the tests.""")
         if self.opts.flat:
             self._checkForCollisions(bundles)
 
-        # In parallel mode a new process is forked for each template
-        # compilation, out of a pool of size self.opts.parallel. This is not
-        # really optimal in all cases (e.g. probably wasteful for small
-        # templates), but seems to work well in real life for me.
-        #
-        # It also won't work for Windows users, but I'm not going to lose any
-        # sleep over that.
-        if self.opts.parallel > 1:
-            bad_child_exit = 0
-            pid_pool = set()
-
-            def child_wait():
-                pid, status = os.wait()
-                pid_pool.remove(pid)
-                return os.WEXITSTATUS(status)
-
-            while bundles:
-                b = bundles.pop()
-                pid = os.fork()
-                if pid:
-                    pid_pool.add(pid)
-                else:
-                    self._compileOrFillBundle(b)
-                    sys.exit(0)
-
-                if len(pid_pool) == self.opts.parallel:
-                    bad_child_exit = child_wait()
-                    if bad_child_exit:
-                        break
+        manifest = templates = None
+        if opts.incremental or opts.manifest:
+            manifest, templates = self._getManifest(bundles)
 
-            while pid_pool:
-                child_exit = child_wait()
-                if not bad_child_exit:
-                    bad_child_exit = child_exit
+        if self.opts.archive:
+            self._compileArchive(bundles, manifest, templates)
+            return
 
-            if bad_child_exit:
-                sys.exit("Child process failed, exited with code %d" % bad_child_exit)
+        allBundles = bundles
+        if manifest is not None:
+            dirty = manifest.getDirty(templates, self._makeOutputExists(bundles))
+            bundles = [b for b in bundles if b.src in dirty]
+            C("%d of %d templates unchanged", len(allBundles) - len(bundles),
+              len(allBundles))
 
-        else:
+        errors = []
+        done = []
+        try:
+            if self.opts.parallel > 1:
+                errors = self._runWorkerPool(bundles)
+                failed = set([b.src for b, error in errors])
+                done = [b for b in bundles if b.src not in failed]
+            else:
+                for b in bundles:
+                    self._compileOrFillBundle(b)
+                    done.append(b)
+        finally:
+            if manifest is not None:
+                self._updateManifest(manifest, templates, done, errors)
+        if errors:
+            self._exitWithErrors(errors, bundles)
+
+    def _getManifest(self, bundles):
+        """Load the manifest for --incremental, see Cheetah.CompileManifest.
+           Returns it along with a dict that maps the source of each bundle
+           to the module name other templates would import it as.
+        """
+        opts = self.opts
+        if opts.stdout:
+            self.error("--incremental can't be used with --stdout")
+        path = opts.manifest
+        if not path:
+            if opts.archive:
+                dir = os.path.dirname(opts.archive)
+            else:
+                dir = opts.odir
+            path = os.path.join(dir or os.curdir, self.MANIFEST_FILE
+                                % (self.isCompile and "compile" or "fill"))
+        manifest = CompileManifest(path, self._getSettingsKey())
+        templates = {}
+        for b in bundles:
+            try:
+                templates[b.src] = self._getBundleModuleName(b)
+            except Error:
+                # it can't be imported, so nothing depends on it
+                templates[b.src] = b.src
+        return manifest, templates
+
+    def _getSettingsKey(self):
+        """A string identifying the options that affect the output of every
+           template, for the manifest.
+        """
+        opts = self.opts
+        key = [self.isCompile, sorted(self._getCompilerSettings().items()),
+               opts.templateClassName, opts.shbang, opts.encoding, opts.oext,
+               opts.odir, opts.flat, opts.archive]
+        if not self.isCompile:
+            if opts.env:
+                key.append(sorted(os.environ.items()))
+            if opts.pickle:
+                key.append(fileDigest(opts.pickle))
+        return repr(key)
+
+    def _makeOutputExists(self, bundles):
+        dsts = dict([(b.src, b.dst) for b in bundles])
+        def outputExists(src):
+            return os.path.exists(dsts[src])
+        return outputExists
+
+    def _updateManifest(self, manifest, templates, done, errors=()):
+        for b in done:
+            manifest.update(b.src, templates)
+        for b, error in errors:
+            manifest.remove(b.src)
+        manifest.save()
+
+    def _exitWithErrors(self, errors, bundles):
+        sys.exit("%d of %d templates failed: %s" % (
+            len(errors), len(bundles),
+            ', '.join([b.src for b, error in errors])))
+
+    def _compileArchive(self, bundles, manifest=None, templates=None):
+        """Compile all the bundles into the single archive file given with
+           --archive, see Cheetah.TemplateArchive.
+
+           With --incremental the templates that haven't changed are copied
+           from the existing archive.  The manifest is only updated once the
+           new archive is in place.
+        """
+        C, D, W = self.chatter, self.debug, self.warn
+        from Cheetah.TemplateArchive import ArchiveWriter, ArchiveReader
+        from Cheetah.TemplateArchive import Error as ArchiveError
+        if not self.isCompile:
+            self.error("--archive can only be used with the compile command")
+        archivePath = self.opts.archive
+        allBundles = bundles
+        unchanged = []
+        reader = None
+        if manifest is not None:
+            try:
+                reader = ArchiveReader(archivePath)
+            except (IOError, ArchiveError):
+                pass
+            def outputExists(src):
+                return reader is not None and templates[src] in reader
+            dirty = manifest.getDirty(templates, outputExists)
+            bundles = [b for b in allBundles if b.src in dirty]
+            unchanged = [b for b in allBundles if b.src not in dirty]
+            C("%d of %d templates unchanged", len(unchanged), len(allBundles))
+        writer = ArchiveWriter(archivePath)
+        try:
+            try:
+                for b in unchanged:
+                    moduleName = templates[b.src]
+                    writer.addCode(moduleName, reader.getCode(moduleName),
+                                   reader.getSource(moduleName))
+            finally:
+                if reader is not None:
+                    reader.close()
+            if self.opts.parallel > 1:
+                errors = self._runWorkerPool(bundles, writer)
+                if errors:
+                    self._exitWithErrors(errors, bundles)
+            else:
+                for b in bundles:
+                    moduleName, code, pysrc = self._compileArchiveBundle(b)
+                    C("Compiling %s -> %s:%s", b.src, archivePath, moduleName)
+                    writer.addCode(moduleName, code, pysrc)
+        except:
+            writer.abort()
+            raise
+        writer.close()
+        if manifest is not None:
+            self._updateManifest(manifest, templates, bundles)
+        C("Wrote %d templates to %s", len(allBundles), archivePath)
+
+    def _compileArchiveBundle(self, b):
+        moduleName = self._getBundleModuleName(b)
+        pysrc = self._compileBundle(b)
+        return moduleName, compile(pysrc + '\n', b.dst, 'exec'), pysrc
+
+    def _runWorkerPool(self, bundles, archiveWriter=None):
+        """Compile or fill the bundles with a pool of self.opts.parallel
+           worker processes.
+
+           The workers are forked once, after Cheetah and the template class
+           have been imported and a template has been compiled, and pull
+           batches of bundles from a shared queue, largest source files
+           first, so the slowest templates don't end up last.  Each result
+           carries the time taken and any error, and the errors are reported
+           together at the end: a list of (bundle, error) pairs is returned
+           for the bundles that failed.
+        """
+        C, D, W = self.chatter, self.debug, self.warn
+        try:
+            import multiprocessing
+        except ImportError:
+            W("The multiprocessing module isn't available, "
+              "compiling/filling sequentially.")
+            multiprocessing = None
+        if multiprocessing is None or not bundles:
             for b in bundles:
-                self._compileOrFillBundle(b)
+                if archiveWriter:
+                    archiveWriter.addCode(*self._compileArchiveBundle(b))
+                else:
+                    self._compileOrFillBundle(b)
+            return []
+
+        def size(b):
+            try:
+                return os.path.getsize(b.src)
+            except OSError:
+                return 0
+        tasks = [(size(b), i, b) for i, b in enumerate(bundles)]
+        tasks.sort(reverse=True)
+        tasks = [(i, b, archiveWriter is not None) for s, i, b in tasks]
+
+        numWorkers = min(self.opts.parallel, len(tasks))
+        # small batches keep the IPC overhead down without letting one worker
+        # sit on a long tail of templates
+        batchSize = max(1, min(16, len(tasks) // (numWorkers * 8)))
+
+        # warm up in the parent, so the workers inherit it all
+        TemplateClass = self._getTemplateClass()
+        TemplateClass.compile(source='$warmup#def warmup\n#end def\n',
+                              returnAClass=False,
+                              compilerSettings=self._getCompilerSettings())
+
+        what = self.isCompile and "Compiled" or "Filled"
+        started = time.time()
+        errors = []
+        pool = multiprocessing.Pool(numWorkers, _initWorker, (self,))
+        try:
+            results = pool.imap_unordered(_runWorkerTask, tasks, batchSize)
+            for i, elapsed, error, result in results:
+                b = bundles[i]
+                if error:
+                    errors.append((b, error))
+                    W("Error in %s:\n%s", b.src, error)
+                    continue
+                if archiveWriter:
+                    moduleName, codeData, pysrc = result
+                    archiveWriter.addCode(moduleName, marshal.loads(codeData), pysrc)
+                    C("%s %s -> %s:%s (%.3fs)", what, b.src,
+                      archiveWriter.path, moduleName, elapsed)
+                else:
+                    C("%s %s -> %s (%.3fs)", what, b.src, b.dst, elapsed)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        pool.join()
+        C("%s %d templates in %.2fs with %d workers", what,
+          len(bundles) - len(errors), time.time() - started, numWorkers)
+        return errors
+
+    def _getBundleModuleName(self, b):
+        """The dotted name a bundle's .py file would be imported as, relative
+           to the output directory.
+        """
+        path = b.dst
+        odir = self.opts.odir
+        if odir and path.startswith(odir + os.sep):
+            path = path[len(odir + os.sep):]
+        path = os.path.splitext(path)[0]
+        parts = path.split(os.sep)
+        for part in parts:
+            if not moduleNameRE.match(part):
+                raise Error("%s: %s can't be turned into a module name"
+                            % (b.src, path))
+        return '.'.join(parts)
 
     def _checkForCollisions(self, bundles):
         """Check for multiple source paths writing to the same destination
@@ -568,6 +808,23 @@ you do have write permission to and re-run the tests.""")
             output = str(TemplateClass(file=sys.stdin, compilerSettings=compilerSettings))
         sys.stdout.write(output)
 
+    def _compileBundle(self, b):
+        """Return the Python module code for a bundle's template.
+        """
+        TemplateClass = self._getTemplateClass()
+        compilerSettings = self._getCompilerSettings()
+        basename = b.basename
+        if not moduleNameRE.match(basename):
+            tup = basename, b.src
+            raise Error("""\
+%s: base name %s contains invalid characters.  It must
+be named according to the same rules as Python modules.""" % tup)
+        return TemplateClass.compile(file=b.src, returnAClass=False,
+                                     moduleName=basename,
+                                     className=basename,
+                                     commandlineopts=self.opts,
+                                     compilerSettings=compilerSettings)
+
     def _compileOrFillBundle(self, b):
         C, D, W = self.chatter, self.debug, self.warn
         TemplateClass = self._getTemplateClass()
@@ -586,17 +843,7 @@ you do have write permission to and re-run the tests.""")
             bak = None
             C("")
         if self.isCompile:
-            if not moduleNameRE.match(basename):
-                tup = basename, src
-                raise Error("""\
-%s: base name %s contains invalid characters.  It must
-be named according to the same rules as Python modules.""" % tup)
-            pysrc = TemplateClass.compile(file=src, returnAClass=False,
-                                          moduleName=basename,
-                                          className=basename,
-                                          commandlineopts=self.opts,
-                                          compilerSettings=compilerSettings)
-            output = pysrc
+            output = self._compileBundle(b)
         else:
             #output = str(TemplateClass(file=src, searchList=self.searchList))
             tclass = TemplateClass.compile(file=src, compilerSettings=compilerSettings)
@@ -0,0 +1,387 @@
+'''
+Provides persistent backends for the compilation cache used by
+Template.compile().
+
+The in-memory cache in Template._CHEETAH_compileCache is keyed with Python's
+builtin hash(), which is only stable for the lifetime of a process.  The
+classes in this module use digests that are stable across process restarts
+so that generated module code, and the byte-code compiled from it, can be
+reused by the next process that compiles the same template:
+
+    from Cheetah.Template import Template
+    from Cheetah.CompileCache import DiskCompileCache
+
+    class MyTemplate(Template):
+        _CHEETAH_persistentCompileCache = DiskCompileCache('/var/cache/cheetah')
+
+A cache backend needs to provide genKey(), get(key) and set(key, ...) with the
+same semantics as DiskCompileCache.
+
+It also provides LRUCompileCache, a bounded replacement for the plain dict
+used as Template._CHEETAH_compileCache:
+
+    class MyTemplate(Template):
+        _CHEETAH_compileCache = LRUCompileCache(maxEntries=500, ttl=3600)
+'''
+import os
+import sys
+import imp
+import time
+import types
+import marshal
+import tempfile
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+try:
+    from threading import Lock, RLock
+except ImportError:
+    class Lock:
+        def acquire(self):
+            pass
+        def release(self):
+            pass
+    RLock = Lock
+
+from Cheetah.Version import Version
+
+class Error(Exception):
+    pass
+
+_literalTypes = (basestring, int, long, float, bool, complex, type(None))
+
+def _normalizeLiteral(val):
+    """Returns a representation of val that has a stable repr(), or raises
+    TypeError if val contains anything other than builtin literals.
+
+    Compiler settings can contain callables (e.g. expressionFilterHooks) whose
+    repr() includes a memory address, so templates compiled with them can't
+    be cached persistently.
+    """
+    if isinstance(val, _literalTypes):
+        return val
+    elif isinstance(val, (list, tuple)):
+        return (type(val).__name__, tuple([_normalizeLiteral(v) for v in val]))
+    elif isinstance(val, dict):
+        return ('dict', tuple(sorted([(k, _normalizeLiteral(v))
+                                      for k, v in val.items()])))
+    raise TypeError('%r is not a literal value' % (val,))
+
+def _sourceBytes(source=None, file=None):
+    if source is not None:
+        if isinstance(source, unicode):
+            return 'u' + source.encode('utf-8')
+        return 's' + source
+    fp = open(file, 'rb')
+    try:
+        return 'f' + fp.read()
+    finally:
+        fp.close()
+
+def codeWithFilename(code, filename):
+    """Returns a copy of the code object, and of the code objects of the
+    functions and classes defined in it, with co_filename set to filename.
+
+    A code object loaded from a persistent cache still has the filename of
+    the module it was compiled for by the process that stored it, which
+    wouldn't match the __file__ of the module it is now exec'd in.
+    """
+    if code.co_filename == filename:
+        return code
+    consts = tuple([isinstance(const, types.CodeType)
+                    and codeWithFilename(const, filename) or const
+                    for const in code.co_consts])
+    return types.CodeType(code.co_argcount, code.co_nlocals,
+                          code.co_stacksize, code.co_flags, code.co_code,
+                          consts, code.co_names, code.co_varnames, filename,
+                          code.co_name, code.co_firstlineno, code.co_lnotab,
+                          code.co_freevars, code.co_cellvars)
+
+class DiskCompileCache(object):
+    """Stores generated module code and marshalled code objects in a
+    directory, one file per template.
+
+    Entries are written to a temporary file and renamed into place, so several
+    processes can share a cache directory.  Unreadable or truncated entries
+    are treated as cache misses.
+    """
+    fileExtension = '.cheetahc'
+
+    def __init__(self, cacheDir):
+        self._cacheDir = cacheDir
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    def cacheDir(self):
+        return self._cacheDir
+
+    def genKey(self, source=None, file=None,
+               compilerClass=None, compilerSettings=None,
+               className=None, moduleName=None, mainMethodName=None,
+               baseclassName=None, shBang=None):
+        """Returns a hex digest for the given compilation inputs, or None if
+        they can't be hashed in a way that is stable between processes.
+        """
+        if not source and not isinstance(file, basestring):
+            return None
+        try:
+            settings = _normalizeLiteral(compilerSettings or {})
+        except TypeError:
+            return None
+        try:
+            srcBytes = _sourceBytes(source, file)
+            # the generated code has the path and mtime of the file in it
+            fileInfo = None
+            if isinstance(file, basestring):
+                fileInfo = (file, os.path.getmtime(file))
+        except (IOError, OSError):
+            return None
+
+        digest = sha1(srcBytes)
+        digest.update('\0')
+        digest.update(repr(fileInfo))
+        if compilerClass is not None:
+            compilerClass = '%s.%s' % (compilerClass.__module__,
+                                       compilerClass.__name__)
+        for val in (settings, compilerClass,
+                    className, moduleName, mainMethodName,
+                    baseclassName, shBang,
+                    Version, imp.get_magic()):
+            digest.update('\0')
+            digest.update(repr(val))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._cacheDir, key + self.fileExtension)
+
+    def get(self, key):
+        """Returns the tuple (generatedModuleCode, moduleEncoding, codeObject)
+        or None if there is no usable entry for key.  codeObject may be None.
+        """
+        path = self._path(key)
+        try:
+            fp = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                code, encoding, codeObject = marshal.load(fp)
+            except (EOFError, ValueError, TypeError):
+                self.delete(key)
+                return None
+        finally:
+            fp.close()
+        return code, encoding, codeObject
+
+    def set(self, key, code, encoding, codeObject=None):
+        data = marshal.dumps((code, encoding, codeObject))
+        fd, tmpPath = tempfile.mkstemp(dir=self._cacheDir, suffix='.tmp')
+        try:
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            try:
+                os.rename(tmpPath, self._path(key))
+            except OSError:
+                # Windows won't rename over an existing file
+                self.delete(key)
+                os.rename(tmpPath, self._path(key))
+        except (IOError, OSError):
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self._cacheDir):
+            if name.endswith(self.fileExtension):
+                try:
+                    os.remove(os.path.join(self._cacheDir, name))
+                except OSError:
+                    pass
+
+class LRUCompileCache(object):
+    """An in-memory compile cache with optional limits on the number of
+    entries, the total size of the generated code and the time an entry may
+    go unused.
+
+    It supports the subset of the mapping protocol that Template.compile()
+    uses.  When the limits are exceeded the entries with the oldest
+    lastCheckoutTime are evicted and their modules are removed from
+    sys.modules, so the template classes can be garbage collected once they
+    are no longer referenced elsewhere.
+    """
+    def __init__(self, maxEntries=None, maxBytes=None, ttl=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = {}
+        self._size = 0
+        self._lock = Lock()
+
+    def _itemSize(self, item):
+        return len(getattr(item, 'code', None) or '')
+
+    def _hasExpired(self, item, now):
+        return bool(self.ttl) and now - item.lastCheckoutTime > self.ttl
+
+    def _evict(self, key):
+        """The calling code is responsible for concurrency locking.
+        """
+        item = self._items.pop(key)
+        self._size -= self._itemSize(item)
+        self.evictions += 1
+        klass = getattr(item, 'klass', None)
+        if klass is not None:
+            modName = klass.__module__
+            mod = sys.modules.get(modName)
+            if mod is not None and getattr(mod, klass.__name__, None) is klass:
+                # Python clears a module's globals when the module object is
+                # deallocated, so the class keeps a reference to it for as
+                # long as the class itself is alive.
+                klass._CHEETAH_evictedModule = mod
+                del sys.modules[modName]
+
+    def _enforceLimits(self):
+        """The calling code is responsible for concurrency locking.
+        """
+        now = time.time()
+        for key, item in self._items.items():
+            if self._hasExpired(item, now):
+                self._evict(key)
+
+        if ((self.maxEntries is None or len(self._items) <= self.maxEntries)
+            and (self.maxBytes is None or self._size <= self.maxBytes)):
+            return
+        byAge = sorted([(item.lastCheckoutTime, key)
+                        for key, item in self._items.items()])
+        for lastCheckoutTime, key in byAge:
+            if ((self.maxEntries is None or len(self._items) <= self.maxEntries)
+                and (self.maxBytes is None or self._size <= self.maxBytes)):
+                break
+            self._evict(key)
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            item = self._items.get(key)
+            if item is not None:
+                now = time.time()
+                if self._hasExpired(item, now):
+                    self._evict(key)
+                    item = None
+                else:
+                    item.lastCheckoutTime = now
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return item
+        finally:
+            self._lock.release()
+
+    def __getitem__(self, key):
+        item = self.get(key)
+        if item is None:
+            raise KeyError(key)
+        return item
+
+    def __contains__(self, key):
+        self._lock.acquire()
+        try:
+            item = self._items.get(key)
+            return item is not None and not self._hasExpired(item, time.time())
+        finally:
+            self._lock.release()
+
+    def __setitem__(self, key, item):
+        self._lock.acquire()
+        try:
+            if key in self._items:
+                self._size -= self._itemSize(self._items[key])
+            self._items[key] = item
+            self._size += self._itemSize(item)
+            self._enforceLimits()
+        finally:
+            self._lock.release()
+
+    def __delitem__(self, key):
+        self._lock.acquire()
+        try:
+            item = self._items.pop(key)
+            self._size -= self._itemSize(item)
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._items)
+
+    def keys(self):
+        return self._items.keys()
+
+    def size(self):
+        """Returns the total length of the generated code held in the cache.
+        """
+        return self._size
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._items.clear()
+            self._size = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {'entries': len(self._items),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                }
+
+class PerKeyLocks(object):
+    """A table of reentrant locks, one per key, that are created on demand and
+    discarded once no thread holds or waits for them.
+
+    Template.compile() uses it to make compilation single-flight per cacheHash
+    without serializing the compilation of unrelated templates.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._locks = {} # key -> [lock, number of holders and waiters]
+
+    def acquire(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [RLock(), 0]
+            entry[1] += 1
+        finally:
+            self._lock.release()
+        entry[0].acquire()
+
+    def release(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._locks[key]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+        finally:
+            self._lock.release()
+        entry[0].release()
+
+    def __len__(self):
+        return len(self._locks)
@@ -0,0 +1,237 @@
+'''
+Keeps track of what `cheetah compile --incremental` (or `fill`) built last
+time, so the next run only rebuilds the templates that changed.
+
+The manifest records, for every template, a digest of its source and the
+templates and files it depends on through #extends, #import, #from and
+#include.  A template is rebuilt when its source or one of the files it
+#includes changed, when its output is missing, when the options it is built
+with changed, or when a template it depends on, directly or not, is rebuilt.
+
+The dependencies are found by scanning the source for the directives rather
+than by compiling it, so they are a best guess: module names are matched
+against the templates being built, both as absolute names and relative to the
+template's own package, and #include is only followed for literal paths.
+'''
+import os
+import re
+import tempfile
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+try:
+    import json
+except ImportError:
+    json = None
+    import cPickle as pickle
+
+from Cheetah.Version import Version
+
+FORMAT_VERSION = 1
+
+_directiveRE = re.compile(r'^[ \t]*#[ \t]*(extends|import|from)[ \t]+([^\n#]+)',
+                          re.M)
+_includeRE = re.compile(
+    r'#include[ \t]+(?:raw[ \t]+)?(?:source[ \t]*=[ \t]*)?[\'"]([^\'"\n]+)[\'"]')
+_dottedNameRE = re.compile(r'^[A-Za-z_][\w.]*$')
+
+def fileDigest(path):
+    """Returns the hex sha1 digest of the file's contents, or None if it can't
+    be read.
+    """
+    try:
+        fp = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        return sha1(fp.read()).hexdigest()
+    finally:
+        fp.close()
+
+def findDependencies(source):
+    """Returns (moduleNames, includePaths) for the #extends, #import, #from
+    and #include directives in a template's source.  For '#from a.b import c'
+    both 'a.b' and 'a.b.c' are returned, as c might be a module.
+    """
+    moduleNames = []
+    for directive, rest in _directiveRE.findall(source):
+        if directive == 'from':
+            parts = rest.split()
+            if len(parts) >= 3 and parts[1] == 'import':
+                moduleNames.append(parts[0])
+                for name in ' '.join(parts[2:]).strip('()').split(','):
+                    name = name.split()
+                    if name:
+                        moduleNames.append(parts[0] + '.' + name[0])
+            continue
+        for name in rest.split(','):
+            name = name.split()
+            if name:
+                moduleNames.append(name[0])
+    moduleNames = [name for name in moduleNames if _dottedNameRE.match(name)]
+    return moduleNames, _includeRE.findall(source)
+
+class CompileManifest(object):
+    """The manifest for a set of templates, stored in the file at path.
+
+    settingsKey is a string that identifies everything other than the sources
+    that affects the output (compiler settings, command-line options, the
+    Cheetah version).  If it differs from the one the manifest was saved
+    with, all the templates are considered dirty.
+    """
+    def __init__(self, path, settingsKey=''):
+        self.path = path
+        self.settingsKey = sha1(repr((Version, settingsKey))).hexdigest()
+        self._entries = {}
+        self._scans = {}
+        self.load()
+
+    def load(self):
+        try:
+            fp = open(self.path, 'rb')
+        except IOError:
+            return
+        try:
+            try:
+                if json:
+                    data = json.load(fp)
+                else:
+                    data = pickle.load(fp)
+            except Exception:
+                # an unreadable manifest just means a full rebuild
+                return
+        finally:
+            fp.close()
+        if (data.get('formatVersion') == FORMAT_VERSION
+            and data.get('settingsKey') == self.settingsKey):
+            self._entries = data.get('templates', {})
+
+    def save(self):
+        data = {'formatVersion': FORMAT_VERSION,
+                'settingsKey': self.settingsKey,
+                'templates': self._entries}
+        dirName = os.path.dirname(os.path.abspath(self.path))
+        fd, tmpPath = tempfile.mkstemp(dir=dirName, suffix='.tmp')
+        fp = os.fdopen(fd, 'wb')
+        try:
+            if json:
+                json.dump(data, fp, indent=1, sort_keys=True)
+            else:
+                pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        try:
+            os.rename(tmpPath, self.path)
+        except OSError:
+            # Windows won't rename over an existing file
+            os.remove(self.path)
+            os.rename(tmpPath, self.path)
+
+    def _scan(self, src):
+        scan = self._scans.get(src)
+        if scan is None:
+            try:
+                fp = open(src, 'rb')
+            except IOError:
+                scan = (None, [], [])
+            else:
+                try:
+                    source = fp.read()
+                finally:
+                    fp.close()
+                moduleNames, includes = findDependencies(source)
+                srcDir = os.path.dirname(src)
+                includePaths = []
+                for path in includes:
+                    # relative paths are resolved at runtime, from the
+                    # current directory, but try the template's directory too
+                    for candidate in (path, os.path.join(srcDir, path)):
+                        if os.path.isfile(candidate):
+                            includePaths.append(os.path.normpath(candidate))
+                            break
+                scan = (sha1(source).hexdigest(), moduleNames, includePaths)
+            self._scans[src] = scan
+        return scan
+
+    def _resolveModule(self, src, moduleName, srcsByModule, templates):
+        """Returns the source of the template that moduleName (or one of its
+        parent modules, for '#extends a.b.ClassName') refers to, or None.
+        """
+        package = templates[src].rpartition('.')[0]
+        parts = moduleName.split('.')
+        for i in range(len(parts), 0, -1):
+            name = '.'.join(parts[:i])
+            if package and package + '.' + name in srcsByModule:
+                return srcsByModule[package + '.' + name]
+            if name in srcsByModule:
+                return srcsByModule[name]
+        return None
+
+    def dependencies(self, src, templates):
+        """Returns (templateSources, includePaths) that src depends on.
+        templates maps the sources of the templates being built to their
+        module names.
+        """
+        srcHash, moduleNames, includePaths = self._scan(src)
+        srcsByModule = dict([(mod, s) for s, mod in templates.items()])
+        deps = []
+        for moduleName in moduleNames:
+            dep = self._resolveModule(src, moduleName, srcsByModule, templates)
+            if dep is not None and dep != src and dep not in deps:
+                deps.append(dep)
+        return deps, includePaths
+
+    def isCurrent(self, src):
+        """Whether src and the files it #includes are unchanged since the last
+        update(src).
+        """
+        entry = self._entries.get(src)
+        if entry is None or entry.get('hash') != self._scan(src)[0]:
+            return False
+        for path, digest in entry.get('includes', {}).items():
+            if fileDigest(path) != digest:
+                return False
+        return True
+
+    def getDirty(self, templates, outputExists=None):
+        """Returns the set of the sources in templates that need rebuilding.
+
+        templates maps the sources of the templates being built to their
+        module names.  outputExists(src), if given, says whether the output of
+        a template is still there.
+        """
+        dirty = set()
+        dependents = {}
+        for src in templates:
+            if (not self.isCurrent(src)
+                or (outputExists is not None and not outputExists(src))):
+                dirty.add(src)
+            for dep in self.dependencies(src, templates)[0]:
+                dependents.setdefault(dep, []).append(src)
+
+        pending = list(dirty)
+        while pending:
+            for src in dependents.get(pending.pop(), []):
+                if src not in dirty:
+                    dirty.add(src)
+                    pending.append(src)
+        return dirty
+
+    def update(self, src, templates):
+        """Records that src was built successfully from its current source.
+        """
+        deps, includePaths = self.dependencies(src, templates)
+        self._entries[src] = {
+            'hash': self._scan(src)[0],
+            'module': templates[src],
+            'dependencies': deps,
+            'includes': dict([(path, fileDigest(path))
+                              for path in includePaths]),
+            }
+
+    def remove(self, src):
+        self._entries.pop(src, None)
+
+    def sources(self):
+        return self._entries.keys()
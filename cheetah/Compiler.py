@@ -19,6 +19,11 @@ import random
 import warnings
 import copy
 import codecs
+import operator
+try:
+    import ast
+except ImportError: # Python < 2.6
+    ast = None
 
 from Cheetah.Version import Version, VersionTuple
 from Cheetah.SettingsManager import SettingsManager
@@ -35,6 +40,47 @@ VFSL=valueFromSearchList
 VFN=valueForName
 currentTime=time.time
 
+# The import statements every generated module starts with, grouped with the
+# names each group binds (None for the ones the module itself uses), and the
+# module constants that follow them.  See the 'lazyImports' setting.
+_DEFAULT_IMPORTS = [
+    (["import sys"], ['sys']),
+    (["import os",
+      "import os.path"], ['os']),
+    (['try:',
+      '    import builtins as builtin',
+      'except ImportError:',
+      '    import __builtin__ as builtin'], ['builtin']),
+    (["from os.path import getmtime, exists"], ['getmtime', 'exists']),
+    (["import time"], ['time']),
+    (["import types"], ['types']),
+    (["from Cheetah.Version import MinCompatibleVersion as RequiredCheetahVersion",
+      "from Cheetah.Version import MinCompatibleVersionTuple as RequiredCheetahVersionTuple",
+      "from Cheetah.Template import Template"], None),
+    (["from Cheetah.DummyTransaction import *"], '*Cheetah.DummyTransaction'),
+    (["from Cheetah.NameMapper import NotFound, valueForName, valueFromSearchList, valueFromFrameOrSearchList"],
+     ['NotFound', 'valueForName', 'valueFromSearchList', 'valueFromFrameOrSearchList']),
+    (["from Cheetah.NameMapper import valueFromFrameOrSearchListCached, autoCall"],
+     ['valueFromFrameOrSearchListCached', 'autoCall']),
+    (["from Cheetah.CacheRegion import CacheRegion"], ['CacheRegion']),
+    (["import Cheetah.Filters as Filters"], ['Filters']),
+    (["import Cheetah.ErrorCatchers as ErrorCatchers"], ['ErrorCatchers']),
+    ]
+
+_DEFAULT_MODULE_CONSTANTS = [
+    "VFFSL=valueFromFrameOrSearchList",
+    "VFSL=valueFromSearchList",
+    "VFFSLC=valueFromFrameOrSearchListCached",
+    "VFN=valueForName",
+    "AUTOCALL=autoCall",
+    "currentTime=time.time",
+    ]
+
+_nameRE = re.compile(r'[A-Za-z_][A-Za-z_0-9]*')
+
+# how long a renderer refreshing a '#cache lock=True' region may hold its lease
+DEFAULT_CACHE_LEASE_TIME = 30
+
 class Error(Exception): pass
 
 # Settings format: (key, default, docstring)
@@ -44,11 +90,20 @@ _DEFAULT_COMPILER_SETTINGS = [
     ('allowSearchListAsMethArg', True, ''),
     ('useAutocalling', True, 'Detect and call callable objects in searchList, requires useNameMapper=True'),
     ('useStackFrames', True, 'Used for NameMapper.valueFromFrameOrSearchList rather than NameMapper.valueFromSearchList'),
+    ('generateStreamingMethods', False, 'Also generate a generator version of each eligible method, which Template.iterRender() uses to yield output in chunks as it is written'),
+    ('optimizeGeneratedCode', False, 'Fold expressions made only of literals, compile #if/#elif conditions that are constant to 1 or 0 so Python drops the dead branches, merge static text that is only separated by comments or #slurp into one write() and hoist long static text into module constants'),
+    ('hoistStrConstsLongerThan', 4096, 'With optimizeGeneratedCode, static text longer than this is written from a module-level constant, so identical text is only stored once per module'),
+    ('useLocalVarFastPath', False, 'Access $placeholders whose first name is a local variable directly rather than via NameMapper. This applies to the targets of #for and #set, #capture variables and #def arguments, from the directive that binds them to the end of its block. Autocalling is done by NameMapper.autoCall'),
+    ('useCompiledNameLookups', False, 'Pre-split $placeholder names at compile time and remember which searchList namespace satisfied each name for the rest of the method call, via NameMapper.valueFromFrameOrSearchListCached. Mappings earlier in the searchList are re-checked on every lookup, other objects are not'),
+    ('profileRendering', False, 'Time every generated method and #include and record the results in the profiler returned by Template.getProfiler(), along with their line and column in the template source. Classmethods and staticmethods are not profiled'),
+    ('profilePlaceholders', False, 'Also time each $placeholder, see profileRendering'),
     ('useErrorCatcher', False, 'Turn on the #errorCatcher directive for catching NameMapper errors, etc'),
+    ('shareCacheRegions', False, 'Share the #cache regions and cached $*placeholders of the generated class between all its instances by setting Template._CHEETAH_shareCacheRegions'),
     ('alwaysFilterNone', True, 'Filter out None prior to calling the #filter'),
     ('useFilters', True, 'If False, pass output through str()'),
     ('includeRawExprInFilterArgs', True, ''),
     ('useLegacyImportMode', True, 'All #import statements are relocated to the top of the generated Python module'),
+    ('lazyImports', False, 'Leave out the default imports and module constants of the generated module (NameMapper, DummyTransaction, CacheRegion, Filters, ErrorCatchers, os, time, etc.) whose names the module does not use. Names are looked for in the generated code, including $placeholder names, so a template that only reaches a module through a dynamic lookup, e.g. eval(), must #import it itself'),
     ('prioritizeSearchListOverSelf', False, 'When iterating the searchList, look into the searchList passed into the initializer instead of Template members first'),
 
     ('autoAssignDummyTransactionToSelf', False, ''),
@@ -101,10 +156,160 @@ _DEFAULT_COMPILER_SETTINGS = [
     ('allowNestedDefScopes', True, ''),
     ('allowPlaceholderFilterArgs', True, ''),
     ('encoding', None, 'The encoding to read input files as (or None for ASCII)'),
+    ('asyncPlaceholders', False, 'Let placeholders and #call targets return awaitables (objects with add_done_callback(), done() and result(), e.g. futures) rather than block, so a render does not wait for each database or RPC call in turn.  Their output is deferred until all the awaitables of the render are done, see Template.renderAsync().  Only output can be deferred: a value used in an expression or a directive must be available when the template gets to it, and a #capture variable holding deferred output can only be used as a placeholder or #call body.  A #cache region with deferred output is stored once it is done, and a #call target is called once its body is done'),
+    ('outputEncoding', None, 'Encode the output of the generated methods with this encoding as it is written, so they return byte strings (str) rather than unicode: static text is encoded at compile time and the filtered values of placeholders as they are written.  Text that is written some other way, e.g. by an #include\'d template compiled without the setting, is encoded when the output is joined'),
 ]
 
 DEFAULT_COMPILER_SETTINGS = dict([(v[0], v[1]) for v in _DEFAULT_COMPILER_SETTINGS])
 
+##################################################
+## CONSTANT FOLDING
+
+class _NotConstant(Exception):
+    pass
+
+_maxFoldedLength = 1000
+_foldableTypes = (basestring, int, long, float, bool, type(None))
+_constantNames = {'True': True, 'False': False, 'None': None}
+if ast:
+    # '/' is left alone as its meaning depends on 'from __future__ import
+    # division', and '**' and '<<' as they can produce huge values
+    _foldableBinOps = {ast.Add: operator.add,
+                       ast.Sub: operator.sub,
+                       ast.Mult: operator.mul,
+                       ast.FloorDiv: operator.floordiv,
+                       ast.Mod: operator.mod,
+                       ast.RShift: operator.rshift,
+                       ast.BitOr: operator.or_,
+                       ast.BitXor: operator.xor,
+                       ast.BitAnd: operator.and_,
+                       }
+    _foldableUnaryOps = {ast.Not: operator.not_,
+                         ast.USub: operator.neg,
+                         ast.UAdd: operator.pos,
+                         ast.Invert: operator.invert,
+                         }
+    _foldableCmpOps = {ast.Eq: operator.eq,
+                       ast.NotEq: operator.ne,
+                       ast.Lt: operator.lt,
+                       ast.LtE: operator.le,
+                       ast.Gt: operator.gt,
+                       ast.GtE: operator.ge,
+                       ast.In: lambda a, b: a in b,
+                       ast.NotIn: lambda a, b: a not in b,
+                       }
+
+def _checkFoldedSize(val):
+    if isinstance(val, (basestring, tuple)) and len(val) > _maxFoldedLength:
+        raise _NotConstant
+    return val
+
+def _constantValue(node):
+    """Evaluates an expression node that only contains literals, or raises
+    _NotConstant.
+    """
+    if isinstance(node, ast.Expression):
+        return _constantValue(node.body)
+    elif isinstance(node, ast.Num):
+        return node.n
+    elif isinstance(node, ast.Str):
+        return node.s
+    elif isinstance(node, ast.Name) and node.id in _constantNames:
+        return _constantNames[node.id]
+    elif isinstance(node, ast.Tuple):
+        return tuple([_constantValue(elt) for elt in node.elts])
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _foldableUnaryOps:
+        return _foldableUnaryOps[type(node.op)](_constantValue(node.operand))
+    elif isinstance(node, ast.BinOp) and type(node.op) in _foldableBinOps:
+        left = _constantValue(node.left)
+        right = _constantValue(node.right)
+        if isinstance(node.op, ast.Mult):
+            for seq, n in ((left, right), (right, left)):
+                if (isinstance(seq, (basestring, tuple))
+                    and isinstance(n, (int, long))
+                    and len(seq) * n > _maxFoldedLength):
+                    raise _NotConstant
+        return _checkFoldedSize(_foldableBinOps[type(node.op)](left, right))
+    elif isinstance(node, ast.BoolOp):
+        for valueNode in node.values:
+            val = _constantValue(valueNode)
+            if isinstance(node.op, ast.And) and not val:
+                break
+            elif isinstance(node.op, ast.Or) and val:
+                break
+        return val
+    elif isinstance(node, ast.Compare):
+        left = _constantValue(node.left)
+        for op, comparatorNode in zip(node.ops, node.comparators):
+            if type(op) not in _foldableCmpOps:
+                raise _NotConstant
+            right = _constantValue(comparatorNode)
+            if not _foldableCmpOps[type(op)](left, right):
+                return False
+            left = right
+        return True
+    elif isinstance(node, ast.IfExp):
+        if _constantValue(node.test):
+            return _constantValue(node.body)
+        return _constantValue(node.orelse)
+    raise _NotConstant
+
+def _isFoldable(val):
+    if isinstance(val, tuple):
+        return not [v for v in val if not _isFoldable(v)]
+    elif isinstance(val, float):
+        # repr() of inf and nan isn't valid Python
+        return val - val == 0
+    return isinstance(val, _foldableTypes)
+
+def _foldConstantExpr(expr):
+    """Returns (True, value) if the Python expression 'expr' consists only of
+    literals (numbers, strings, True, False, None and tuples of them) combined
+    with operators, or (False, None) if it doesn't or can't be evaluated at
+    compile-time.
+    """
+    if ast is None:
+        return False, None
+    try:
+        if isinstance(expr, unicode):
+            # non-ascii str literals depend on the module's encoding
+            expr = expr.encode('ascii')
+        tree = ast.parse(expr.strip(), '<expr>', 'eval')
+        val = _constantValue(tree)
+    except (_NotConstant, SyntaxError, UnicodeError,
+            ArithmeticError, TypeError, ValueError):
+        return False, None
+    if not _isFoldable(val):
+        return False, None
+    return True, val
+
+def _strConstLiteral(strConst):
+    """Returns the triple-quoted Python literal used to output strConst.
+    """
+    reprstr = repr(strConst)
+    i = 0
+    out = []
+    if reprstr.startswith('u'):
+        i = 1
+        out = ['u']
+    body = escapedNewlineRE.sub('\\1\n', reprstr[i+1:-1])
+
+    if reprstr[i]=="'":
+        out.append("'''")
+        out.append(body)
+        out.append("'''")
+    else:
+        out.append('"""')
+        out.append(body)
+        out.append('"""')
+    return ''.join(out)
+
+_identifierRE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_assignmentTargetRE = re.compile(r'^[A-Za-z0-9_\s,()]*$')
+_forTargetRE = re.compile(r'^for\s+(.+?)\s+in\s', re.DOTALL)
+
+_constantConditionRE = re.compile(r'^(if|elif|while)\s+(.+?)\s*:?$', re.DOTALL)
+
 
 
 class GenUtils(object):
@@ -150,6 +355,17 @@ class GenUtils(object):
             if key == 'timer':
                 key = 'interval'
                 val = self.genTimeInterval(val)
+            elif key == 'stale':
+                val = self.genTimeInterval(val)
+            elif key == 'lock':
+                if val in ('True', '1'):
+                    val = DEFAULT_CACHE_LEASE_TIME
+                elif val in ('False', '0', 'None'):
+                    val = None
+                else:
+                    val = self.genTimeInterval(val)
+            elif key == 'jitter':
+                val = float(val)
                 
             cacheInfo[key] = val
         return cacheInfo
@@ -245,6 +461,20 @@ class GenUtils(object):
           A` = VFSL([locals()]+SL+[globals(), __builtin__], name=A[0], executeCallables=(useAC and A[1]))A[2]
         This option allows Cheetah to be used with Psyco, which doesn't support
         stack frame introspection.
+
+        If the compiler setting useLocalVarFastPath=True (default is False)
+        and 'a' is a local variable bound by #for, #set, #capture or a #def
+        argument earlier in the current block then
+          A` = VFN(AUTOCALL(a), 'b.c', executeCallables=(useAC and A[1]))A[2]
+        where AUTOCALL = NameMapper.autoCall, which is left out if useAC is
+        False, and VFN is left out if there are no more names after 'a'.
+
+        If the compiler setting useCompiledNameLookups=True (default is False)
+        then
+          A` = VFFSLC(SL, _slotCache, ('a', 'b', 'c'), executeCallables=(useAC and A[1]))A[2]
+        where VFFSLC = NameMapper.valueFromFrameOrSearchListCached and
+        _slotCache is a dict local to the method.  The name tuple is a code
+        constant, so it is split and interned once at compile time.
         """
         defaultUseAC = self.setting('useAutocalling')
         useSearchList = self.setting('useSearchList')
@@ -262,6 +492,31 @@ class GenUtils(object):
                               + remainder)
             else:
                 pythonCode = name+remainder
+        elif (self.setting('useLocalVarFastPath')
+              and self.isLocalVar(name.split('.')[0])):
+            useAC = defaultUseAC and useAC
+            nameParts = name.split('.', 1)
+            if useAC:
+                pythonCode = 'AUTOCALL(' + nameParts[0] + ')'
+            else:
+                pythonCode = nameParts[0]
+            if len(nameParts) > 1:
+                pythonCode = ('VFN(' + pythonCode +
+                              ',"' + nameParts[1] +
+                              '",' + repr(useAC) + ')')
+            pythonCode += remainder
+        elif self.setting('useCompiledNameLookups'):
+            self.useNameLookupCache()
+            nameTuple = repr(tuple([str(chunk) for chunk in name.split('.')]))
+            if self.setting('useStackFrames'):
+                frameArgs = ''
+            else:
+                frameArgs = ',locals(),globals()'
+            pythonCode = ('VFFSLC(SL,_slotCache,'
+                          + nameTuple + ','
+                          + repr(defaultUseAC and useAC)
+                          + frameArgs + ')'
+                          + remainder)
         elif self.setting('useStackFrames'):
             pythonCode = ('VFFSL(SL,'
                           '"'+ name + '",'
@@ -293,8 +548,9 @@ class MethodCompiler(GenUtils):
         self._moduleCompiler = classCompiler._moduleCompiler
         self._methodName = methodName
         self._initialMethodComment = initialMethodComment
-        self._setupState()
         self._decorators = decorators or []
+        self._lineCol = None # of the #def or #block in the source
+        self._setupState()
 
     def setting(self, key):
         return self._settingsManager.setting(key)
@@ -309,6 +565,7 @@ class MethodCompiler(GenUtils):
         self._methodBodyChunks = []
 
         self._cacheRegionsStack = []
+        self._leasedCacheRegions = set()
         self._callRegionsStack = []
         self._captureRegionsStack = []
         self._filterRegionsStack = []
@@ -317,6 +574,11 @@ class MethodCompiler(GenUtils):
 
         self._hasReturnStatement = False
         self._isGenerator = False
+        self._usesNameLookupCache = False
+        self._hasClosures = False
+        self._streamPoints = [] # (index in _methodBodyChunks, 'write' or 'stop')
+        self._strConstChunks = {} # index in _methodBodyChunks -> (strConst, chunk)
+        self._localVars = [] # (indentLev, name), or (indentLev, None) for a closure
         
         
     def cleanupState(self):
@@ -324,6 +586,12 @@ class MethodCompiler(GenUtils):
         """
         pass
 
+    def useNameLookupCache(self):
+        """Called when a placeholder in this method is compiled to a
+        VFFSLC() call, which needs the _slotCache local.
+        """
+        self._usesNameLookupCache = True
+
     def methodName(self):
         return self._methodName
 
@@ -343,6 +611,49 @@ class MethodCompiler(GenUtils):
             self._indentLev -=1
         else:
             raise Error('Attempt to dedent when the indentLev is 0')
+        # the local variables bound in the block that just ended might not be
+        # bound at runtime
+        self._localVars = [(indentLev, name) for indentLev, name in self._localVars
+                           if indentLev <= self._indentLev]
+
+    ## tracking of local variables, see the 'useLocalVarFastPath' setting
+
+    def addLocalVars(self, target):
+        """Records the names bound by assigning to target, e.g. 'x' or
+        'k, v', as local variables for the rest of the current block.
+        Targets that aren't just names, e.g. 'a.b' or 'a[0]', are ignored.
+        """
+        if not _assignmentTargetRE.match(target):
+            return
+        for name in _identifierRE.findall(target):
+            self._localVars.append((self._indentLev, name))
+
+    def delLocalVars(self, target):
+        names = _identifierRE.findall(target)
+        self._localVars = [(indentLev, name) for indentLev, name in self._localVars
+                           if name not in names]
+
+    def isLocalVar(self, name):
+        for indentLev, localName in reversed(self._localVars):
+            if localName is None:
+                # the enclosing method's locals aren't visible to
+                # NameMapper within a closure
+                return False
+            elif localName == name:
+                return True
+        return False
+
+    ## profiling, see the 'profileRendering' setting
+
+    def isProfiled(self):
+        """Does the generated method set up the _profiler local?
+        """
+        return False
+
+    def _profileKey(self, kind, name, lineCol=None):
+        source = self._classCompiler._fileName or self._classCompiler.className()
+        line, col = lineCol or (None, None)
+        return repr((source, kind, name, line, col))
 
     ## methods for final code wrapping
 
@@ -397,8 +708,15 @@ class MethodCompiler(GenUtils):
     def appendToPrevChunk(self, appendage):
         self._methodBodyChunks[-1] = self._methodBodyChunks[-1] + appendage
 
+    def _addStreamPoint(self, kind='write'):
+        """Marks the chunk just added as a point where the streaming version
+        of this method can yield output.  See AutoMethodCompiler.
+        """
+        self._streamPoints.append((len(self._methodBodyChunks)-1, kind))
+
     def addWriteChunk(self, chunk):
         self.addChunk('write(' + chunk + ')')
+        self._addStreamPoint()
 
     def addFilteredChunk(self, chunk, filterArgs=None, rawExpr=None, lineCol=None):
         if filterArgs is None:
@@ -406,7 +724,17 @@ class MethodCompiler(GenUtils):
         if self.setting('includeRawExprInFilterArgs') and rawExpr:
             filterArgs += ', rawExpr=%s'%repr(rawExpr)
 
-        if self.setting('alwaysFilterNone'):
+        isConstant, val = self._foldExpr(chunk)
+        if isConstant:
+            chunk = repr(val)
+        if isConstant and val is not None:
+            # no need to check for None
+            if self.setting('useFilters'):
+                self.addChunk("write(%s)"%self._encodeChunk(
+                    "_filter(%s%s)"%(chunk, filterArgs)))
+            else:
+                self.addChunk("write(str(%s))"%chunk)
+        elif self.setting('alwaysFilterNone') or self.setting('asyncPlaceholders'):
             if rawExpr and rawExpr.find('\n')==-1 and rawExpr.find('\r')==-1:
                 self.addChunk("_v = %s # %r"%(chunk, rawExpr))
                 if lineCol:
@@ -414,15 +742,53 @@ class MethodCompiler(GenUtils):
             else:
                 self.addChunk("_v = %s"%chunk)
                 
-            if self.setting('useFilters'):
-                self.addChunk("if _v is not None: write(_filter(_v%s))"%filterArgs)
+            if self.setting('asyncPlaceholders'):
+                self._addDeferrableWrite(filterArgs)
+            elif self.setting('useFilters'):
+                self.addChunk("if _v is not None: write(%s)"%self._encodeChunk(
+                    "_filter(_v%s)"%filterArgs))
             else:
                 self.addChunk("if _v is not None: write(str(_v))")
         else:
             if self.setting('useFilters'):
-                self.addChunk("write(_filter(%s%s))"%(chunk, filterArgs))
+                self.addChunk("write(%s)"%self._encodeChunk(
+                    "_filter(%s%s)"%(chunk, filterArgs)))
             else:
                 self.addChunk("write(str(%s))"%chunk)
+        self._addStreamPoint()
+
+    def _addDeferrableWrite(self, filterArgs):
+        """Writes _v, or a DeferredChunk for it if it's an awaitable, see the
+        'asyncPlaceholders' setting.  The filter is bound as a default
+        argument as _filter can be changed by a later #filter.
+        """
+        if self.setting('useFilters'):
+            filtered = self._encodeChunk('_filter(_v%s)' % filterArgs)
+            args = '_v, _filter=_filter'
+            if self.setting('outputEncoding'):
+                args += ', _encode=_encode'
+        else:
+            filtered = 'str(_v)'
+            args = '_v'
+        write = ('write(isAwaitable(_v) and DeferredChunk(_v, lambda %s: %s) or %s)'
+                 % (args, filtered, filtered))
+        if self.setting('alwaysFilterNone'):
+            write = 'if _v is not None: ' + write
+        self.addChunk(write)
+
+    def _encodeChunk(self, chunk):
+        """Wraps the code for a filtered value so it's encoded as it's written,
+        see the 'outputEncoding' setting.
+        """
+        if self.setting('outputEncoding'):
+            return '_encode(' + chunk + ')'
+        return chunk
+
+    def _newTransactionCode(self):
+        outputEncoding = self.setting('outputEncoding')
+        if outputEncoding:
+            return 'DummyTransaction(encoding=%r)' % outputEncoding
+        return 'DummyTransaction()'
 
     def _appendToPrevStrConst(self, strConst):
         if self._pendingStrConstChunks:
@@ -441,24 +807,83 @@ class MethodCompiler(GenUtils):
         self._pendingStrConstChunks = []
         if not strConst:
             return
+        outputEncoding = self.setting('outputEncoding')
+        if outputEncoding and isinstance(strConst, unicode):
+            strConst = strConst.encode(outputEncoding)
 
-        reprstr = repr(strConst)
-        i = 0
-        out = []
-        if reprstr.startswith('u'):
-            i = 1
-            out = ['u']
-        body = escapedNewlineRE.sub('\\1\n', reprstr[i+1:-1])
-        
-        if reprstr[i]=="'":
-            out.append("'''")
-            out.append(body)
-            out.append("'''")
-        else:
-            out.append('"""')
-            out.append(body)
-            out.append('"""')
-        self.addWriteChunk(''.join(out))
+        self.addWriteChunk(_strConstLiteral(strConst))
+        index = len(self._methodBodyChunks)-1
+        self._strConstChunks[index] = (strConst, self._methodBodyChunks[index])
+
+    ## compile-time optimizations, see the 'optimizeGeneratedCode' setting
+
+    def _foldExpr(self, expr):
+        if not self.setting('optimizeGeneratedCode'):
+            return False, None
+        return _foldConstantExpr(expr)
+
+    def _foldCondition(self, expr):
+        """Replaces a constant #if/#elif/#while condition with 1 or 0.  The
+        Python compiler drops the code for a branch that can't be taken and
+        the test for one that always is.
+        """
+        match = _constantConditionRE.match(expr.strip())
+        if match:
+            isConstant, val = self._foldExpr(match.group(2))
+            if isConstant:
+                return '%s %d' % (match.group(1), bool(val))
+        return expr
+
+    def _optimizeMethodBody(self):
+        """Merges the write() calls for static text that are only separated
+        by comments or blank lines, e.g. from ## comments or #slurp, and moves
+        long static text into module constants.
+        """
+        if not self.setting('optimizeGeneratedCode'):
+            return
+        chunks = self._methodBodyChunks
+        strConstChunks = self._strConstChunks
+        newChunks = []
+        newStrConsts = {} # index in newChunks -> strConst
+        indexMap = {}
+        lastStrConstIndex = None
+        for i, chunk in enumerate(chunks):
+            if i in strConstChunks and strConstChunks[i][1] == chunk:
+                strConst = strConstChunks[i][0]
+                if lastStrConstIndex is not None:
+                    prevChunk = newChunks[lastStrConstIndex]
+                    indent = chunk[:len(chunk) - len(chunk[1:].lstrip())]
+                    if prevChunk.startswith(indent + 'write('):
+                        strConst = newStrConsts[lastStrConstIndex] + strConst
+                        newStrConsts[lastStrConstIndex] = strConst
+                        newChunks[lastStrConstIndex] = (
+                            indent + 'write(' + _strConstLiteral(strConst) + ')')
+                        indexMap[i] = lastStrConstIndex
+                        continue
+                lastStrConstIndex = len(newChunks)
+                newStrConsts[lastStrConstIndex] = strConst
+            elif chunk.strip() and not chunk.strip().startswith('#'):
+                lastStrConstIndex = None
+            indexMap[i] = len(newChunks)
+            newChunks.append(chunk)
+
+        minLength = self.setting('hoistStrConstsLongerThan')
+        if minLength is not None:
+            for index, strConst in newStrConsts.items():
+                if len(strConst) > minLength:
+                    chunk = newChunks[index]
+                    indent = chunk[:len(chunk) - len(chunk[1:].lstrip())]
+                    name = self._moduleCompiler.addStrConstant(strConst)
+                    newChunks[index] = indent + 'write(' + name + ')'
+
+        streamPoints = []
+        for index, kind in self._streamPoints:
+            point = (indexMap[index], kind)
+            if point not in streamPoints:
+                streamPoints.append(point)
+        self._methodBodyChunks = newChunks
+        self._streamPoints = streamPoints
+        self._strConstChunks = {}
 
     def handleWSBeforeDirective(self):
         """Truncate the pending strCont to the beginning of the current line.
@@ -494,7 +919,15 @@ class MethodCompiler(GenUtils):
     def addPlaceholder(self, expr, filterArgs, rawPlaceholder,
                        cacheTokenParts, lineCol,
                        silentMode=False):
+        isProfiled = self.setting('profilePlaceholders') and self.isProfiled()
+        if isProfiled:
+            self.addChunk('_profStart = profileTimer()')
+            numStreamPoints = len(self._streamPoints)
+
         cacheInfo = self.genCacheInfo(cacheTokenParts)
+        if cacheInfo and self._foldExpr(expr)[0]:
+            # there's nothing to gain from caching a constant
+            cacheInfo = None
         if cacheInfo:
             cacheInfo['ID'] = repr(rawPlaceholder)[1:-1]
             self.startCacheRegion(cacheInfo, lineCol, rawPlaceholder=rawPlaceholder)
@@ -518,6 +951,15 @@ class MethodCompiler(GenUtils):
         if cacheInfo:
             self.endCacheRegion()
 
+        if isProfiled:
+            self.addChunk('_profiler.record(%s, profileTimer() - _profStart)'
+                          % self._profileKey('placeholder', rawPlaceholder, lineCol))
+            if len(self._streamPoints) > numStreamPoints:
+                # don't count the time the output is held by a streaming
+                # consumer
+                self._streamPoints[-1] = (len(self._methodBodyChunks)-1,
+                                          self._streamPoints[-1][1])
+
     def addSilent(self, expr):
         self.addChunk( expr )
 
@@ -548,22 +990,42 @@ class MethodCompiler(GenUtils):
             LVALUE = 'self._CHEETAH__globalSetVars["' + primary + '"]' + secondary
             expr = LVALUE + ' ' + OP + ' ' + RVALUE.strip()
 
+        else:
+            LVALUE, OP, RVALUE = (exprComponents.LVALUE,
+                                  exprComponents.OP,
+                                  exprComponents.RVALUE)
+            isConstant, val = self._foldExpr(RVALUE)
+            # expressionFilterHooks might have changed expr
+            if isConstant and expr == LVALUE + ' ' + OP + ' ' + RVALUE.strip():
+                expr = LVALUE + ' ' + OP + ' ' + repr(val)
+
         if setStyle is SET_MODULE:
             self._moduleCompiler.addModuleGlobal(expr)
         else:
             self.addChunk(expr)
+            if setStyle is SET_LOCAL:
+                self.addLocalVars(exprComponents.LVALUE)
 
-    def addInclude(self, sourceExpr, includeFrom, isRaw):
+    def addInclude(self, sourceExpr, includeFrom, isRaw, lineCol=None, rawExpr=None):
+        isProfiled = self.setting('profileRendering') and self.isProfiled()
+        if isProfiled:
+            self.addChunk('_profStart = profileTimer()')
         self.addChunk('self._handleCheetahInclude(' + sourceExpr +
                            ', trans=trans, ' +
                            'includeFrom="' + includeFrom + '", raw=' +
                            repr(isRaw) + ')')
+        if isProfiled:
+            self.addChunk('_profiler.record(%s, profileTimer() - _profStart)'
+                          % self._profileKey('include', rawExpr or sourceExpr, lineCol))
 
     def addWhile(self, expr, lineCol=None):
         self.addIndentingDirective(expr, lineCol=lineCol)
         
     def addFor(self, expr, lineCol=None):
         self.addIndentingDirective(expr, lineCol=lineCol)
+        match = _forTargetRE.match(expr.strip())
+        if match:
+            self.addLocalVars(match.group(1))
 
     def addRepeat(self, expr, lineCol=None):
         #the _repeatCount stuff here allows nesting of #repeat directives        
@@ -571,6 +1033,7 @@ class MethodCompiler(GenUtils):
         self.addFor('for __i%s in range(%s)' % (self._repeatCount, expr), lineCol=lineCol)
 
     def addIndentingDirective(self, expr, lineCol=None):
+        expr = self._foldCondition(expr)
         if expr and not expr[-1] == ':':
             expr = expr  + ':'
         self.addChunk( expr )
@@ -582,6 +1045,7 @@ class MethodCompiler(GenUtils):
         self.commitStrConst()
         if dedent:
             self.dedent()
+        expr = self._foldCondition(expr)
         if not expr[-1] == ':':
             expr = expr  + ':'
             
@@ -604,6 +1068,12 @@ class MethodCompiler(GenUtils):
         """For a single-lie #if ... then .... else ... directive
         <condition> then <trueExpr> else <falseExpr>
         """
+        match = _constantConditionRE.match(conditionExpr.strip())
+        if match and match.group(1) == 'if':
+            isConstant, val = self._foldExpr(match.group(2))
+            if isConstant:
+                self.addFilteredChunk(val and trueExpr or falseExpr)
+                return
         self.addIndentingDirective(conditionExpr, lineCol=lineCol)            
         self.addFilteredChunk(trueExpr)
         self.dedent()
@@ -629,7 +1099,12 @@ class MethodCompiler(GenUtils):
                 chunk += '=' + arg[1]
             argStringChunks.append(chunk)
         signature = "def " + functionName + "(" + ','.join(argStringChunks) + "):"
+        self.addLocalVars(functionName)
         self.addIndentingDirective(signature)
+        self._hasClosures = True
+        self._localVars.append((self._indentLev, None))
+        for arg in argsList:
+            self.addLocalVars(arg[0].replace('*', ''))
         self.addChunk('#'+parserComment)
 
     def addTry(self, expr, lineCol=None):
@@ -655,7 +1130,7 @@ class MethodCompiler(GenUtils):
             self.addChunk('if _dummyTrans:')
             self.indent()
             self.addChunk('yield trans.response().getvalue()')
-            self.addChunk('trans = DummyTransaction()')
+            self.addChunk('trans = ' + self._newTransactionCode())
             self.addChunk('write = trans.response().write')
             self.dedent()
             self.addChunk('else:')
@@ -669,6 +1144,7 @@ class MethodCompiler(GenUtils):
         self.addChunk(expr)
 
     def addDel(self, expr):
+        self.delLocalVars(expr)
         self.addChunk(expr)
 
     def addAssert(self, expr):
@@ -689,7 +1165,7 @@ class MethodCompiler(GenUtils):
         if PSP[0] == '=':
             PSP = PSP[1:]
             if PSP:
-                self.addWriteChunk('_filter(' + PSP + ')')
+                self.addWriteChunk(self._encodeChunk('_filter(' + PSP + ')'))
             return
                     
         elif PSP.lower() == 'end':
@@ -722,6 +1198,11 @@ class MethodCompiler(GenUtils):
         if customID:
             ID = customID
         varyBy = cacheInfo.get('varyBy', repr(ID))
+        stale = cacheInfo.get('stale', None)
+        jitter = cacheInfo.get('jitter', None)
+        leaseTime = cacheInfo.get('lock', None)
+        if stale and not leaseTime:
+            leaseTime = DEFAULT_CACHE_LEASE_TIME
         self._cacheRegionsStack.append(ID) # attrib of current methodCompiler
 
         # @@TR: add this to a special class var as well
@@ -754,49 +1235,123 @@ class MethodCompiler(GenUtils):
             self.addChunk('_RECACHE_%(ID)s = True'%locals())
             self.dedent()
 
-        self.addChunk('if (not _RECACHE_%(ID)s) and _cacheItem_%(ID)s.getRefreshTime():'%locals())
+        if leaseTime:
+            self._startLeasedCacheRegion(ID, leaseTime)
+        else:
+            self.addChunk('if (not _RECACHE_%(ID)s) and _cacheItem_%(ID)s.getRefreshTime():'%locals())
+            self.indent()
+            #self.addChunk('print "DEBUG"+"-"*50')
+            self.addChunk('try:')
+            self.indent()
+            self.addChunk('_output = _cacheItem_%(ID)s.renderOutput()'%locals())        
+            self.dedent()                
+            self.addChunk('except KeyError:')
+            self.indent()
+            self.addChunk('_RECACHE_%(ID)s = True'%locals())
+            #self.addChunk('print "DEBUG"+"*"*50')
+            self.dedent()                
+            self.addChunk('else:')
+            self.indent()
+            self.addWriteChunk('_output')
+            self.addChunk('del _output')
+            self.dedent()                
+
+            self.dedent()                
+
+            self.addChunk('if _RECACHE_%(ID)s or not _cacheItem_%(ID)s.getRefreshTime():'%locals())
+            self.indent()
+        self.addChunk('trans = self._pushOutputBuffer(%s)'
+                      % self._pushOutputBufferArgs(setBuffering=False))
+        self.addChunk('write = trans.write')
+        if interval and jitter:
+            self.addChunk('_cacheItem_%(ID)s.setExpiryInterval(%(interval)r, %(jitter)r)'%locals())
+        elif interval:
+            self.addChunk(("_cacheItem_%(ID)s.setExpiryTime(currentTime() +"%locals())
+                          + str(interval) + ")")
+        if stale:
+            self.addChunk('_cacheItem_%(ID)s.setStaleTime(%(stale)r)'%locals())
+        if leaseTime:
+            self.addChunk('try:')
+            self.indent()
+
+    def _startLeasedCacheRegion(self, ID, leaseTime):
+        """Only the renderer that gets the item's lease refreshes it.  The
+        others serve the stale data if there is some or wait for the new data.
+        """
+        self._leasedCacheRegions.add(ID)
+        self.addChunk('_lease_%(ID)s = None'%locals())
+        self.addChunk('_output = None')
+        self.addChunk('if not _RECACHE_%(ID)s:'%locals())
         self.indent()
-        #self.addChunk('print "DEBUG"+"-"*50')
-        self.addChunk('try:')
+        self.addChunk('_output = _cacheItem_%(ID)s.lookupOutput()'%locals())
+        self.dedent()
+        self.addChunk('if _output is None:')
         self.indent()
-        self.addChunk('_output = _cacheItem_%(ID)s.renderOutput()'%locals())        
-        self.dedent()                
-        self.addChunk('except KeyError:')
+        self.addChunk('_lease_%(ID)s = _cacheItem_%(ID)s.acquireLease(%(leaseTime)r)'%locals())
+        self.addChunk('if _lease_%(ID)s is None:'%locals())
         self.indent()
-        self.addChunk('_RECACHE_%(ID)s = True'%locals())
-        #self.addChunk('print "DEBUG"+"*"*50')
-        self.dedent()                
-        self.addChunk('else:')
+        self.addChunk('_output = _cacheItem_%(ID)s.waitForOutput(%(leaseTime)r)'%locals())
+        self.dedent()
+        self.dedent()
+        self.addChunk('if _output is not None:')
         self.indent()
         self.addWriteChunk('_output')
         self.addChunk('del _output')
-        self.dedent()                
-
-        self.dedent()                
-
-        self.addChunk('if _RECACHE_%(ID)s or not _cacheItem_%(ID)s.getRefreshTime():'%locals())
+        self.dedent()
+        self.addChunk('else:')
         self.indent()
-        self.addChunk('_orig_trans%(ID)s = trans'%locals())
-        self.addChunk('trans = _cacheCollector_%(ID)s = DummyTransaction()'%locals())
-        self.addChunk('write = _cacheCollector_%(ID)s.response().write'%locals())
-        if interval:
-            self.addChunk(("_cacheItem_%(ID)s.setExpiryTime(currentTime() +"%locals())
-                          + str(interval) + ")")
-        
+        self.addChunk('del _output')
+
     def endCacheRegion(self):
         ID = self._cacheRegionsStack.pop()
-        self.addChunk('trans = _orig_trans%(ID)s'%locals())
+        self.addChunk('_cacheData, trans = self._popOutputBuffer(trans)')
         self.addChunk('write = trans.response().write')
-        self.addChunk('_cacheData = _cacheCollector_%(ID)s.response().getvalue()'%locals())
-        self.addChunk('_cacheItem_%(ID)s.setData(_cacheData)'%locals())
-        self.addWriteChunk('_cacheData')
+        if self.setting('asyncPlaceholders'):
+            # the output can only be stored once its awaitables are done,
+            # and the lease is then handed over to the DeferredChunk
+            self.addChunk('if isAwaitable(_cacheData):')
+            self.indent()
+            if ID in self._leasedCacheRegions:
+                self.addChunk(('write(DeferredChunk(_cacheData, lambda _v,'
+                               ' _lease=_lease_%(ID)s:'
+                               ' _cacheItem_%(ID)s.storeDeferredData(_v, _lease)))')
+                              %locals())
+                self.addChunk('_lease_%(ID)s = None'%locals())
+            else:
+                self.addChunk(('write(DeferredChunk(_cacheData,'
+                               ' _cacheItem_%(ID)s.storeDeferredData))')%locals())
+            self.dedent()
+            self.addChunk('else:')
+            self.indent()
+            self.addChunk('_cacheItem_%(ID)s.setData(_cacheData)'%locals())
+            self.addWriteChunk('_cacheData')
+            self.dedent()
+        else:
+            self.addChunk('_cacheItem_%(ID)s.setData(_cacheData)'%locals())
+            self.addWriteChunk('_cacheData')
         self.addChunk('del _cacheData')        
-        self.addChunk('del _cacheCollector_%(ID)s'%locals())
-        self.addChunk('del _orig_trans%(ID)s'%locals())
+        if ID in self._leasedCacheRegions:
+            self._leasedCacheRegions.remove(ID)
+            self.dedent()
+            self.addChunk('finally:')
+            self.indent()
+            self.addChunk('if _lease_%(ID)s is not None:'%locals())
+            self.indent()
+            self.addChunk('_cacheItem_%(ID)s.releaseLease(_lease_%(ID)s)'%locals())
+            self.dedent()
+            self.dedent()
         self.dedent()
         self.addChunk('## END CACHE REGION: '+ID)
         self.addChunk('')
 
+    def _pushOutputBufferArgs(self, setBuffering=True):
+        args = ['trans']
+        if not setBuffering:
+            args.append('setBuffering=False')
+        if self.setting('outputEncoding'):
+            args.append('encoding=%r' % self.setting('outputEncoding'))
+        return ', '.join(args)
+
     def nextCallRegionID(self):
         return self.nextCacheID()
 
@@ -815,11 +1370,9 @@ class MethodCompiler(GenUtils):
                       +ID
                       +' of '+functionName
                       +' at line %s, col %s'%lineCol + ' in the source.')
-        self.addChunk('_orig_trans%(ID)s = trans'%locals())
-        self.addChunk('_wasBuffering%(ID)s = self._CHEETAH__isBuffering'%locals())
-        self.addChunk('self._CHEETAH__isBuffering = True')
-        self.addChunk('trans = _callCollector%(ID)s = DummyTransaction()'%locals())
-        self.addChunk('write = _callCollector%(ID)s.response().write'%locals())
+        self.addChunk('trans = self._pushOutputBuffer(%s)'
+                      % self._pushOutputBufferArgs())
+        self.addChunk('write = trans.write')
 
     def setCallArg(self, argName, lineCol):
         ID, callDetails = self._callRegionsStack[-1]
@@ -835,38 +1388,34 @@ class MethodCompiler(GenUtils):
     def _endCallArg(self):
         ID, callDetails = self._callRegionsStack[-1]
         currCallArg = callDetails.currentArgname
-        self.addChunk(('_callKws%(ID)s[%(currCallArg)r] ='
-                       ' _callCollector%(ID)s.response().getvalue()')%locals())
-        self.addChunk('del _callCollector%(ID)s'%locals())
-        self.addChunk('trans = _callCollector%(ID)s = DummyTransaction()'%locals())
-        self.addChunk('write = _callCollector%(ID)s.response().write'%locals())
+        self.addChunk('_callKws%(ID)s[%(currCallArg)r] = trans.popvalue()'%locals())
     
     def endCallRegion(self, regionTitle='CALL'):
         ID, callDetails = self._callRegionsStack[-1]
         functionName, initialKwArgs, lineCol = (
             callDetails.functionName, callDetails.args, callDetails.lineCol)
 
-        def reset(ID=ID):
-            self.addChunk('trans = _orig_trans%(ID)s'%locals())
-            self.addChunk('write = trans.response().write')
-            self.addChunk('self._CHEETAH__isBuffering = _wasBuffering%(ID)s '%locals())
-            self.addChunk('del _wasBuffering%(ID)s'%locals())
-            self.addChunk('del _orig_trans%(ID)s'%locals())
-
         if not callDetails.usesKeywordArgs:
-            reset()
-            self.addChunk('_callArgVal%(ID)s = _callCollector%(ID)s.response().getvalue()'%locals())
-            self.addChunk('del _callCollector%(ID)s'%locals())
+            self.addChunk('_callArgVal%(ID)s, trans = self._popOutputBuffer(trans)'%locals())
+            self.addChunk('write = trans.response().write')
             if initialKwArgs:
                 initialKwArgs = ', '+initialKwArgs           
-            self.addFilteredChunk('%(functionName)s(_callArgVal%(ID)s%(initialKwArgs)s)'%locals())
+            if self.setting('asyncPlaceholders'):
+                self.addFilteredChunk('callWhenDone(%(functionName)s, _callArgVal%(ID)s%(initialKwArgs)s)'%locals())
+            else:
+                self.addFilteredChunk('%(functionName)s(_callArgVal%(ID)s%(initialKwArgs)s)'%locals())
             self.addChunk('del _callArgVal%(ID)s'%locals())
         else:
             if initialKwArgs:
                 initialKwArgs = initialKwArgs+', '
-            self._endCallArg()
-            reset()
-            self.addFilteredChunk('%(functionName)s(%(initialKwArgs)s**_callKws%(ID)s)'%locals())
+            currCallArg = callDetails.currentArgname
+            self.addChunk(('_callKws%(ID)s[%(currCallArg)r], trans ='
+                           ' self._popOutputBuffer(trans)')%locals())
+            self.addChunk('write = trans.response().write')
+            if self.setting('asyncPlaceholders'):
+                self.addFilteredChunk('callWhenDone(%(functionName)s, %(initialKwArgs)s**_callKws%(ID)s)'%locals())
+            else:
+                self.addFilteredChunk('%(functionName)s(%(initialKwArgs)s**_callKws%(ID)s)'%locals())
             self.addChunk('del _callKws%(ID)s'%locals())
         self.addChunk('## END %(regionTitle)s REGION: '%locals()
                       +ID
@@ -889,22 +1438,18 @@ class MethodCompiler(GenUtils):
         self.addChunk('## START CAPTURE REGION: '+ID
                       +' '+assignTo
                       +' at line %s, col %s'%lineCol + ' in the source.')
-        self.addChunk('_orig_trans%(ID)s = trans'%locals())
-        self.addChunk('_wasBuffering%(ID)s = self._CHEETAH__isBuffering'%locals())
-        self.addChunk('self._CHEETAH__isBuffering = True')
-        self.addChunk('trans = _captureCollector%(ID)s = DummyTransaction()'%locals())
-        self.addChunk('write = _captureCollector%(ID)s.response().write'%locals())
+        self.addChunk('trans = self._pushOutputBuffer(%s)'
+                      % self._pushOutputBufferArgs())
+        self.addChunk('write = trans.write')
 
     def endCaptureRegion(self):
         ID, captureDetails = self._captureRegionsStack.pop()
         assignTo, lineCol = (captureDetails.assignTo, captureDetails.lineCol)
-        self.addChunk('trans = _orig_trans%(ID)s'%locals())
+        self.addChunk('_captured%(ID)s, trans = self._popOutputBuffer(trans)'%locals())
         self.addChunk('write = trans.response().write')
-        self.addChunk('self._CHEETAH__isBuffering = _wasBuffering%(ID)s '%locals())
-        self.addChunk('%(assignTo)s = _captureCollector%(ID)s.response().getvalue()'%locals())
-        self.addChunk('del _orig_trans%(ID)s'%locals())
-        self.addChunk('del _captureCollector%(ID)s'%locals())
-        self.addChunk('del _wasBuffering%(ID)s'%locals())
+        self.addChunk('%(assignTo)s = _captured%(ID)s'%locals())
+        self.addLocalVars(assignTo)
+        self.addChunk('del _captured%(ID)s'%locals())
         
     def setErrorCatcher(self, errorCatcherName):
         self.turnErrorCatcherOn()        
@@ -975,6 +1520,18 @@ class AutoMethodCompiler(MethodCompiler):
         self._streamingEnabled = True
         self._isClassMethod = None
         self._isStaticMethod = None
+        # settings can change while the method is compiled, so this is
+        # decided up front
+        self._isProfiled = ((self.setting('profileRendering')
+                             or self.setting('profilePlaceholders'))
+                            and not self.isClassMethod()
+                            and not self.isStaticMethod())
+        self._isTimed = self._isProfiled and self.setting('profileRendering')
+        if self._isProfiled:
+            self._moduleCompiler.addProfileTimerImport()
+        if self._isTimed:
+            # leave room for the try: that wraps the body, see cleanupState()
+            self.indent()
 
     def _useKWsDictArgForPassingTrans(self):
         alreadyHasTransArg = [argname for argname, defval in self._argStringList
@@ -992,6 +1549,9 @@ class AutoMethodCompiler(MethodCompiler):
         if self._isStaticMethod is None:
             self._isStaticMethod = '@staticmethod' in self._decorators
         return self._isStaticMethod
+
+    def isProfiled(self):
+        return self._isProfiled
     
     def cleanupState(self):
         MethodCompiler.cleanupState(self)
@@ -1022,12 +1582,76 @@ class AutoMethodCompiler(MethodCompiler):
                 else:
                     self._streamingEnabled = False
                 
+        self._optimizeMethodBody()
         self._indentLev = self.setting('initialMethIndentLevel')
         mainBodyChunks = self._methodBodyChunks
         self._methodBodyChunks = []
         self._addAutoSetupCode()
+        self._streamSetupIndex = len(self._methodBodyChunks)
+        if self._isTimed:
+            self.addChunk('_profMethodStart = profileTimer()')
+            self.addChunk('try:')
+            self.indent()
+        offset = len(self._methodBodyChunks)
+        self._streamPoints = [(offset + i, kind) for i, kind in self._streamPoints]
         self._methodBodyChunks.extend(mainBodyChunks)
         self._addAutoCleanupCode()
+        if self._isTimed:
+            self.dedent()
+            self.addChunk('finally:')
+            self.indent()
+            self.addChunk('_profiler.record(%s, profileTimer() - _profMethodStart)'
+                          % self._profileKey('method', self.methodName(), self._lineCol))
+            self.dedent()
+
+    def isStreamable(self):
+        """Can a generator version of this method be made by adding yields
+        after its write() calls?
+        """
+        return (self.setting('generateStreamingMethods')
+                and self._streamingEnabled
+                and not self._decorators
+                and not self._isGenerator
+                and not self._hasReturnStatement
+                and not self._hasClosures)
+
+    def streamingMethodName(self):
+        return '_CHEETAH_streaming_' + self.methodName()
+
+    def streamingMethodBody(self):
+        """Returns the body of the generator version of this method.  After
+        each write() it yields the output collected so far once the
+        StreamingResponse's flushThreshold is reached, and #stop yields the
+        remainder instead of returning it.
+        """
+        chunks = list(self._methodBodyChunks)
+        for index, kind in reversed(self._streamPoints):
+            chunk = chunks[index]
+            indent = chunk[1:len(chunk) - len(chunk[1:].lstrip())]
+            if kind == 'stop':
+                chunks[index] = (
+                    '\n' + indent + 'if _streamResponse._outputChunks:'
+                    ' yield _streamResponse.popvalue()'
+                    '\n' + indent + 'return')
+            else:
+                chunks.insert(index + 1, (
+                    '\n' + indent + 'if _streamResponse._pendingSize >='
+                    ' _streamResponse.flushThreshold:'
+                    ' yield _streamResponse.popvalue()'))
+        chunks.insert(self._streamSetupIndex,
+                      '\n' + self.indentation() + '_streamResponse = trans.response()')
+        return ''.join(chunks)
+
+    def wrapCode(self):
+        methodDef = MethodCompiler.wrapCode(self)
+        if self.isStreamable():
+            signature = self.methodSignature().replace(
+                'def ' + self.methodName() + '(',
+                'def ' + self.streamingMethodName() + '(', 1)
+            methodDef = ''.join([methodDef, '\n\n',
+                                 signature, self.streamingMethodBody()])
+            self._methodDef = methodDef
+        return methodDef
         
     def _addAutoSetupCode(self):
         if self._initialMethodComment:
@@ -1044,14 +1668,14 @@ class AutoMethodCompiler(MethodCompiler):
             self.dedent()
             self.addChunk('if not trans:')
             self.indent()
-            self.addChunk('trans = DummyTransaction()')
+            self.addChunk('trans = ' + self._newTransactionCode())
             if self.setting('autoAssignDummyTransactionToSelf'):
                 self.addChunk('self.transaction = trans')            
             self.addChunk('_dummyTrans = True')
             self.dedent()
             self.addChunk('else: _dummyTrans = False')
         else:
-            self.addChunk('trans = DummyTransaction()')
+            self.addChunk('trans = ' + self._newTransactionCode())
             self.addChunk('_dummyTrans = True')
         self.addChunk('write = trans.response().write')
         if self.setting('useNameMapper'):
@@ -1065,11 +1689,18 @@ class AutoMethodCompiler(MethodCompiler):
                 self.addChunk('SL = self._CHEETAH__searchList')                
             else:
                 self.addChunk('SL = [KWS]')
+            if self._usesNameLookupCache:
+                self.addChunk('_slotCache = {}')
         if self.setting('useFilters'):
             if self.isClassMethod() or self.isStaticMethod():
                 self.addChunk('_filter = lambda x, **kwargs: unicode(x)')
             else:
                 self.addChunk('_filter = self._CHEETAH__currentFilter')
+            if self.setting('outputEncoding'):
+                self.addChunk('_encode = outputEncoder(%r)'
+                              % self.setting('outputEncoding'))
+        if self.isProfiled():
+            self.addChunk('_profiler = self.getProfiler()')
         self.addChunk('')
         self.addChunk("#" *40)
         self.addChunk('## START - generated method body')
@@ -1087,9 +1718,11 @@ class AutoMethodCompiler(MethodCompiler):
         
     def addStop(self, expr=None):
         self.addChunk('return _dummyTrans and trans.response().getvalue() or ""')
+        self._addStreamPoint('stop')
 
     def addMethArg(self, name, defVal=None):
         self._argStringList.append( (name, defVal) )
+        self.addLocalVars(name.replace('*', ''))
         
     def methodSignature(self):
         argStringChunks = []
@@ -1205,6 +1838,13 @@ class ClassCompiler(GenUtils):
             methCompiler = self._popActiveMethodCompiler()
             self._swallowMethodCompiler(methCompiler)
         self._setupInitMethod()
+        if self.setting('shareCacheRegions'):
+            self._generatedAttribs.append('_CHEETAH_shareCacheRegions = True')
+        if self.setting('outputEncoding'):
+            self._generatedAttribs.append('_CHEETAH_outputEncoding = %r'
+                                          % self.setting('outputEncoding'))
+        if self.setting('asyncPlaceholders'):
+            self._generatedAttribs.append('_CHEETAH_asyncPlaceholders = True')
         if self._mainMethodName == 'respond':
             if self.setting('setup__str__method'):
                 self._generatedAttribs.append('def __str__(self): return self.respond()')
@@ -1303,9 +1943,10 @@ class ClassCompiler(GenUtils):
             self._finishedMethodsList.insert(pos, methodCompiler)
         return methodCompiler
 
-    def startMethodDef(self, methodName, argsList, parserComment):
+    def startMethodDef(self, methodName, argsList, parserComment, lineCol=None):
         methodCompiler = self._spawnMethodCompiler(
             methodName, initialMethodComment=parserComment)
+        methodCompiler._lineCol = lineCol
         self._setActiveMethodCompiler(methodCompiler)        
         for argName, defVal in argsList:
             methodCompiler.addMethArg(argName, defVal)
@@ -1330,7 +1971,8 @@ class ClassCompiler(GenUtils):
     def addAttribute(self, attribExpr):
         ## first test to make sure that the user hasn't used any fancy Cheetah syntax
         #  (placeholders, directives, etc.) inside the expression 
-        if attribExpr.find('VFN(') != -1 or attribExpr.find('VFFSL(') != -1:
+        if (attribExpr.find('VFN(') != -1 or attribExpr.find('VFFSL(') != -1
+            or attribExpr.find('VFFSLC(') != -1):
             raise ParseError(self,
                              'Invalid #attr directive.' +
                              ' It should only contain simple Python literals.')
@@ -1623,26 +2265,9 @@ class ModuleCompiler(SettingsManager, GenUtils):
         self._moduleHeaderLines = []
         self._moduleDocStringLines = []
         self._specialVars = {}
-        self._importStatements = [
-            "import sys",
-            "import os",
-            "import os.path",
-            'try:',
-            '    import builtins as builtin',
-            'except ImportError:',
-            '    import __builtin__ as builtin',
-            "from os.path import getmtime, exists",
-            "import time",
-            "import types",
-            "from Cheetah.Version import MinCompatibleVersion as RequiredCheetahVersion",            
-            "from Cheetah.Version import MinCompatibleVersionTuple as RequiredCheetahVersionTuple",
-            "from Cheetah.Template import Template",
-            "from Cheetah.DummyTransaction import *",
-            "from Cheetah.NameMapper import NotFound, valueForName, valueFromSearchList, valueFromFrameOrSearchList",
-            "from Cheetah.CacheRegion import CacheRegion",
-            "import Cheetah.Filters as Filters",
-            "import Cheetah.ErrorCatchers as ErrorCatchers",
-            ]        
+        self._importStatements = [statement
+                                  for statements, names in _DEFAULT_IMPORTS
+                                  for statement in statements]
 
         self._importedVarNames = ['sys',
                                   'os',
@@ -1657,12 +2282,8 @@ class ModuleCompiler(SettingsManager, GenUtils):
                                   'CacheRegion',
                                   ]
         
-        self._moduleConstants = [
-            "VFFSL=valueFromFrameOrSearchList",
-            "VFSL=valueFromSearchList",
-            "VFN=valueForName",
-            "currentTime=time.time",
-            ]
+        self._strConstantNames = {}
+        self._moduleConstants = list(_DEFAULT_MODULE_CONSTANTS)
         
     def compile(self):
         classCompiler = self._spawnClassCompiler(self._mainClassName)            
@@ -1821,6 +2442,11 @@ class ModuleCompiler(SettingsManager, GenUtils):
         """
         self._moduleDocStringLines.append(line)
 
+    def addProfileTimerImport(self):
+        impStatement = 'from Cheetah.Profiler import timer as profileTimer'
+        if impStatement not in self._importStatements:
+            self._importStatements.append(impStatement)
+
     def addModuleGlobal(self, line):
         """Adds a line of global module code.  It is inserted after the import
         statements and Cheetah default module constants.
@@ -1848,6 +2474,17 @@ class ModuleCompiler(SettingsManager, GenUtils):
 
     def addAttribute(self, attribName, expr):
         self._getActiveClassCompiler().addAttribute(attribName + ' =' + expr)
+
+    def addStrConstant(self, strConst):
+        """Adds a module constant for the static text strConst, or reuses the
+        one added for identical text, and returns its name.
+        """
+        name = self._strConstantNames.get(strConst)
+        if name is None:
+            name = '_CHEETAH_strConst%d' % (len(self._strConstantNames) + 1)
+            self._strConstantNames[strConst] = name
+            self._moduleConstants.append(name + ' = ' + _strConstLiteral(strConst))
+        return name
         
     def addComment(self, comm):
         if re.match(r'#+$', comm):      # skip bar comments
@@ -1907,7 +2544,26 @@ class ModuleCompiler(SettingsManager, GenUtils):
             self.addModuleGlobal('__CHEETAH_src__ = None')
             self.addModuleGlobal('__CHEETAH_srcLastModified__ = None')            
 
-        moduleDef = """%(header)s
+        parts = {'header': self.moduleHeader(),
+                 'docstring': self.moduleDocstring(),
+                 'specialVars': self.specialVars(),
+                 'imports': self.importStatements(),
+                 'constants': self.moduleConstants(),
+                 'classes': self.classDefs(),
+                 'footer': self.moduleFooter(),
+                 'mainClassName': self._mainClassName,
+                 }
+        if self.setting('lazyImports'):
+            imports, constants = self._usedImportsAndConstants(
+                self._moduleDefTemplate % dict(parts, imports='', constants=''))
+            parts['imports'] = '\n'.join(imports)
+            parts['constants'] = '\n'.join(constants)
+        moduleDef = self._moduleDefTemplate % parts
+       
+        self._moduleDef = moduleDef
+        return moduleDef
+
+    _moduleDefTemplate = """%(header)s
 %(docstring)s
 
 ##################################################
@@ -1937,18 +2593,40 @@ if not hasattr(%(mainClassName)s, '_initCheetahAttributes'):
     templateAPIClass._addCheetahPlumbingCodeToClass(%(mainClassName)s)
 
 %(footer)s
-""" %   {'header': self.moduleHeader(),
-         'docstring': self.moduleDocstring(),
-         'specialVars': self.specialVars(),
-         'imports': self.importStatements(),
-         'constants': self.moduleConstants(),
-         'classes': self.classDefs(),
-         'footer': self.moduleFooter(),
-         'mainClassName': self._mainClassName,
-         }
-       
-        self._moduleDef = moduleDef
-        return moduleDef
+"""
+
+    def _usedImportsAndConstants(self, moduleDef):
+        """For the 'lazyImports' setting: returns the import statements and
+        module constants, without the default ones that bind names that aren't
+        used in moduleDef or in the other module constants.
+        """
+        numDefaultConstants = len(_DEFAULT_MODULE_CONSTANTS)
+        usedNames = set(_nameRE.findall(moduleDef))
+        for line in self._moduleConstants[numDefaultConstants:]:
+            usedNames.update(_nameRE.findall(line))
+
+        constants = []
+        for line in self._moduleConstants[:numDefaultConstants]:
+            name, value = line.split('=', 1)
+            if name in usedNames:
+                constants.append(line)
+                usedNames.update(_nameRE.findall(value))
+        constants.extend(self._moduleConstants[numDefaultConstants:])
+
+        imports = []
+        for statements, names in _DEFAULT_IMPORTS:
+            if isinstance(names, str) and names.startswith('*'):
+                # the public names of a module imported with *
+                module = __import__(names[1:], {}, {}, ['*'])
+                names = [name for name in dir(module)
+                         if not name.startswith('_')]
+            if names is None or usedNames.intersection(names):
+                imports.extend(statements)
+        numDefaultImports = len([statement
+                                 for statements, names in _DEFAULT_IMPORTS
+                                 for statement in statements])
+        imports.extend(self._importStatements[numDefaultImports:])
+        return imports, constants
 
     def timestamp(self, theTime=None):
         if not theTime:
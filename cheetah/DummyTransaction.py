@@ -9,7 +9,16 @@ specific DummyTransaction or DummyResponse behavior
 '''
 
 import logging
+import sys
 import types
+try:
+    from threading import Lock
+except ImportError:
+    class Lock:
+        def acquire(self):
+            pass
+        def release(self):
+            pass
 
 class DummyResponseFailure(Exception):
     pass
@@ -19,9 +28,14 @@ class DummyResponse(object):
         A dummy Response class is used by Cheetah in place of real Webware
         Response objects when the Template obj is not used directly as a Webware
         servlet
+
+        If an encoding is given the response collects byte strings, as written
+        by templates compiled with the 'outputEncoding' setting, and getvalue()
+        returns a str: any unicode chunks are encoded with the encoding.
     ''' 
-    def __init__(self):
+    def __init__(self, encoding=None):
         self._outputChunks = []
+        self.encoding = encoding
 
     def flush(self):
         pass
@@ -53,6 +67,18 @@ class DummyResponse(object):
 
     def getvalue(self, outputChunks=None):
         chunks = outputChunks or self._outputChunks
+        try:
+            return self._join(chunks)
+        except TypeError:
+            if not [c for c in chunks if isinstance(c, DeferredChunk)]:
+                raise
+            # some of the output is waiting for awaitables, see the
+            # 'asyncPlaceholders' compiler setting
+            return DeferredOutput(list(chunks), self.encoding)
+
+    def _join(self, chunks):
+        if self.encoding is not None:
+            return self._getbytes(chunks)
         try:
             return u''.join(chunks)
         except UnicodeDecodeError, ex:
@@ -60,11 +86,77 @@ class DummyResponse(object):
             logging.debug('...perhaps you could fix "%s" while you\'re debugging')
             return ''.join((self.safeConvert(c) for c in chunks))
 
+    def _getbytes(self, chunks):
+        try:
+            value = ''.join(chunks)
+        except UnicodeDecodeError:
+            value = None
+        if not isinstance(value, str):
+            # something wrote unicode, e.g. an #include'd template that
+            # wasn't compiled with the same 'outputEncoding'
+            encoding = self.encoding
+            encoded = []
+            for chunk in chunks:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode(encoding)
+                encoded.append(chunk)
+            value = ''.join(encoded)
+        return value
+
     def writelines(self, *lines):
         ## not used
         [self.writeln(ln) for ln in lines]
         
 
+class StreamingResponse(DummyResponse):
+    '''
+        A response that keeps track of how much output is pending, so that
+        the streaming versions of generated methods (see the compiler setting
+        'generateStreamingMethods') know when to yield it.
+    '''
+    def __init__(self, flushThreshold=8192, encoding=None):
+        super(StreamingResponse, self).__init__(encoding)
+        self.flushThreshold = flushThreshold
+        self._pendingSize = 0
+
+    def write(self, value):
+        self._outputChunks.append(value)
+        self._pendingSize += len(value)
+
+    def popvalue(self):
+        """Returns the pending output and empties the buffer.
+        """
+        value = self.getvalue()
+        self._outputChunks = []
+        self._pendingSize = 0
+        return value
+
+
+class OutputBuffer(DummyResponse):
+    '''
+        Collects the output of a #call, #capture or #cache region.  It stands
+        in for both the transaction and its response, so a region needs only
+        one object, and it is kept on the template's buffer stack (see
+        Template._pushOutputBuffer) to be reused by the next region.
+    '''
+    def __init__(self, encoding=None):
+        super(OutputBuffer, self).__init__(encoding)
+        self.write = self._outputChunks.append
+        self.outerTrans = None
+        self.wasBuffering = False
+
+    def response(self, resp=None):
+        return self
+
+    def popvalue(self):
+        """Returns the buffered output and empties the buffer, keeping its
+        list for reuse.
+        """
+        value = self.getvalue()
+        del self._outputChunks[:]
+        return value
+
+
 class DummyTransaction(object):
     '''
         A dummy Transaction class is used by Cheetah in place of real Webware
@@ -72,17 +164,37 @@ class DummyTransaction(object):
         servlet.
 
         It only provides a response object and method.  All other methods and
-        attributes make no sense in this context.
+        attributes make no sense in this context.  The 'encoding' keyword
+        argument is passed on to the DummyResponse.
     '''
     def __init__(self, *args, **kwargs):
         self._response = None
+        self._encoding = kwargs.get('encoding')
 
     def response(self, resp=None):
         if self._response is None:
-            self._response = resp or DummyResponse()
+            self._response = resp or DummyResponse(self._encoding)
         return self._response
 
 
+_outputEncoders = {}
+
+def outputEncoder(encoding):
+    '''
+        Returns the function that the methods of templates compiled with the
+        'outputEncoding' setting pass their filtered placeholder values
+        through: it encodes unicode values and leaves byte strings alone.
+    '''
+    try:
+        return _outputEncoders[encoding]
+    except KeyError:
+        def encode(value, unicode=unicode, isinstance=isinstance):
+            if isinstance(value, unicode):
+                return value.encode(encoding)
+            return value
+        return _outputEncoders.setdefault(encoding, encode)
+
+
 class TransformerResponse(DummyResponse):
     def __init__(self, *args, **kwargs):
         super(TransformerResponse, self).__init__(*args, **kwargs)
@@ -106,3 +218,182 @@ class TransformerTransaction(object):
             return self._response
         return TransformerResponse()
 
+
+##################################################
+## DEFERRED OUTPUT
+## for templates compiled with the 'asyncPlaceholders' setting
+
+def isAwaitable(value):
+    '''
+        Whether value is an awaitable that a placeholder's output can wait
+        for: any object with add_done_callback(), done() and result(), such
+        as the futures of concurrent.futures, Tornado or asyncio, or a
+        DeferredOutput.
+    '''
+    return (hasattr(value, 'add_done_callback') and hasattr(value, 'result')
+            and not isinstance(value, type))
+
+def _whenAllDone(awaitables, fn):
+    """Calls fn() once all of the awaitables are done.
+    """
+    if not awaitables:
+        fn()
+        return
+    lock = Lock()
+    pending = [len(awaitables)]
+    def awaitableDone(awaitable):
+        lock.acquire()
+        try:
+            pending[0] -= 1
+            finished = not pending[0]
+        finally:
+            lock.release()
+        if finished:
+            fn()
+    for awaitable in awaitables:
+        awaitable.add_done_callback(awaitableDone)
+
+class _Deferred(object):
+    def __str__(self):
+        raise TypeError('the output of %r is deferred until its awaitables are'
+                        ' done: use it as a placeholder, or call its result()'
+                        % self)
+    __unicode__ = __str__
+
+class DeferredChunk(object):
+    '''
+        Stands in the output for a placeholder whose value was an awaitable,
+        until the awaitable's result can be filtered and written.
+    '''
+    __slots__ = ('awaitable', 'filter')
+
+    def __init__(self, awaitable, filter):
+        self.awaitable = awaitable
+        self.filter = filter
+
+    def resolve(self):
+        return self.filter(self.awaitable.result())
+
+class DeferredOutput(_Deferred):
+    '''
+        The output of a template, or of a #def, #call or #capture region, in
+        which some placeholders are waiting for awaitables.  It is itself an
+        awaitable: add_done_callback() calls its callback once all of the
+        awaitables are done, so they are waited for together rather than one
+        after the other, and result() returns the output with their filtered
+        results filled in.  See Template.renderAsync().
+    '''
+    def __init__(self, chunks, encoding=None):
+        self._chunks = chunks
+        self._encoding = encoding
+
+    def awaitables(self):
+        return [chunk.awaitable for chunk in self._chunks
+                if isinstance(chunk, DeferredChunk)]
+
+    def done(self):
+        for awaitable in self.awaitables():
+            if not awaitable.done():
+                return False
+        return True
+
+    def add_done_callback(self, fn):
+        _whenAllDone(self.awaitables(), lambda: fn(self))
+
+    def result(self):
+        """Returns the output.  Raises the exception of an awaitable that
+        failed, and waits for the ones that aren't done only if their own
+        result() does, e.g. concurrent.futures.
+        """
+        chunks = []
+        for chunk in self._chunks:
+            if isinstance(chunk, DeferredChunk):
+                chunk = chunk.resolve()
+            chunks.append(chunk)
+        return DummyResponse(self._encoding).getvalue(chunks)
+
+def _resultOf(value):
+    if isAwaitable(value):
+        return value.result()
+    return value
+
+class DeferredCall(_Deferred):
+    '''
+        The call of a #call target whose body, or one of whose #arg values,
+        is a DeferredOutput.  It is an awaitable that calls the target with
+        the results once they are all done, so the target gets the text of
+        its body rather than an object standing in for it.  See
+        callWhenDone().
+    '''
+    def __init__(self, func, args, kwargs):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._lock = Lock()
+        self._called = False
+        self._value = self._error = None
+
+    def awaitables(self):
+        return [arg for arg in self._args + tuple(self._kwargs.values())
+                if isAwaitable(arg)]
+
+    def _call(self):
+        self._lock.acquire()
+        try:
+            if not self._called:
+                try:
+                    args = [_resultOf(arg) for arg in self._args]
+                    kwargs = {}
+                    for name, arg in self._kwargs.items():
+                        kwargs[name] = _resultOf(arg)
+                    self._value = self._func(*args, **kwargs)
+                except:
+                    self._error = sys.exc_info()
+                self._called = True
+        finally:
+            self._lock.release()
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._value
+
+    def done(self):
+        for awaitable in self.awaitables():
+            if not awaitable.done():
+                return False
+        value = self._call()
+        return not isAwaitable(value) or value.done()
+
+    def add_done_callback(self, fn):
+        def argsDone():
+            try:
+                value = self._call()
+            except:
+                value = None
+            if isAwaitable(value):
+                value.add_done_callback(lambda value: fn(self))
+            else:
+                fn(self)
+        _whenAllDone(self.awaitables(), argsDone)
+
+    def result(self):
+        """Returns what the target returned, or its result() if it returned
+        an awaitable.  Raises the exception of an awaitable argument, or of
+        the target.
+        """
+        value = self._call()
+        if isAwaitable(value):
+            return value.result()
+        return value
+
+def callWhenDone(func, *args, **kwargs):
+    """Calls func, the target of a #call, with args and kwargs, or returns a
+    DeferredCall to call it later if any of them is an awaitable.  Used by
+    the code generated with the 'asyncPlaceholders' setting.
+    """
+    for arg in args:
+        if isAwaitable(arg):
+            return DeferredCall(func, args, kwargs)
+    for arg in kwargs.values():
+        if isAwaitable(arg):
+            return DeferredCall(func, args, kwargs)
+    return func(*args, **kwargs)
@@ -6,6 +6,13 @@
 '''
 import sys
 
+try:
+    from Cheetah import _filters
+    # it is possible with Jython or Windows, for example, that _filters.c hasn't been compiled
+    C_VERSION = True
+except ImportError:
+    C_VERSION = False
+
 # Additional entities WebSafe knows how to transform.  No need to include
 # '<', '>' or '&' since those will have been done already.
 webSafeEntities = {' ': '&nbsp;', '"': '&quot;'}
@@ -39,6 +46,9 @@ class Filter(object):
                 # on and let DummyTransaction worry about it
                 return str(val)
 
+if C_VERSION:
+    Filter = _filters.Filter
+
 RawOrEncodedUnicode = Filter
 
 EncodeUnicode = Filter
@@ -146,6 +156,8 @@ class WebSafe(Filter):
                 s = s.replace(k, v)
         return s
 
+if C_VERSION:
+    WebSafe = _filters.WebSafe
 
 class Strip(Filter):
     """Strip leading/trailing whitespace but preserve newlines.
@@ -379,6 +379,7 @@ class ImportManager:
             
     def install(self):
         import __builtin__
+        self._builtinImport = __builtin__.__import__
         __builtin__.__import__ = self.importHook
         __builtin__.reload = self.reloadHook
         
@@ -387,7 +388,11 @@ class ImportManager:
             NOTE: Currently importHook will accept the keyword-argument "level" 
             but it will *NOT* use it (currently). Details about the "level" keyword
             argument can be found here: http://www.python.org/doc/2.5.2/lib/built-in-funcs.html
+            Explicit relative imports (level > 0) are passed on to the builtin
+            __import__.
         '''
+        if level > 0:
+            return self._builtinImport(name, globals, locals, fromlist, level)
         # first see if we could be importing a relative name
         #print "importHook(%s, %s, locals, %s)" % (name, globals['__name__'], fromlist)
         _sys_modules_get = sys.modules.get
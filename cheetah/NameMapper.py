@@ -143,7 +143,9 @@ __all__ = ['NotFound',
            'valueForName',
            'valueFromSearchList',
            'valueFromFrameOrSearchList',
+           'valueFromFrameOrSearchListCached',
            'valueFromFrame',
+           'autoCall',
            ]
 
 if not hasattr(inspect.imp, 'get_suffixes'):
@@ -214,7 +216,9 @@ def valueForKey(obj, key):
         _raiseNotFoundException(key, obj)
 
 def _valueForName(obj, name, executeCallables=False):
-    nameChunks=name.split('.')
+    return _valueForNameChunks(obj, name.split('.'), executeCallables)
+
+def _valueForNameChunks(obj, nameChunks, executeCallables=False):
     for i in range(len(nameChunks)):
         key = nameChunks[i]
         if hasattr(obj, 'has_key') and key in obj:
@@ -271,6 +275,69 @@ def valueFromFrameOrSearchList(searchList, name, executeCallables=False,
     finally:
         del frame
 
+def _namespaceFromSlotCache(searchList, slotCache, key, globals):
+    slot = slotCache.get(key)
+    if slot is None or slot >= len(searchList):
+        return None
+    if slot < 0:
+        skipped = searchList
+    else:
+        skipped = searchList[:slot]
+    for namespace in skipped:
+        if isinstance(namespace, dict) and key in namespace:
+            return None
+    if slot >= 0:
+        namespace = searchList[slot]
+    elif globals is not None and key in globals:
+        namespace = globals
+    else:
+        namespace = __builtins__
+    if hasKey(namespace, key):
+        return namespace
+    return None
+
+def valueFromFrameOrSearchListCached(searchList, slotCache, nameChunks,
+                                     executeCallables=False,
+                                     locals=None, globals=None):
+    """A variant of valueFromFrameOrSearchList() that is used by templates
+    compiled with the 'useCompiledNameLookups' setting.
+
+    nameChunks is the name pre-split into a tuple and slotCache is a dict,
+    usually one per method call, that remembers which searchList namespace
+    satisfied each root name (-1 for globals or builtins).  Later lookups
+    of the same name go straight to that namespace, re-checking only the
+    mappings that precede it in the searchList.
+    """
+    def __valueForName(namespace):
+        try:
+            return _valueForNameChunks(namespace, nameChunks, executeCallables)
+        except NotFound, e:
+            _wrapNotFoundException(e, fullName='.'.join(nameChunks),
+                                   namespace=searchList)
+    key = nameChunks[0]
+    if not isinstance(searchList, (list, tuple)):
+        searchList = list(searchList)
+    if locals is None:
+        frame = inspect.currentframe().f_back
+        try:
+            locals, globals = frame.f_locals, frame.f_globals
+        finally:
+            del frame
+    if hasKey(locals, key):
+        return __valueForName(locals)
+    namespace = _namespaceFromSlotCache(searchList, slotCache, key, globals)
+    if namespace is not None:
+        return __valueForName(namespace)
+    for i, namespace in enumerate(searchList):
+        if hasKey(namespace, key):
+            slotCache[key] = i
+            return __valueForName(namespace)
+    for namespace in (globals, __builtins__):
+        if hasKey(namespace, key):
+            slotCache[key] = -1
+            return __valueForName(namespace)
+    _raiseNotFoundException(key, searchList)
+
 def valueFromFrame(name, executeCallables=False, frame=None):
     # @@TR consider implementing the C version the same way
     # at the moment it provides a seperate but mirror implementation
@@ -285,6 +352,14 @@ def valueFromFrame(name, executeCallables=False, frame=None):
     finally:
         del frame
 
+def autoCall(obj):
+    """Returns obj() if obj is something NameMapper calls when autocalling,
+    i.e. a callable that isn't a class or an instance, and obj otherwise.
+    """
+    if hasattr(obj, '__call__') and not _isInstanceOrClass(obj):
+        return obj()
+    return obj
+
 def hasName(obj, name):
     #Not in the C version
     """Determine if 'obj' has the 'name' """
@@ -303,6 +378,12 @@ try:
     C_VERSION = True
 except:
     C_VERSION = False
+if C_VERSION:
+    try:
+        from Cheetah._namemapper import valueFromFrameOrSearchListCached, autoCall
+    except ImportError:
+        # an _namemapper.c build that predates the compiled lookups
+        pass
 
 ##################################################
 ## CLASSES
@@ -391,6 +391,10 @@ class _LowLevelParser(SourceReader):
             self.setting('cheetahVarStartToken')[0] +
             self.setting('directiveStartToken')[0] +
             self.setting('PSPStartToken')[0])
+        # finds the next char that could start a token, so eatPlainText()
+        # only tries the matchers there
+        self._nonStrConstStartRE = cachedRegex('|'.join(
+            [escapeRegexChars(c) for c in sorted(set(self._possibleNonStrConstantChars))]))
         self._nonStrConstMatchers = [
             self.matchCommentStartToken,
             self.matchMultiLineCommentStartToken,
@@ -1503,7 +1507,17 @@ class _HighLevelParser(_LowLevelParser):
     def eatPlainText(self):
         startPos = self.pos()
         match = None
+        src = self.src()
+        breakPoint = self.breakPoint()
+        searchTokenStart = self._nonStrConstStartRE.search
         while not self.atEnd():
+            # skip the static text up to the next char that could start a
+            # token rather than trying the matchers at every char
+            tokenStart = searchTokenStart(src, self.pos(), breakPoint)
+            if tokenStart is None:
+                self.setPos(breakPoint)
+                break
+            self.setPos(tokenStart.start())
             match = self.matchTopLevelToken()
             if match:
                 break
@@ -2025,14 +2039,16 @@ class _HighLevelParser(_LowLevelParser):
         endOfFirstLinePos = self.findEOL()
         self._eatRestOfDirectiveTag(isLineClearToStartToken, endOfFirstLinePos)
         signature = ' '.join([line.strip() for line in signature.splitlines()]) 
+        lineCol = self.getRowCol(startPos)
         parserComment = ('## CHEETAH: generated from ' + signature + 
-                         ' at line %s, col %s' % self.getRowCol(startPos)
+                         ' at line %s, col %s' % lineCol
                          + '.')
 
         isNestedDef = (self.setting('allowNestedDefScopes')
                        and len([name for name in self._openDirectivesStack if name=='def'])>1)
         if directiveName=='block' or (directiveName=='def' and not isNestedDef):
-            self._compiler.startMethodDef(methodName, argsList, parserComment)
+            self._compiler.startMethodDef(methodName, argsList, parserComment,
+                                          lineCol=lineCol)
         else: #closure
             self._useSearchList_orig = self.setting('useSearchList')
             self.setSetting('useSearchList', False)
@@ -2043,13 +2059,15 @@ class _HighLevelParser(_LowLevelParser):
     def _eatSingleLineDef(self, directiveName, methodName, argsList, startPos, endPos):
         # filtered in calling method        
         fullSignature = self[startPos:endPos]
+        lineCol = self.getRowCol(startPos)
         parserComment = ('## Generated from ' + fullSignature + 
-                         ' at line %s, col %s' % self.getRowCol(startPos)
+                         ' at line %s, col %s' % lineCol
                          + '.')
         isNestedDef = (self.setting('allowNestedDefScopes')
                        and [name for name in self._openDirectivesStack if name=='def'])
         if directiveName=='block' or (directiveName=='def' and not isNestedDef):
-            self._compiler.startMethodDef(methodName, argsList, parserComment)
+            self._compiler.startMethodDef(methodName, argsList, parserComment,
+                                          lineCol=lineCol)
         else: #closure
             # @@TR: temporary hack of useSearchList
             useSearchList_orig = self.setting('useSearchList')
@@ -2203,6 +2221,7 @@ class _HighLevelParser(_LowLevelParser):
         # filtered
         isLineClearToStartToken = self.isLineClearToStartToken()
         endOfFirstLinePos = self.findEOL()
+        lineCol = self.getRowCol()
         self.getDirectiveStartToken()
         self.advance(len('include'))
 
@@ -2223,9 +2242,11 @@ class _HighLevelParser(_LowLevelParser):
             self.advance()
         startPos = self.pos()
         sourceExpr = self.getExpression()
+        rawExpr = self[startPos:self.pos()].strip()
         sourceExpr = self._applyExpressionFilters(sourceExpr, 'include', startPos=startPos)        
         self._eatRestOfDirectiveTag(isLineClearToStartToken, endOfFirstLinePos)
-        self._compiler.addInclude(sourceExpr, includeFrom, isRaw)
+        self._compiler.addInclude(sourceExpr, includeFrom, isRaw,
+                                  lineCol=lineCol, rawExpr=rawExpr)
 
     
     def eatDefMacro(self):
@@ -0,0 +1,112 @@
+'''
+Collects the timings recorded by templates compiled with the
+'profileRendering' or 'profilePlaceholders' compiler settings.
+
+The generated code times every method (#def, #block and the main method),
+every #include and, with 'profilePlaceholders', every $placeholder, and hands
+the elapsed time to the template's profiler along with where it came from in
+the template source:
+
+    t = Template(src, compilerSettings={'profileRendering': True,
+                                        'profilePlaceholders': True})
+    t.respond()
+    print t.getProfiler().report(10)
+
+Templates pulled in with #include share the profiler of the template that
+includes them.  Method and #include timings are inclusive, i.e. the time spent
+in a #def includes the time of the placeholders and methods it calls.
+'''
+from timeit import default_timer as timer
+
+class ProfileEntry(object):
+    """The accumulated timings for one method, #include or placeholder.
+    """
+    __slots__ = ('source', 'kind', 'name', 'line', 'col',
+                 'count', 'total', 'max')
+
+    def __init__(self, key, count, total, max):
+        self.source, self.kind, self.name, self.line, self.col = key
+        self.count = count
+        self.total = total
+        self.max = max
+
+    def mean(self):
+        return self.total / self.count
+
+    def location(self):
+        if self.line is None:
+            return str(self.source)
+        return '%s:%s:%s' % (self.source, self.line, self.col)
+
+    def __repr__(self):
+        return '<ProfileEntry %s %s at %s: %d calls, %.6fs>' % (
+            self.kind, self.name, self.location(), self.count, self.total)
+
+class RenderProfiler(object):
+    """Accumulates call counts and times, keyed by the tuple
+    (source, kind, name, line, col) that the generated code passes to
+    record().  source is the template's file name or, for templates compiled
+    from a string, its class name.  kind is 'method', 'include' or
+    'placeholder'.
+    """
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, key, elapsed):
+        stat = self._stats.get(key)
+        if stat is None:
+            self._stats[key] = [1, elapsed, elapsed]
+        else:
+            stat[0] += 1
+            stat[1] += elapsed
+            if elapsed > stat[2]:
+                stat[2] = elapsed
+
+    def reset(self):
+        self._stats = {}
+
+    def entries(self, kind=None):
+        """Returns a list of ProfileEntry objects, most expensive first.
+        """
+        entries = [ProfileEntry(key, *stat)
+                   for key, stat in self._stats.items()
+                   if kind is None or key[1] == kind]
+        entries.sort(key=lambda entry: entry.total, reverse=True)
+        return entries
+
+    def top(self, n=10, kind=None):
+        return self.entries(kind)[:n]
+
+    def byLine(self):
+        """Returns a list of ((source, line), totalTime) pairs, most expensive
+        first, combining the placeholders and #includes on each line.  Methods
+        are left out as their time is inclusive of those lines.
+        """
+        totals = {}
+        for (source, kind, name, line, col), stat in self._stats.items():
+            if kind == 'method' or line is None:
+                continue
+            totals[(source, line)] = totals.get((source, line), 0) + stat[1]
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    def report(self, n=10):
+        """Returns a table of the n most expensive methods and the n most
+        expensive placeholders and #includes.
+        """
+        lines = []
+        for title, kinds in (('methods', ('method',)),
+                             ('placeholders and #includes',
+                              ('placeholder', 'include'))):
+            entries = [entry for entry in self.entries()
+                       if entry.kind in kinds][:n]
+            if not entries:
+                continue
+            lines.append('top %d %s:' % (n, title))
+            lines.append('%10s %8s %10s %10s  %s' % (
+                'total(ms)', 'calls', 'mean(ms)', 'max(ms)', 'location'))
+            for entry in entries:
+                lines.append('%10.3f %8d %10.3f %10.3f  %s %s' % (
+                    entry.total * 1000, entry.count, entry.mean() * 1000,
+                    entry.max * 1000, entry.location(), entry.name))
+            lines.append('')
+        return '\n'.join(lines)
@@ -2,6 +2,7 @@
 """
 import re
 import sys
+from bisect import bisect_right
 
 EOLre = re.compile(r'[ \f\t]*(?:\r\n|\r|\n)')
 EOLZre = re.compile(r'(?:\r\n|\r|\n|\Z)')
@@ -23,19 +24,30 @@ class SourceReader(object):
         self._bookmarks = {}
         self._posTobookmarkMap = {}
 
-        ## collect some meta-information
-        self._EOLs = []
-        pos = 0
-        while pos < len(self):
-            EOLmatch = EOLZre.search(src, pos)
-            self._EOLs.append(EOLmatch.start())
-            pos = EOLmatch.end()
-            
-        self._BOLs = []
-        for pos in self._EOLs:
-            BOLpos = self.findBOL(pos)
-            self._BOLs.append(BOLpos)
+        self._lineIndexes = {}
         
+    def _lineIndex(self):
+        """Returns (BOLs, EOLs, lines): the sorted start and end positions of
+        the lines of the source, so positions can be mapped to lines with a
+        binary search, and the lines themselves.  The index is built on first
+        use, and kept per source as the parser swaps in the output of macros.
+        """
+        src = self._src
+        index = self._lineIndexes.get(src)
+        if index is None:
+            BOLs = []
+            EOLs = []
+            pos = 0
+            srcLen = len(src)
+            while pos < srcLen:
+                EOLmatch = EOLZre.search(src, pos)
+                BOLs.append(pos)
+                EOLs.append(EOLmatch.start())
+                pos = EOLmatch.end()
+            lines = [src[BOL:EOL] for BOL, EOL in zip(BOLs, EOLs)]
+            index = self._lineIndexes[src] = (BOLs, EOLs, lines)
+        return index
+
     def src(self):
         return self._src
 
@@ -57,23 +69,24 @@ class SourceReader(object):
         return self._src[i:j]
 
     def splitlines(self):
-        if not hasattr(self, '_srcLines'):
-            self._srcLines = self._src.splitlines()
-        return self._srcLines
+        return self._lineIndex()[2]
 
     def lineNum(self, pos=None):
+        """Returns the 0-based number of the line pos is on, or None if pos
+        is on a line break.
+        """
         if pos == None:
             pos = self._pos
-            
-        for i in range(len(self._BOLs)):
-            if pos >= self._BOLs[i] and pos <= self._EOLs[i]:
-                return i
+        BOLs, EOLs, lines = self._lineIndex()
+        i = bisect_right(BOLs, pos) - 1
+        if i >= 0 and pos <= EOLs[i]:
+            return i
             
     def getRowCol(self, pos=None):
         if pos == None:
             pos = self._pos
         lineNum = self.lineNum(pos)
-        BOL, EOL = self._BOLs[lineNum], self._EOLs[lineNum]
+        BOL = self._lineIndex()[0][lineNum]
         return lineNum+1, pos-BOL+1
             
     def getRowColLine(self, pos=None):
@@ -210,6 +223,9 @@ class SourceReader(object):
     def findBOL(self, pos=None):
         if pos == None:
             pos = self._pos
+        lineNum = self.lineNum(pos)
+        if lineNum is not None:
+            return self._lineIndex()[0][lineNum]
         src = self.src()
         return max(src.rfind('\n', 0, pos)+1, src.rfind('\r', 0, pos)+1, 0)
         
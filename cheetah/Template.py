@@ -61,7 +61,12 @@ from Cheetah.Utils.Indenter import Indenter      # Used in Template.__init__ and
                                                  # placeholders
 from Cheetah.NameMapper import NotFound, valueFromSearchList
 from Cheetah.CacheStore import MemoryCacheStore, MemcachedCacheStore
-from Cheetah.CacheRegion import CacheRegion
+from Cheetah.CacheRegion import CacheRegion, CacheRegionRegistry
+from Cheetah.DummyTransaction import (DummyTransaction, StreamingResponse,
+                                      OutputBuffer, DeferredOutput)
+from Cheetah.CompileCache import PerKeyLocks, codeWithFilename
+from Cheetah.Profiler import RenderProfiler
+from Cheetah.TemplatePool import TemplatePool, renderBatch as _renderBatch
 from Cheetah.Utils.WebInputMixin import _Converter, _lookup, NonNumericInputError
 
 from Cheetah.Unspecified import Unspecified
@@ -261,6 +266,7 @@ class Template(Servlet):
          'i18n',
          'runAsMainProgram',
          'respond',
+         'iterRender',
          'shutdown',
          'webInput',
          'serverSidePath',
@@ -273,13 +279,30 @@ class Template(Servlet):
          'getCacheRegion',
          'getCacheRegions',
          'refreshCache',
+         'prefetchCache',
+         'discardPrefetchedCache',
+         'getProfiler',
+         'setProfiler',
          
          '_handleCheetahInclude',
          '_getTemplateAPIClassForIncludeDirectiveCompilation',
+         '_pushOutputBuffer',
+         '_popOutputBuffer',
+         'rebind',
+         'renderAsync',
+         '_resetCheetahInstance',
+         '_recordInstanceAttrNames',
+         '_buildSearchList',
+         '_getMainMethodName',
          )
-    _CHEETAH_requiredCheetahClassMethods = ('subclass',) 
+    _CHEETAH_requiredCheetahClassMethods = ('subclass', 'getInstancePool',
+                                            'renderBatch')
     _CHEETAH_requiredCheetahClassAttributes = ('cacheRegionClass', 'cacheStore',
-                                               'cacheStoreIdPrefix', 'cacheStoreClass')
+                                               'cacheStoreIdPrefix', 'cacheStoreClass',
+                                               'shareCacheRegions', 'cacheRegionRegistry',
+                                               'profilerClass', 'outputEncoding',
+                                               'instancePoolSize', 'instancePoolLock',
+                                               'asyncPlaceholders')
 
     ## the following are used by .compile(). Most are documented in its docstring.
     _CHEETAH_cacheModuleFilesForTracebacks = False
@@ -288,10 +311,16 @@ class Template(Servlet):
     _CHEETAH_compileCache = dict() # cache store for compiled code and classes
     # To do something other than simple in-memory caching you can create an
     # alternative cache store. It just needs to support the basics of Python's
-    # mapping/dict protocol. E.g.:
+    # mapping/dict protocol, including .get(). E.g.:
     #   class AdvCachingTemplate(Template):
     #       _CHEETAH_compileCache = MemoryOrFileCache()
+    # Cheetah.CompileCache.LRUCompileCache provides a bounded in-memory cache.
     _CHEETAH_compileLock = Lock() # used to prevent race conditions
+    _CHEETAH_compileLocks = PerKeyLocks() # single-flight compilation per cacheHash
+    # An optional cache that persists generated code between process
+    # restarts, e.g. Cheetah.CompileCache.DiskCompileCache(cacheDir).  It is
+    # consulted when a template isn't found in _CHEETAH_compileCache.
+    _CHEETAH_persistentCompileCache = None
     _CHEETAH_defaultMainMethodName = None
     _CHEETAH_compilerSettings = None
     _CHEETAH_compilerClass = Compiler
@@ -316,6 +345,22 @@ class Template(Servlet):
     #_CHEETAH_cacheStoreClass = MemcachedCacheStore
     _CHEETAH_cacheStore = None  
     _CHEETAH_cacheStoreIdPrefix = None  
+    # Share #cache regions between all instances of a template class, keyed
+    # by the class rather than id(self).  Useful when a new instance is
+    # created for every request.
+    _CHEETAH_shareCacheRegions = False
+    _CHEETAH_cacheRegionRegistry = CacheRegionRegistry() # process-wide
+    # collects the timings of templates compiled with the 'profileRendering'
+    # or 'profilePlaceholders' settings, see getProfiler()
+    _CHEETAH_profilerClass = RenderProfiler
+    # set by the 'outputEncoding' compiler setting: the encoding of the byte
+    # strings the template's methods return, or None if they return unicode
+    _CHEETAH_outputEncoding = None
+    # set by the 'asyncPlaceholders' compiler setting, see renderAsync()
+    _CHEETAH_asyncPlaceholders = False
+    # the maximum number of idle instances kept by getInstancePool()
+    _CHEETAH_instancePoolSize = 16
+    _CHEETAH_instancePoolLock = Lock()
 
     @classmethod
     def _getCompilerClass(klass, source=None, file=None):
@@ -464,6 +509,10 @@ class Template(Servlet):
               code, compiler settings and other options, the cached template
               class will be returned.
 
+              If klass._CHEETAH_persistentCompileCache is set (see
+              Cheetah.CompileCache) it is used as a second-level cache for the
+              generated code and byte-code, which survives process restarts.
+
             - cacheModuleFilesForTracebacks (True/False)
               Default: Template._CHEETAH_cacheModuleFilesForTracebacks=False
 
@@ -706,11 +755,9 @@ class Template(Servlet):
                     fileHash += str(os.path.getmtime(file))
                 
             try:
-                # @@TR: find some way to create a cacheHash that is consistent
-                # between process restarts.  It would allow for caching the
-                # compiled module on disk and thereby reduce the startup time
-                # for applications that use a lot of dynamically compiled
-                # templates.                
+                # This key is only valid for the lifetime of the process.  See
+                # klass._CHEETAH_persistentCompileCache for a cache that
+                # survives process restarts.
                 cacheHash = ''.join([str(v) for v in
                                      [hash(source),
                                       fileHash,
@@ -726,108 +773,161 @@ class Template(Servlet):
             except:
                 #@@TR: should add some logging to this
                 pass
-        outputEncoding = 'ascii'
-        compiler = None
-        if useCache and cacheHash and cacheHash in klass._CHEETAH_compileCache:
-            cacheItem = klass._CHEETAH_compileCache[cacheHash]
-            generatedModuleCode = cacheItem.code
-        else:
-            compiler = compilerClass(source, file,
-                                     moduleName=moduleName,
-                                     mainClassName=className,
-                                     baseclassName=baseclassName,
-                                     mainMethodName=mainMethodName,
-                                     settings=(compilerSettings or {}))
-            if commandlineopts:
-                compiler.setShBang(commandlineopts.shbang)
-            compiler.compile()
-            generatedModuleCode = compiler.getModuleCode()
-            outputEncoding = compiler.getModuleEncoding()
-
-        if not returnAClass:
-            # This is a bit of a hackish solution to make sure we're setting the proper 
-            # encoding on generated code that is destined to be written to a file
-            if not outputEncoding == 'ascii':
-                generatedModuleCode = generatedModuleCode.split('\n')
-                generatedModuleCode.insert(1, '# -*- coding: %s -*-' % outputEncoding)
-                generatedModuleCode = '\n'.join(generatedModuleCode)
-            return generatedModuleCode.encode(outputEncoding)
-        else:
+        # Compilations are single-flight per cacheHash: if another thread is
+        # already compiling the same template this one waits for it and then
+        # picks up its result from the cache.  Unrelated templates compile in
+        # parallel.
+        compileLockKey = None
+        if useCache and cacheCompilationResults and cacheHash:
+            compileLockKey = cacheHash
+            klass._CHEETAH_compileLocks.acquire(compileLockKey)
+        try:
+            outputEncoding = 'ascii'
+            compiler = None
+            persistentCache = klass._CHEETAH_persistentCompileCache
+            persistentCacheKey = None
+            persistentCacheItem = None
+            codeObject = None
+            if useCache and cacheHash:
+                cacheItem = klass._CHEETAH_compileCache.get(cacheHash)
             if cacheItem:
-                cacheItem.lastCheckoutTime = time.time()
-                return cacheItem.klass
+                generatedModuleCode = cacheItem.code
+            else:
+                if persistentCache is not None and cacheHash:
+                    persistentCacheKey = persistentCache.genKey(
+                        source=source, file=file,
+                        compilerClass=compilerClass,
+                        compilerSettings=compilerSettings,
+                        className=className,
+                        moduleName=moduleName,
+                        mainMethodName=mainMethodName,
+                        baseclassName=baseclassName,
+                        shBang=(commandlineopts and commandlineopts.shbang or None))
+                    if useCache and persistentCacheKey:
+                        persistentCacheItem = persistentCache.get(persistentCacheKey)
+
+            if persistentCacheItem:
+                generatedModuleCode, outputEncoding, codeObject = persistentCacheItem
+            elif not cacheItem:
+                compiler = compilerClass(source, file,
+                                         moduleName=moduleName,
+                                         mainClassName=className,
+                                         baseclassName=baseclassName,
+                                         mainMethodName=mainMethodName,
+                                         settings=(compilerSettings or {}))
+                if commandlineopts:
+                    compiler.setShBang(commandlineopts.shbang)
+                compiler.compile()
+                generatedModuleCode = compiler.getModuleCode()
+                outputEncoding = compiler.getModuleEncoding()
+                if persistentCacheKey and cacheCompilationResults and not returnAClass:
+                    persistentCache.set(persistentCacheKey,
+                                        generatedModuleCode, outputEncoding)
+
+            if not returnAClass:
+                # This is a bit of a hackish solution to make sure we're setting the proper 
+                # encoding on generated code that is destined to be written to a file
+                if not outputEncoding == 'ascii':
+                    generatedModuleCode = generatedModuleCode.split('\n')
+                    generatedModuleCode.insert(1, '# -*- coding: %s -*-' % outputEncoding)
+                    generatedModuleCode = '\n'.join(generatedModuleCode)
+                return generatedModuleCode.encode(outputEncoding)
+            else:
+                if cacheItem:
+                    cacheItem.lastCheckoutTime = time.time()
+                    return cacheItem.klass
+
+                # The global lock is only held while reserving a unique module
+                # name, so that the module code of different templates can be
+                # exec'd concurrently.
+                try:
+                    klass._CHEETAH_compileLock.acquire()
+                    uniqueModuleName = _genUniqueModuleName(moduleName)
+                    mod = types.ModuleType(str(uniqueModuleName))
+                    sys.modules[uniqueModuleName] = mod
+                finally:
+                    klass._CHEETAH_compileLock.release()
 
-            try:
-                klass._CHEETAH_compileLock.acquire()
-                uniqueModuleName = _genUniqueModuleName(moduleName)
-                __file__ = uniqueModuleName+'.py' # relative file path with no dir part
-
-                if cacheModuleFilesForTracebacks:
-                    if not os.path.exists(cacheDirForModuleFiles):
-                        raise Exception('%s does not exist'%cacheDirForModuleFiles)
-
-                    __file__ = os.path.join(cacheDirForModuleFiles, __file__)
-                    # @@TR: might want to assert that it doesn't already exist
-                    open(__file__, 'w').write(generatedModuleCode)
-                    # @@TR: should probably restrict the perms, etc.
-
-                mod = types.ModuleType(str(uniqueModuleName))
-                if moduleGlobals:
-                    for k, v in moduleGlobals.items():
-                        setattr(mod, k, v)
-                mod.__file__ = __file__
-                if __orig_file__ and os.path.exists(__orig_file__):
-                    # this is used in the WebKit filemonitoring code
-                    mod.__orig_file__ = __orig_file__
-
-                if baseclass and baseclassValue:
-                    setattr(mod, baseclassName, baseclassValue)
-                ##
                 try:
-                    co = compile(generatedModuleCode, __file__, 'exec')
-                    exec(co, mod.__dict__)
-                except SyntaxError, e:
+                    __file__ = uniqueModuleName+'.py' # relative file path with no dir part
+
+                    if cacheModuleFilesForTracebacks:
+                        if not os.path.exists(cacheDirForModuleFiles):
+                            raise Exception('%s does not exist'%cacheDirForModuleFiles)
+
+                        __file__ = os.path.join(cacheDirForModuleFiles, __file__)
+                        # @@TR: might want to assert that it doesn't already exist
+                        open(__file__, 'w').write(generatedModuleCode)
+                        # @@TR: should probably restrict the perms, etc.
+
+                    if moduleGlobals:
+                        for k, v in moduleGlobals.items():
+                            setattr(mod, k, v)
+                    mod.__file__ = __file__
+                    if __orig_file__ and os.path.exists(__orig_file__):
+                        # this is used in the WebKit filemonitoring code
+                        mod.__orig_file__ = __orig_file__
+
+                    if baseclass and baseclassValue:
+                        setattr(mod, baseclassName, baseclassValue)
+                    ##
                     try:
-                        parseError = genParserErrorFromPythonException(
-                            source, file, generatedModuleCode, exception=e)
-                    except:
+                        if codeObject is None or cacheModuleFilesForTracebacks:
+                            co = compile(generatedModuleCode, __file__, 'exec')
+                        else:
+                            co = codeWithFilename(codeObject, __file__)
+                        exec(co, mod.__dict__)
+                    except SyntaxError, e:
+                        try:
+                            parseError = genParserErrorFromPythonException(
+                                source, file, generatedModuleCode, exception=e)
+                        except:
+                            updateLinecache(__file__, generatedModuleCode)
+                            e.generatedModuleCode = generatedModuleCode
+                            raise e
+                        else:
+                            raise parseError
+                    except Exception, e:
                         updateLinecache(__file__, generatedModuleCode)
                         e.generatedModuleCode = generatedModuleCode
-                        raise e
-                    else:
-                        raise parseError
-                except Exception, e:
-                    updateLinecache(__file__, generatedModuleCode)
-                    e.generatedModuleCode = generatedModuleCode
+                        raise
+                except:
+                    if sys.modules.get(uniqueModuleName) is mod:
+                        del sys.modules[uniqueModuleName]
                     raise
-                ##
-                sys.modules[uniqueModuleName] = mod
-            finally:
-                klass._CHEETAH_compileLock.release()
 
-            templateClass = getattr(mod, className)
+                templateClass = getattr(mod, className)
+
+                if (persistentCacheKey
+                    and cacheCompilationResults
+                    and codeObject is None):
+                    persistentCache.set(persistentCacheKey, generatedModuleCode,
+                                        outputEncoding, co)
 
-            if (cacheCompilationResults
-                and cacheHash
-                and cacheHash not in klass._CHEETAH_compileCache):
+                if (cacheCompilationResults
+                    and cacheHash
+                    and cacheHash not in klass._CHEETAH_compileCache):
                 
-                cacheItem = CompileCacheItem()
-                cacheItem.cacheTime = cacheItem.lastCheckoutTime = time.time()
-                cacheItem.code = generatedModuleCode
-                cacheItem.klass = templateClass
-                templateClass._CHEETAH_isInCompilationCache = True
-                klass._CHEETAH_compileCache[cacheHash] = cacheItem
-            else:
-                templateClass._CHEETAH_isInCompilationCache = False
+                    cacheItem = CompileCacheItem()
+                    cacheItem.cacheTime = cacheItem.lastCheckoutTime = time.time()
+                    cacheItem.code = generatedModuleCode
+                    cacheItem.klass = templateClass
+                    templateClass._CHEETAH_isInCompilationCache = True
+                    klass._CHEETAH_compileCache[cacheHash] = cacheItem
+                else:
+                    templateClass._CHEETAH_isInCompilationCache = False
 
-            if keepRefToGeneratedCode or cacheCompilationResults:
-                templateClass._CHEETAH_generatedModuleCode = generatedModuleCode                
+                if keepRefToGeneratedCode or cacheCompilationResults:
+                    templateClass._CHEETAH_generatedModuleCode = generatedModuleCode                
      
-            # If we have a compiler object, let's set it to the compiler class
-            # to help the directive analyzer code
-            if compiler:
-                templateClass._CHEETAH_compilerInstance = compiler
-            return templateClass
+                # If we have a compiler object, let's set it to the compiler class
+                # to help the directive analyzer code
+                if compiler:
+                    templateClass._CHEETAH_compilerInstance = compiler
+                return templateClass
+        finally:
+            if compileLockKey:
+                klass._CHEETAH_compileLocks.release(compileLockKey)
 
     @classmethod
     def subclass(klass, *args, **kws):
@@ -844,6 +944,46 @@ class Template(Servlet):
             templateAPIClass = Template
         return templateAPIClass.compile(*args, **kws)
 
+    @classmethod
+    def getInstancePool(klass):
+        """Returns the TemplatePool of reusable instances of this template
+        class, which is created on first use and shared by all its callers:
+
+          html = MyTemplate.getInstancePool().render(searchList=[{'user': user}])
+
+        The pool keeps up to _CHEETAH_instancePoolSize idle instances, which
+        are constructed without arguments.  Create a TemplatePool directly to
+        pass other constructor arguments.
+        """
+        pool = klass.__dict__.get('_CHEETAH_instancePool')
+        if pool is None:
+            klass._CHEETAH_instancePoolLock.acquire()
+            try:
+                pool = klass.__dict__.get('_CHEETAH_instancePool')
+                if pool is None:
+                    pool = TemplatePool(klass, maxSize=klass._CHEETAH_instancePoolSize)
+                    klass._CHEETAH_instancePool = pool
+            finally:
+                klass._CHEETAH_instancePoolLock.release()
+        return pool
+
+    @classmethod
+    def renderBatch(klass, namespaces, methodName=None, processes=None,
+                    chunkSize=32, **kwargs):
+        """Renders the template for each of many namespaces, e.g. one per
+        email or page, and yields the outputs in order:
+
+          for output in MyTemplate.renderBatch(records, processes=4):
+              ...
+
+        One instance is rebound to each namespace rather than an instance
+        being constructed for each, and with processes the rendering is
+        spread over a pool of worker processes.  See
+        Cheetah.TemplatePool.renderBatch for the details.
+        """
+        return _renderBatch(klass, namespaces, methodName=methodName,
+                            processes=processes, chunkSize=chunkSize, **kwargs)
+
     @classmethod
     def _preprocessSource(klass, source, file, preprocessors):
         """Iterates through the .compile() classmethod's preprocessors argument
@@ -1037,6 +1177,28 @@ class Template(Servlet):
                     else:
                         return super(self.__class__, self).__unicode__()
                     
+            if concreteTemplateClass._CHEETAH_asyncPlaceholders:
+                # rendered synchronously: wait for the awaitables
+                renderDeferredStr, renderDeferredUnicode = __str__, __unicode__
+                def __str__(self):
+                    rc = renderDeferredStr(self)
+                    if isinstance(rc, DeferredOutput):
+                        rc = rc.result()
+                        if isinstance(rc, unicode):
+                            return rc.encode('utf-8')
+                    return rc
+                def __unicode__(self):
+                    rc = renderDeferredUnicode(self)
+                    if isinstance(rc, DeferredOutput):
+                        return rc.result()
+                    return rc
+            if concreteTemplateClass._CHEETAH_outputEncoding:
+                renderUnicode = __unicode__
+                def __unicode__(self):
+                    rc = renderUnicode(self)
+                    if isinstance(rc, str):
+                        return rc.decode(self._CHEETAH_outputEncoding)
+                    return rc
             __str__ = createMethod(__str__, concreteTemplateClass)
             __unicode__ = createMethod(__unicode__, concreteTemplateClass)
             setattr(concreteTemplateClass, '__str__', __str__)
@@ -1289,6 +1451,9 @@ class Template(Servlet):
         if not self._CHEETAH__cacheStore:
             if self._CHEETAH_cacheStore is not None:
                 self._CHEETAH__cacheStore = self._CHEETAH_cacheStore
+            elif self._CHEETAH_shareCacheRegions:
+                self._CHEETAH__cacheStore = (
+                    self._CHEETAH_cacheRegionRegistry.cacheStore())
             else:
                 # @@TR: might want to provide a way to provide init args
                 self._CHEETAH__cacheStore = self._CHEETAH_cacheStoreClass()
@@ -1298,6 +1463,9 @@ class Template(Servlet):
     def _getCacheStoreIdPrefix(self):
         if self._CHEETAH_cacheStoreIdPrefix is not None:            
             return self._CHEETAH_cacheStoreIdPrefix
+        elif self._CHEETAH_shareCacheRegions:
+            klass = self.__class__
+            return klass.__module__ + '.' + klass.__name__
         else:
             return str(id(self))
     
@@ -1308,8 +1476,23 @@ class Template(Servlet):
             cacheStore=self._getCacheStore())
 
     def getCacheRegion(self, regionID, cacheInfo=None, create=True):
+        """Returns the cache region used by a #cache directive or cached
+        $placeholder.
+
+        If _CHEETAH_shareCacheRegions is set the region is shared by all the
+        instances of this template class, through
+        _CHEETAH_cacheRegionRegistry, rather than belonging to this instance.
+        """
         cacheRegion = self._CHEETAH__cacheRegions.get(regionID)
-        if not cacheRegion and create:
+        if not cacheRegion and self._CHEETAH_shareCacheRegions:
+            factory = None
+            if create:
+                factory = lambda: self._createCacheRegion(regionID)
+            cacheRegion = self._CHEETAH_cacheRegionRegistry.getCacheRegion(
+                self.__class__, regionID, factory)
+            if cacheRegion is not None:
+                self._CHEETAH__cacheRegions[regionID] = cacheRegion
+        elif not cacheRegion and create:
             cacheRegion = self._createCacheRegion(regionID)
             self._CHEETAH__cacheRegions[regionID] = cacheRegion
         return cacheRegion        
@@ -1321,6 +1504,9 @@ class Template(Servlet):
         Each #cache directive block or $*cachedPlaceholder is a separate 'cache
         region'.        
         """
+        if self._CHEETAH_shareCacheRegions:
+            return self._CHEETAH_cacheRegionRegistry.getCacheRegions(
+                self.__class__)
         # returns a copy to prevent users mucking it up
         return self._CHEETAH__cacheRegions.copy()
 
@@ -1332,7 +1518,7 @@ class Template(Servlet):
             for cacheRegion in self.getCacheRegions().itervalues():
                 cacheRegion.clear()
         else:
-            cregion = self._CHEETAH__cacheRegions.get(cacheRegionId)
+            cregion = self.getCacheRegion(cacheRegionId, create=False)
             if not cregion:
                 return
             if not cacheItemId: # clear the desired region and all its cacheItems
@@ -1341,9 +1527,59 @@ class Template(Servlet):
                 cache = cregion.getCacheItem(cacheItemId)
                 if cache:
                     cache.clear()
+
+    def prefetchCache(self):
+        """Fetches the data of all the cache items this template has used so
+        far in one round trip, if the cacheStore supports it (see
+        Cheetah.CacheStore.MemcachedCacheStore.prefetch).  Calling it before
+        rendering a template whose cache regions are already known, e.g. one
+        with _CHEETAH_shareCacheRegions set, saves a round trip per #cache
+        region.  The values are meant for that render only:
+
+            template.prefetchCache()
+            try:
+                output = str(template)
+            finally:
+                template.discardPrefetchedCache()
+        """
+        cacheStore = self._getCacheStore()
+        if not hasattr(cacheStore, 'prefetch'):
+            return
+        keys = []
+        for cacheRegion in self.getCacheRegions().itervalues():
+            keys.extend(cacheRegion.getCacheItemKeys())
+        if keys:
+            cacheStore.prefetch(keys)
+
+    def discardPrefetchedCache(self):
+        """Discards the values fetched by prefetchCache() that the render
+        didn't use, so they aren't served stale by a later one.
+        """
+        cacheStore = self._getCacheStore()
+        if hasattr(cacheStore, 'discardPrefetched'):
+            cacheStore.discardPrefetched()
                     
     ## end cache methods ##
                     
+    ## profiling methods ##
+    def getProfiler(self):
+        """Returns the profiler that collects the timings of this template
+        and the templates it #includes, creating an instance of
+        _CHEETAH_profilerClass on first use.
+
+        Timings are only recorded if the template was compiled with the
+        'profileRendering' or 'profilePlaceholders' compiler settings.
+        """
+        if self._CHEETAH__profiler is None:
+            self._CHEETAH__profiler = self._CHEETAH_profilerClass()
+        return self._CHEETAH__profiler
+
+    def setProfiler(self, profiler):
+        """Use profiler, e.g. one shared by several templates, instead of
+        this template's own.
+        """
+        self._CHEETAH__profiler = profiler
+
     def shutdown(self):
         """Break reference cycles before discarding a servlet.
         """
@@ -1354,6 +1590,108 @@ class Template(Servlet):
         self._CHEETAH__searchList = None
         self.__dict__ = {}
             
+    def iterRender(self, methodName=None, flushThreshold=8192, encoding=None):
+        """Renders the template incrementally, yielding chunks of output of at
+        least flushThreshold characters (except for the last) as they are
+        written.  The result can be returned as a WSGI application iterable:
+
+          return t.iterRender(encoding='utf-8')
+
+        methodName defaults to the method used by str(template).  Output is only
+        streamed if the template was compiled with the compiler setting
+        generateStreamingMethods=True and the method is eligible (it isn't a
+        generator and has no #return or #closure); otherwise the whole output
+        is yielded as a single chunk.  Output is yielded between the
+        top-level statements of the method, so each #def, #block or
+        placeholder called from it is rendered in full before being yielded.
+
+        If encoding is given the chunks are encoded with it.
+        """
+        if methodName is None:
+            methodName = self._getMainMethodName()
+        streamingMethodName = '_CHEETAH_streaming_' + methodName
+        streamingMethod = None
+        # only use the streaming version if it was generated for the same
+        # definition of the method, rather than one a subclass overrides
+        for klass in inspect.getmro(self.__class__):
+            if methodName in klass.__dict__:
+                if streamingMethodName in klass.__dict__:
+                    streamingMethod = getattr(self, streamingMethodName)
+                break
+
+        if streamingMethod is None:
+            chunks = [getattr(self, methodName)()]
+        else:
+            trans = DummyTransaction()
+            trans.response(StreamingResponse(flushThreshold=flushThreshold,
+                                             encoding=self._CHEETAH_outputEncoding))
+            chunks = streamingMethod(trans=trans)
+        for chunk in chunks:
+            if encoding and isinstance(chunk, unicode):
+                chunk = chunk.encode(encoding)
+            yield chunk
+
+    def _getMainMethodName(self):
+        """Returns the name of the method that str(template) renders.
+        """
+        if getattr(self.__class__, 'respond', None) not in (None, Servlet.respond):
+            return 'respond'
+        return getattr(self, '_mainCheetahMethod_for_' + self.__class__.__name__,
+                       'respond')
+
+    def renderAsync(self, methodName=None):
+        """Renders the template without waiting for the awaitables that its
+        placeholders return, if it was compiled with the 'asyncPlaceholders'
+        setting, and returns a DeferredOutput: an awaitable whose result() is
+        the output.  The calls that return the awaitables all run during
+        the render, so they run concurrently, and their results are filled
+        in once they are all done.  E.g. with a $getArticle($id) that returns
+        executor.submit(fetchArticle, id) from a concurrent.futures executor:
+
+          t.renderAsync().add_done_callback(lambda output: send(output.result()))
+
+        The callback runs in whichever thread completes the last awaitable,
+        so an event loop should be handed the output with its thread-safe
+        call (e.g. Tornado's IOLoop.add_callback).  An awaitable that failed
+        makes output.result() raise its exception.  methodName
+        defaults to the method str(template) would use.
+        """
+        if methodName is None:
+            methodName = self._getMainMethodName()
+        trans = DummyTransaction(encoding=self._CHEETAH_outputEncoding)
+        getattr(self, methodName)(trans=trans)
+        response = trans.response()
+        return DeferredOutput(response._outputChunks, response.encoding)
+
+    def rebind(self, searchList=None, namespaces=None):
+        """Resets the template's per-render state and binds it to a new
+        searchList, so that one instance can be used for many renders, e.g.
+        one per request, rather than constructing a new instance for each.
+        Returns the template.
+
+        The searchList and #set global variables are replaced, and the
+        current #filter and #errorCatcher, the transaction and the output
+        indentation are reset.  The attributes added to the instance since
+        it was first rebound, e.g. by '#silent self.x = ...', are removed.
+        This is also done for the templates cached for '#include file'
+        directives, while those for '#include source' ones are discarded,
+        so they don't accumulate one per distinct source.  What the instance
+        keeps is what it is meant to share between renders: the filter and
+        error catcher instances, #cache regions and the attributes it was
+        constructed with.  See TemplatePool for a pool of instances that are
+        rebound.
+        """
+        if namespaces is not None:
+            assert searchList is None, (
+                'Provide "namespaces" or "searchList", not both!')
+            searchList = namespaces
+        if '_CHEETAH__instanceAttrNames' not in self.__dict__:
+            self._recordInstanceAttrNames()
+        self._CHEETAH__globalSetVars = {}
+        self._CHEETAH__searchList = self._buildSearchList(searchList)
+        self._resetCheetahInstance()
+        return self
+
     ## utility functions ##   
 
     def getVar(self, varName, default=Unspecified, autoCall=True):        
@@ -1467,8 +1805,9 @@ class Template(Servlet):
             assert searchList is None, (
                 'Provide "namespaces" or "searchList", not both!')
             searchList = namespaces
-        if searchList is not None and not isinstance(searchList, (list, tuple)):
-            searchList = [searchList]
+        self._CHEETAH__prioritizeSearchList = bool(
+            isinstance(compilerSettings, dict)
+            and compilerSettings.get('prioritizeSearchListOverSelf'))
 
         self._CHEETAH__globalSetVars = {}
         if _globalSetVars is not None:
@@ -1481,13 +1820,9 @@ class Template(Servlet):
             self._CHEETAH__searchList.append(self)
         else:
             # create our own searchList
-            self._CHEETAH__searchList = [self._CHEETAH__globalSetVars, self]
-            if searchList is not None:
-                if isinstance(compilerSettings, dict) and compilerSettings.get('prioritizeSearchListOverSelf'):
-                    self._CHEETAH__searchList = searchList + self._CHEETAH__searchList
-                else:
-                    self._CHEETAH__searchList.extend(list(searchList))
+            self._CHEETAH__searchList = self._buildSearchList(searchList)
         self._CHEETAH__cheetahIncludes = {}
+        self._CHEETAH__sourceIncludeIDs = set()
         self._CHEETAH__cacheRegions = {}
         self._CHEETAH__indenter = Indenter()
 
@@ -1522,10 +1857,59 @@ class Template(Servlet):
         self._CHEETAH__instanceInitialized = True
         self._CHEETAH__isBuffering = False
         self._CHEETAH__isControlledByWebKit = False 
+        self._CHEETAH__outputBuffers = []
 
         self._CHEETAH__cacheStore = None
         if self._CHEETAH_cacheStore is not None:
             self._CHEETAH__cacheStore = self._CHEETAH_cacheStore
+        self._CHEETAH__profiler = None
+
+    def _buildSearchList(self, searchList):
+        """Returns the searchList for the searchList or namespaces argument of
+        the constructor or rebind(): the #set global variables and the
+        template itself, followed or preceded by searchList.
+        """
+        ownSearchList = [self._CHEETAH__globalSetVars, self]
+        if searchList is None:
+            return ownSearchList
+        if not isinstance(searchList, (list, tuple)):
+            searchList = [searchList]
+        if self._CHEETAH__prioritizeSearchList:
+            return list(searchList) + ownSearchList
+        return ownSearchList + list(searchList)
+
+    def _recordInstanceAttrNames(self):
+        """Records the instance's attributes, as the ones rebind() keeps.
+        """
+        attrNames = set(self.__dict__)
+        attrNames.add('_CHEETAH__instanceAttrNames')
+        self._CHEETAH__instanceAttrNames = attrNames
+
+    def _resetCheetahInstance(self):
+        """Resets the state a render can leave behind, see rebind().  The
+        templates cached for '#include file' directives are given the new
+        searchList and #set global variables.
+        """
+        attrNames = self.__dict__.get('_CHEETAH__instanceAttrNames')
+        if attrNames is not None:
+            for name in self.__dict__.keys():
+                if name not in attrNames:
+                    del self.__dict__[name]
+        self._CHEETAH__currentFilter = self._CHEETAH__initialFilter
+        self._CHEETAH__errorCatcher = self._CHEETAH__initErrorCatcher
+        self._CHEETAH__indenter = Indenter()
+        self._CHEETAH__isBuffering = False
+        self.transaction = None
+        includes = self._CHEETAH__cheetahIncludes
+        for includeID in self._CHEETAH__sourceIncludeIDs:
+            includes.pop(includeID, None)
+        self._CHEETAH__sourceIncludeIDs.clear()
+        for included in includes.values():
+            if isinstance(included, basestring):
+                continue
+            included._CHEETAH__globalSetVars = self._CHEETAH__globalSetVars
+            included._CHEETAH__searchList = self._CHEETAH__searchList + [included]
+            included._resetCheetahInstance()
         
     def _compile(self, source=None, file=None, compilerSettings=Unspecified,
                  moduleName=None, mainMethodName=None):
@@ -1603,6 +1987,9 @@ class Template(Servlet):
                 # filter='WebSafe'.
                 nestedTemplate._CHEETAH__initialFilter = self._CHEETAH__initialFilter
                 nestedTemplate._CHEETAH__currentFilter = self._CHEETAH__initialFilter   
+                if self._CHEETAH__profiler is not None:
+                    nestedTemplate.setProfiler(self._CHEETAH__profiler)
+                nestedTemplate._recordInstanceAttrNames()
                 self._CHEETAH__cheetahIncludes[_includeID] = nestedTemplate
             else:
                 if includeFrom == 'file':
@@ -1610,12 +1997,43 @@ class Template(Servlet):
                     self._CHEETAH__cheetahIncludes[_includeID] = self.getFileContents(path)
                 else:
                     self._CHEETAH__cheetahIncludes[_includeID] = srcArg
+            if includeFrom != 'file':
+                self._CHEETAH__sourceIncludeIDs.add(_includeID)
         ##
         if not raw:
             self._CHEETAH__cheetahIncludes[_includeID].respond(trans)
         else:
             trans.response().write(self._CHEETAH__cheetahIncludes[_includeID])
 
+    def _pushOutputBuffer(self, trans, setBuffering=True, encoding=None):
+        """Called at runtime at the start of #call, #capture and #cache
+        regions.  Returns an empty OutputBuffer, reused from earlier regions
+        when possible, to be used as the region's transaction.  encoding is
+        the method's 'outputEncoding' compiler setting.
+        """
+        try:
+            buf = self._CHEETAH__outputBuffers.pop()
+        except IndexError:
+            buf = OutputBuffer()
+        buf.encoding = encoding
+        buf.outerTrans = trans
+        buf.wasBuffering = self._CHEETAH__isBuffering
+        if setBuffering:
+            self._CHEETAH__isBuffering = True
+        return buf
+
+    def _popOutputBuffer(self, buf):
+        """Called at runtime at the end of the region started by
+        _pushOutputBuffer().  Returns (output, outerTrans): what the region
+        wrote and the transaction that was in use before it.
+        """
+        value = buf.popvalue()
+        trans = buf.outerTrans
+        buf.outerTrans = None
+        self._CHEETAH__isBuffering = buf.wasBuffering
+        self._CHEETAH__outputBuffers.append(buf)
+        return value, trans
+
     def _getTemplateAPIClassForIncludeDirectiveCompilation(self, source, file):
         """Returns the subclass of Template which should be used to compile
         #include directives.
@@ -0,0 +1,238 @@
+'''
+Packs compiled templates into a single archive file and imports them from it.
+
+`cheetah compile --archive=templates.cta` writes the marshalled code object of
+every compiled template into one file, with an index of module names, instead
+of writing a .py file per template.  At runtime the archive is opened once,
+memory-mapped, and the template modules are unmarshalled and executed only
+when they are imported:
+
+    from Cheetah import TemplateArchive
+    TemplateArchive.install('/path/to/templates.cta')
+
+    from some.templates.dir.mytemplate import mytemplate
+
+This avoids the stat() calls, .pyc checks and byte-compilation that importing
+thousands of separate template modules costs at startup.
+
+An archive is tied to the Python version that wrote it, as marshal's format
+changes between versions.  Templates are stored under the dotted module names
+they would have had as .py files in the --odir directory, and their parent
+packages are created in the archive so no __init__.py files are needed; a
+package that can also be imported the normal way, e.g. the application package
+the templates directory is in, is left to the normal import.  The generated
+Python source is stored compressed next to the code, for
+tracebacks.
+'''
+import imp
+import marshal
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+class Error(Exception):
+    pass
+
+MAGIC = 'CHTA'
+FORMAT_VERSION = 1
+# magic, format version, Python's bytecode magic, offset and length of the index
+_HEADER = struct.Struct('<4sH4sQQ')
+
+class ArchiveWriter(object):
+    """Writes an archive.  Call add() for each module and close() to write the
+    index.  The archive is written to a temporary file that close() renames
+    into place, so processes that have the old archive mapped keep working.
+    """
+    def __init__(self, path):
+        self.path = path
+        dirName = os.path.dirname(os.path.abspath(path))
+        fd, self._tmpPath = tempfile.mkstemp(dir=dirName, suffix='.tmp')
+        self._fp = os.fdopen(fd, 'wb')
+        self._fp.write(_HEADER.pack(MAGIC, FORMAT_VERSION, imp.get_magic(), 0, 0))
+        self._index = {}
+
+    def _write(self, data):
+        offset = self._fp.tell()
+        self._fp.write(data)
+        return offset, len(data)
+
+    def add(self, moduleName, pysrc, fileName=None):
+        """Compiles the generated module code pysrc and adds it to the archive
+        under moduleName, along with any parent packages not added yet.
+        fileName is the name shown in tracebacks.
+        """
+        if fileName is None:
+            fileName = moduleName.replace('.', os.sep) + '.py'
+        code = compile(pysrc + '\n', fileName, 'exec')
+        self.addCode(moduleName, code, pysrc)
+
+    def addCode(self, moduleName, code, pysrc=None):
+        parts = moduleName.split('.')
+        for i in range(1, len(parts)):
+            self._addPackage('.'.join(parts[:i]))
+        codeLoc = self._write(marshal.dumps(code))
+        srcLoc = (0, 0)
+        if pysrc is not None:
+            srcLoc = self._write(zlib.compress(pysrc))
+        self._index[moduleName] = (codeLoc, srcLoc, False)
+
+    def _addPackage(self, packageName):
+        entry = self._index.get(packageName)
+        if entry is None:
+            code = compile('', packageName.replace('.', os.sep), 'exec')
+            self._index[packageName] = (self._write(marshal.dumps(code)),
+                                        (0, 0), True)
+        elif not entry[2]:
+            raise Error('%s is both a module and a package' % packageName)
+
+    def moduleNames(self):
+        return [name for name, entry in self._index.items() if not entry[2]]
+
+    def close(self):
+        indexOffset, indexLength = self._write(marshal.dumps(self._index))
+        self._fp.seek(0)
+        self._fp.write(_HEADER.pack(MAGIC, FORMAT_VERSION, imp.get_magic(),
+                                    indexOffset, indexLength))
+        self._fp.close()
+        # mkstemp() creates the file readable by its owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self._tmpPath, 0666 & ~umask)
+        try:
+            os.rename(self._tmpPath, self.path)
+        except OSError:
+            # Windows won't rename over an existing file
+            os.remove(self.path)
+            os.rename(self._tmpPath, self.path)
+
+    def abort(self):
+        self._fp.close()
+        os.remove(self._tmpPath)
+
+class ArchiveReader(object):
+    """Reads an archive through a read-only memory map.  Only the index is
+    unmarshalled when the archive is opened.
+    """
+    def __init__(self, path):
+        self.path = path
+        fp = open(path, 'rb')
+        try:
+            try:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                raise Error('%s is not a template archive' % path)
+        finally:
+            fp.close()
+        if len(self._map) < _HEADER.size:
+            raise Error('%s is not a template archive' % path)
+        (magic, version, pyMagic,
+         indexOffset, indexLength) = _HEADER.unpack(self._map[:_HEADER.size])
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise Error('%s is not a template archive' % path)
+        if pyMagic != imp.get_magic():
+            raise Error('%s was written by a different version of Python'
+                        % path)
+        self._index = marshal.loads(
+            self._map[indexOffset:indexOffset+indexLength])
+
+    def __contains__(self, moduleName):
+        return moduleName in self._index
+
+    def moduleNames(self):
+        return [name for name, entry in self._index.items() if not entry[2]]
+
+    def isPackage(self, moduleName):
+        return self._index[moduleName][2]
+
+    def getCode(self, moduleName):
+        (offset, length), srcLoc, isPackage = self._index[moduleName]
+        return marshal.loads(self._map[offset:offset+length])
+
+    def getSource(self, moduleName):
+        """Returns the generated module code, or None if it wasn't stored.
+        """
+        codeLoc, (offset, length), isPackage = self._index[moduleName]
+        if not length:
+            return None
+        return zlib.decompress(self._map[offset:offset+length])
+
+    def close(self):
+        self._map.close()
+
+class ArchiveImporter(object):
+    """A PEP 302 finder and loader for the modules in an archive, for use in
+    sys.meta_path.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._reader = ArchiveReader(path)
+
+    def find_module(self, fullname, path=None):
+        if fullname not in self._reader:
+            return None
+        if self._reader.isPackage(fullname) and self._isImportable(fullname, path):
+            # the archive only has an empty package that was created for the
+            # templates in it, which mustn't shadow the real one
+            return None
+        return self
+
+    def _isImportable(self, fullname, path):
+        """Whether the import machinery would find fullname on path, the
+        parent package's __path__ (or sys.path for a top-level name).
+        """
+        try:
+            fp, pathname, description = imp.find_module(
+                fullname.rpartition('.')[2], path)
+        except ImportError:
+            return False
+        if fp is not None:
+            fp.close()
+        return True
+
+    def load_module(self, fullname):
+        mod = sys.modules.get(fullname)
+        if mod is not None:
+            return mod
+        code = self._reader.getCode(fullname)
+        mod = imp.new_module(fullname)
+        mod.__file__ = code.co_filename
+        mod.__loader__ = self
+        if self._reader.isPackage(fullname):
+            mod.__path__ = []
+            mod.__package__ = fullname
+        else:
+            mod.__package__ = fullname.rpartition('.')[0]
+        sys.modules[fullname] = mod
+        try:
+            exec code in mod.__dict__
+        except:
+            del sys.modules[fullname]
+            raise
+        return mod
+
+    def is_package(self, fullname):
+        return self._reader.isPackage(fullname)
+
+    def get_code(self, fullname):
+        return self._reader.getCode(fullname)
+
+    def get_source(self, fullname):
+        return self._reader.getSource(fullname)
+
+    def close(self):
+        self._reader.close()
+
+def install(path):
+    """Makes the modules in the archive at path importable and returns the
+    importer.  Archives installed later take precedence.
+    """
+    importer = ArchiveImporter(path)
+    sys.meta_path.insert(0, importer)
+    return importer
+
+def uninstall(importer):
+    if importer in sys.meta_path:
+        sys.meta_path.remove(importer)
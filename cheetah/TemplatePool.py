@@ -0,0 +1,178 @@
+'''
+A pool of reusable instances of a template class, for servers that render a
+template per request and would otherwise construct a new instance for each:
+
+  pool = TemplatePool(MyTemplate, filter='WebSafe')
+  html = pool.render(searchList=[{'user': user}])
+
+or, to do more with the instance than render its main method:
+
+  t = pool.acquire(searchList=[{'user': user}])
+  try:
+      html = t.respond()
+  finally:
+      pool.release(t)
+
+The instances are rebound to the searchList they are acquired with, and to
+an empty one when they are released, with Template.rebind(), which also
+removes the attributes that were added to an instance since it was first
+acquired, e.g. by '#silent self.x = ...', so nothing from one request is seen
+by the next one.  Template.getInstancePool() returns a pool shared by all the
+users of a template class.
+
+The pool is thread-safe, but an instance must only be used by one thread at a
+time, between acquire() and release().
+
+renderBatch() (or Template.renderBatch()) renders a template class for each
+of many namespaces, e.g. one per email, with a single rebound instance, or
+with one in each of a pool of worker processes.
+'''
+from itertools import islice
+try:
+    from threading import Lock
+except ImportError:
+    class Lock:
+        def acquire(self):
+            pass
+        def release(self):
+            pass
+
+class TemplatePool(object):
+    """Keeps up to maxSize idle instances of templateClass, constructed with
+    the keyword arguments kwargs (e.g. filter, errorCatcher).
+    """
+    def __init__(self, templateClass, maxSize=16, **kwargs):
+        self.templateClass = templateClass
+        self.maxSize = maxSize
+        self._kwargs = kwargs
+        self._idle = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._idle)
+
+    def acquire(self, searchList=None, namespaces=None):
+        """Returns an idle instance, or a new one if there isn't one, bound to
+        searchList (or namespaces).
+        """
+        template = None
+        self._lock.acquire()
+        try:
+            if self._idle:
+                template = self._idle.pop()
+        finally:
+            self._lock.release()
+        if template is None:
+            template = self.templateClass(**self._kwargs)
+        return template.rebind(searchList=searchList, namespaces=namespaces)
+
+    def release(self, template):
+        """Returns an instance from acquire() to the pool.  It is reset first,
+        and discarded if the pool already has maxSize idle instances.
+        """
+        template.rebind()
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self.maxSize:
+                self._idle.append(template)
+        finally:
+            self._lock.release()
+
+    def render(self, searchList=None, namespaces=None, methodName=None):
+        """Renders methodName, by default the method str(template) would use,
+        with an instance from the pool and returns its output.
+        """
+        template = self.acquire(searchList=searchList, namespaces=namespaces)
+        try:
+            if methodName is None:
+                methodName = template._getMainMethodName()
+            return getattr(template, methodName)()
+        finally:
+            self.release(template)
+
+    def clear(self):
+        """Discards the idle instances.
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for template in idle:
+            template.shutdown()
+
+
+##################################################
+## BATCH RENDERING
+
+## used by renderBatch() in the worker processes
+_workerTemplate = None
+_workerRender = None
+
+def _initBatchWorker(templateClass, methodName, kwargs):
+    global _workerTemplate, _workerRender
+    _workerTemplate = templateClass(**kwargs)
+    _workerRender = getattr(_workerTemplate,
+                            methodName or _workerTemplate._getMainMethodName())
+
+def _renderBatchItem(namespaces):
+    _workerTemplate.rebind(searchList=namespaces)
+    return _workerRender()
+
+def renderBatch(templateClass, namespaces, methodName=None, processes=None,
+                chunkSize=32, **kwargs):
+    """Yields the output of rendering templateClass for each item of the
+    iterable namespaces, in order.  An item is a namespace or a list of them,
+    as for the searchList argument of Template.rebind().  methodName defaults
+    to the method str(template) would use, and kwargs are passed to the
+    constructor.
+
+    One instance is constructed and rebound to each item in turn, which
+    also removes the attributes a render added to it.  With
+    processes, the items are rendered by that many worker processes, which
+    each construct their own instance and are sent the items in chunks of
+    chunkSize; the items and the outputs must then be picklable.  The workers
+    are forked with the template class already defined, so it needn't be
+    importable, except where multiprocessing can't fork (Windows).  The
+    items are read as the outputs are consumed, a few chunks per worker
+    ahead, so a long iterable isn't read into memory.
+    """
+    multiprocessing = None
+    if processes:
+        try:
+            import multiprocessing
+        except ImportError:
+            pass
+    if multiprocessing is None:
+        template = templateClass(**kwargs)
+        rebind = template.rebind
+        render = getattr(template, methodName or template._getMainMethodName())
+        for item in namespaces:
+            rebind(searchList=item)
+            yield render()
+        return
+
+    items = iter(namespaces)
+    windowSize = chunkSize * processes * 4
+    pool = multiprocessing.Pool(processes, _initBatchWorker,
+                                (templateClass, methodName, kwargs))
+    try:
+        # dispatch the next window of items before returning the outputs of
+        # the current one, so the workers don't wait for the consumer
+        pending = None
+        while True:
+            window = list(islice(items, windowSize))
+            outputs = None
+            if window:
+                outputs = pool.imap(_renderBatchItem, window, chunkSize)
+            if pending is not None:
+                for output in pending:
+                    yield output
+            if outputs is None:
+                break
+            pending = outputs
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    pool.join()
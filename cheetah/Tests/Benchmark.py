@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from Cheetah import Benchmark
+
+class PercentileTest(unittest.TestCase):
+    def test_interpolation(self):
+        values = [4, 1, 3, 2, 5]
+        self.assertEqual(Benchmark.percentile(values, 0), 1)
+        self.assertEqual(Benchmark.percentile(values, 50), 3)
+        self.assertEqual(Benchmark.percentile(values, 100), 5)
+        self.assertEqual(Benchmark.percentile([1, 2], 50), 1.5)
+        self.assertEqual(Benchmark.percentile([7], 99), 7)
+
+    def test_empty(self):
+        self.assertRaises(ValueError, Benchmark.percentile, [], 50)
+
+class ScenarioTest(unittest.TestCase):
+    def test_allScenariosRun(self):
+        data = Benchmark.run(number=1, repeat=2, warmup=0)
+        self.assertEqual(sorted(data['results'].keys()),
+                         sorted(Benchmark.scenarioNames()))
+        for name, result in data['results'].items():
+            self.assert_(result['kind'] in ('compile', 'render'))
+            self.assert_(result['min'] <= result['p50'] <= result['p90']
+                         <= result['p99'] <= result['max'], name)
+            self.assertEqual(result['repeat'], 2)
+            self.assert_(isinstance(result['allocations'], (int, long)))
+
+    def test_renderOutputIsStable(self):
+        for scenarioClass in Benchmark.SCENARIOS:
+            if scenarioClass.kind != 'render':
+                continue
+            scenario = scenarioClass()
+            func = scenario.setup()
+            try:
+                first = func()
+                self.assert_(first.strip(), scenarioClass.name)
+                self.assertEqual(first, func())
+            finally:
+                scenario.teardown()
+
+    def test_compilerSettings(self):
+        settings = {'useLocalVarFastPath': True}
+        data = Benchmark.run(['render-loop'], compilerSettings=settings,
+                             number=1, repeat=1, warmup=0)
+        self.assertEqual(data['compilerSettings'], settings)
+
+    def test_unknownScenario(self):
+        self.assertRaises(Benchmark.Error, Benchmark.run, ['no-such-scenario'])
+
+class CompareTest(unittest.TestCase):
+    def result(self, **medians):
+        return {'formatVersion': Benchmark.FORMAT_VERSION,
+                'results': dict([(name, {'p50': val, 'allocations': 0})
+                                 for name, val in medians.items()])}
+
+    def test_compare(self):
+        rows = Benchmark.compare(self.result(a=1.0, b=1.0, c=1.0, d=1.0),
+                                 self.result(a=1.5, b=0.5, c=1.05),
+                                 threshold=0.1)
+        self.assertEqual([(row['name'], row['status']) for row in rows],
+                         [('a', 'slower'), ('b', 'faster'), ('c', 'same')])
+        self.assertEqual(rows[0]['ratio'], 1.5)
+
+    def test_roundTripAndCommandLine(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            base = os.path.join(tempDir, 'base.json')
+            slow = os.path.join(tempDir, 'slow.json')
+            Benchmark.dump(self.result(a=1.0), base)
+            Benchmark.dump(self.result(a=2.0), slow)
+            self.assertEqual(Benchmark.load(base), self.result(a=1.0))
+
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                self.assertEqual(Benchmark.main(['compare', base, base]), 0)
+                self.assertEqual(Benchmark.main(['compare', base, slow]), 1)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+        finally:
+            shutil.rmtree(tempDir, True)
+
+if __name__ == '__main__':
+    unittest.main()
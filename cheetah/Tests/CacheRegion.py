@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import gc
+import sys
+import threading
+import time
+import unittest
+
+from Cheetah.Template import Template
+from Cheetah.CacheRegion import CacheItem, CacheRegion, CacheRegionRegistry
+from Cheetah.CacheStore import MemoryCacheStore
+
+
+class SharedCacheRegionsTest(unittest.TestCase):
+    source = ('#cache timer="5m"\n$render()#end cache\n'
+              '$*5*cachedPlaceholder')
+
+    def setUp(self):
+        self.renders = []
+        class SharedTemplate(Template):
+            _CHEETAH_shareCacheRegions = True
+            _CHEETAH_cacheRegionRegistry = CacheRegionRegistry()
+        self.baseclass = SharedTemplate
+        self.templateClass = self.compile(self.source)
+        self.registry = SharedTemplate._CHEETAH_cacheRegionRegistry
+
+    def compile(self, source):
+        return Template.compile(source, baseclass=self.baseclass)
+
+    def namespace(self):
+        def render():
+            self.renders.append(1)
+            return 'rendered %d' % len(self.renders)
+        return {'render': render, 'cachedPlaceholder': len(self.renders)}
+
+    def newInstance(self):
+        return self.templateClass(namespaces=self.namespace())
+
+    def test_sharedBetweenInstances(self):
+        self.assertEqual(str(self.newInstance()), 'rendered 1\n0')
+        self.assertEqual(str(self.newInstance()), 'rendered 1\n0')
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(len(self.registry), 2)
+
+    def test_notSharedByDefault(self):
+        klass = Template.compile(self.source)
+        self.assertEqual(str(klass(namespaces=self.namespace())), 'rendered 1\n0')
+        self.assertEqual(str(klass(namespaces=self.namespace())), 'rendered 2\n1')
+
+    def test_keyedByClass(self):
+        str(self.newInstance())
+        klass = self.compile(self.source + ' ')
+        self.assertNotEqual(klass()._getCacheStoreIdPrefix(),
+                            self.newInstance()._getCacheStoreIdPrefix())
+        self.assertEqual(str(klass(namespaces=self.namespace())), 'rendered 2\n1 ')
+
+    def test_compilerSetting(self):
+        klass = Template.compile(self.source,
+                                 compilerSettings={'shareCacheRegions': True})
+        self.assertEqual(str(klass(namespaces=self.namespace())), 'rendered 1\n0')
+        self.assertEqual(str(klass(namespaces=self.namespace())), 'rendered 1\n0')
+        Template._CHEETAH_cacheRegionRegistry.clear()
+
+    def test_varyBy(self):
+        klass = self.compile('#cache varyBy=$user\n$user $render()#end cache\n')
+        output = [str(klass(namespaces=dict(self.namespace(), user=user)))
+                  for user in ('a', 'b', 'a', 'b')]
+        self.assertEqual(output, ['a rendered 1\n', 'b rendered 2\n',
+                                  'a rendered 1\n', 'b rendered 2\n'])
+
+    def test_refreshCache(self):
+        str(self.newInstance())
+        self.newInstance().refreshCache()
+        self.assertEqual(str(self.newInstance()), 'rendered 2\n1')
+
+    def test_registryClear(self):
+        str(self.newInstance())
+        self.registry.clear()
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(str(self.newInstance()), 'rendered 2\n1')
+
+    def test_threads(self):
+        str(self.newInstance())
+        results = []
+        def render():
+            for i in range(20):
+                results.append(str(self.newInstance()))
+        threads = [threading.Thread(target=render) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 100)
+        self.assertEqual(set(results), set(['rendered 1\n0']))
+
+    def test_customStore(self):
+        store = MemoryCacheStore()
+        class StoreTemplate(Template):
+            _CHEETAH_shareCacheRegions = True
+            _CHEETAH_cacheRegionRegistry = CacheRegionRegistry()
+            _CHEETAH_cacheStore = store
+        klass = Template.compile(self.source, baseclass=StoreTemplate)
+        str(klass(namespaces=self.namespace()))
+        self.assertEqual(len(store._data), 2)
+
+
+class CacheItemLeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryCacheStore()
+        self.item = CacheItem('item', self.store)
+
+    def test_lease(self):
+        token = self.item.acquireLease(60)
+        self.assert_(token)
+        self.assert_(self.item.isLeased())
+        self.assertEqual(self.item.acquireLease(60), None)
+        self.item.releaseLease('someone else')
+        self.assert_(self.item.isLeased())
+        self.item.releaseLease(token)
+        self.failIf(self.item.isLeased())
+        self.assert_(self.item.acquireLease(60))
+
+    def test_leaseExpires(self):
+        self.item.acquireLease(0.01)
+        time.sleep(0.02)
+        self.assert_(self.item.acquireLease(60))
+
+    def test_staleData(self):
+        self.item.setExpiryTime(time.time() - 1)
+        self.item.setData('old')
+        self.assertRaises(KeyError, self.store.get, 'item')
+
+        self.item.setStaleTime(60)
+        self.item.setData('old')
+        self.assert_(self.item.hasExpired())
+        self.assertEqual(self.item.lookupOutput(), 'old')
+        self.assertEqual(self.item.waitForOutput(0), 'old')
+
+    def test_waitForOutput(self):
+        self.item.pollInterval = 0.01
+        self.assertEqual(self.item.waitForOutput(5), None)
+        self.item.acquireLease(60)
+        start = time.time()
+        self.assertEqual(self.item.waitForOutput(0.05), None)
+        self.assert_(time.time() - start >= 0.05)
+
+    def test_jitter(self):
+        for i in range(20):
+            now = time.time()
+            self.item.setExpiryInterval(100, 0.1)
+            self.assert_(now + 90 <= self.item.getExpiryTime() <= time.time() + 100)
+
+
+class StampedeProtectionTest(unittest.TestCase):
+    source = '#cache id="r", timer="5m", stale="5m"\n$render()#end cache\n'
+
+    def setUp(self):
+        self.renders = []
+        class SharedTemplate(Template):
+            _CHEETAH_shareCacheRegions = True
+            _CHEETAH_cacheRegionRegistry = CacheRegionRegistry()
+        self.baseclass = SharedTemplate
+
+    def render(self, source, delay=0):
+        def render():
+            time.sleep(delay)
+            self.renders.append(1)
+            return 'rendered %d' % len(self.renders)
+        klass = Template.compile(source, baseclass=self.baseclass)
+        return str(klass(namespaces={'render': render}))
+
+    def cacheItem(self, source=None):
+        klass = Template.compile(source or self.source, baseclass=self.baseclass)
+        return klass().getCacheRegion('r').getCacheItem('r')
+
+    def test_servesStaleWhileLeased(self):
+        self.assertEqual(self.render(self.source), 'rendered 1\n')
+        item = self.cacheItem()
+        item.setExpiryTime(time.time() - 1)
+        token = item.acquireLease(60)
+        self.assertEqual(self.render(self.source), 'rendered 1\n')
+        item.releaseLease(token)
+        self.assertEqual(self.render(self.source), 'rendered 2\n')
+        self.assertEqual(self.render(self.source), 'rendered 2\n')
+
+    def test_oneRendererRefreshes(self):
+        self.render(self.source)
+        self.cacheItem().setExpiryTime(time.time() - 1)
+        results = []
+        def render():
+            results.append(self.render(self.source, delay=0.05))
+        threads = [threading.Thread(target=render) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.renders), 2)
+        self.assertEqual(sorted(results),
+                         ['rendered 1\n'] * 4 + ['rendered 2\n'])
+
+    def test_lockWaitsForNewData(self):
+        source = '#cache id="r", timer="5m", lock=True\n$render()#end cache\n'
+        results = []
+        def render():
+            results.append(self.render(source, delay=0.05))
+        threads = [threading.Thread(target=render) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.renders), 1)
+        self.assertEqual(results, ['rendered 1\n'] * 5)
+
+    def test_lockTimesOut(self):
+        source = '#cache id="r", lock="0.05s"\n$render()#end cache\n'
+        self.cacheItem(source).acquireLease(60)
+        self.assertEqual(self.render(source), 'rendered 1\n')
+
+    def test_leaseReleasedOnError(self):
+        source = '#cache id="r", stale="5m"\n$render()$fail()#end cache\n'
+        def fail():
+            raise ValueError
+        klass = Template.compile(source, baseclass=self.baseclass)
+        template = klass(namespaces={'render': lambda: '', 'fail': fail})
+        self.assertRaises(ValueError, template.respond)
+        self.failIf(self.cacheItem(source).isLeased())
+
+    def test_jitter(self):
+        source = '#cache id="r", timer="100s", jitter=0.5\n$render()#end cache\n'
+        now = time.time()
+        self.render(source)
+        expiryTime = self.cacheItem(source).getExpiryTime()
+        self.assert_(now + 50 <= expiryTime <= time.time() + 100)
+
+
+class CacheRegionRegistryTest(unittest.TestCase):
+    def test_getCacheRegion(self):
+        class T(object): pass
+        class U(object): pass
+        registry = CacheRegionRegistry()
+        self.assertEqual(registry.getCacheRegion(T, 'r'), None)
+        region = registry.getCacheRegion(T, 'r', lambda: CacheRegion('r', 't'))
+        self.assert_(registry.getCacheRegion(T, 'r') is region)
+        self.assertEqual(registry.getCacheRegion(U, 'r'), None)
+        self.assertEqual(registry.getCacheRegions(T), {'r': region})
+        self.assertEqual(registry.getCacheRegions(U), {})
+        self.assertEqual(registry.cacheStore().maxEntries,
+                         CacheRegionRegistry.DEFAULT_MAX_ENTRIES)
+
+    def test_regionsGoWithTheirClass(self):
+        class SharedTemplate(Template):
+            _CHEETAH_shareCacheRegions = True
+            _CHEETAH_cacheRegionRegistry = CacheRegionRegistry()
+        registry = SharedTemplate._CHEETAH_cacheRegionRegistry
+        klass = Template.compile('#cache\n$x#end cache\n',
+                                 baseclass=SharedTemplate,
+                                 cacheCompilationResults=False)
+        self.assertEqual(str(klass(namespaces={'x': 1})), '1\n')
+        self.assertEqual(len(registry), 1)
+        # e.g. a template that is reloaded after it was changed
+        del sys.modules[klass.__module__], klass
+        gc.collect()
+        self.assertEqual(len(registry), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+import SocketServer
+import threading
+import time
+import unittest
+
+from Cheetah.Template import Template
+from Cheetah.Version import Version
+from Cheetah.CacheRegion import CacheRegionRegistry
+from Cheetah.CacheStore import Error, MemoryCacheStore, LRUMemoryCacheStore, \
+     MemcachedCacheStore
+
+
+class MemoryCacheStoreTest(unittest.TestCase):
+    storeClass = MemoryCacheStore
+
+    def setUp(self):
+        self.store = self.storeClass()
+
+    def test_setGetDelete(self):
+        self.store.set('a', 'x')
+        self.assertEqual(self.store.get('a'), 'x')
+        self.store.delete('a')
+        self.assertRaises(KeyError, self.store.get, 'a')
+        self.assertRaises(KeyError, self.store.delete, 'a')
+
+    def test_addAndReplace(self):
+        self.assertRaises(Error, self.store.replace, 'a', 'x')
+        self.store.add('a', 'x')
+        self.assertRaises(Error, self.store.add, 'a', 'y')
+        self.store.replace('a', 'z')
+        self.assertEqual(self.store.get('a'), 'z')
+
+    def test_expiry(self):
+        self.store.set('a', 'x', time.time() - 1)
+        self.store.set('b', 'y', time.time() + 60)
+        self.assertRaises(KeyError, self.store.get, 'a')
+        self.assertEqual(self.store.get('b'), 'y')
+
+    def test_addOverExpired(self):
+        self.store.set('a', 'x', time.time() - 1)
+        self.store.add('a', 'y')
+        self.assertEqual(self.store.get('a'), 'y')
+        self.store.set('b', 'x', time.time() - 1)
+        self.assertRaises(Error, self.store.replace, 'b', 'y')
+
+    def test_clear(self):
+        self.store.set('a', 'x')
+        self.store.clear()
+        self.assertRaises(KeyError, self.store.get, 'a')
+
+
+class LRUMemoryCacheStoreTest(MemoryCacheStoreTest):
+    storeClass = LRUMemoryCacheStore
+
+    def test_maxEntries(self):
+        store = LRUMemoryCacheStore(maxEntries=2)
+        store.set('a', 'x')
+        store.set('b', 'x')
+        store.get('a')
+        store.set('c', 'x')
+        self.assertRaises(KeyError, store.get, 'b')
+        self.assertEqual(store.get('a'), 'x')
+        self.assertEqual(store.get('c'), 'x')
+        self.assertEqual(store.stats()['evictions'], 1)
+
+    def test_maxBytes(self):
+        store = LRUMemoryCacheStore(maxBytes=10)
+        store.set('a', 'x' * 6)
+        store.set('b', 'y' * 4)
+        self.assertEqual(store.size(), 10)
+        store.set('a', 'x' * 2)
+        self.assertEqual(store.size(), 6)
+        store.set('c', 'z' * 5)
+        self.assertRaises(KeyError, store.get, 'b')
+        self.assertEqual(store.size(), 7)
+        store.set('d', 'w' * 11)
+        self.assertRaises(KeyError, store.get, 'd')
+        self.assertEqual(store.stats()['entries'], 2)
+
+    def test_sweep(self):
+        store = LRUMemoryCacheStore(sweepInterval=0)
+        for i in range(10):
+            store.set(i, 'x', time.time() - 1)
+        store.set('a', 'x')
+        self.assertEqual(store.stats()['entries'], 1)
+        self.assertEqual(store.stats()['expirations'], 10)
+
+        store = LRUMemoryCacheStore(sweepInterval=None)
+        store.set('b', 'x', time.time() - 1)
+        store.set('a', 'x')
+        self.assertEqual(store.stats()['entries'], 2)
+        store.sweep()
+        self.assertEqual(store.stats()['entries'], 1)
+
+    def test_stats(self):
+        self.store.set('a', 'xyz')
+        self.store.get('a')
+        self.assertRaises(KeyError, self.store.get, 'b')
+        self.assertEqual(self.store.stats(),
+                         {'entries': 1, 'bytes': 3, 'hits': 1, 'misses': 1,
+                          'evictions': 0, 'expirations': 0})
+
+    def test_threads(self):
+        store = LRUMemoryCacheStore(maxEntries=50)
+        def work(n):
+            for i in range(500):
+                store.set((n, i % 70), 'x')
+                try:
+                    store.get((n, (i * 7) % 70))
+                except KeyError:
+                    pass
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.stats()['entries'], 50)
+        self.assertEqual(store.size(), 50)
+
+    def test_withCacheRegions(self):
+        store = LRUMemoryCacheStore(maxEntries=2)
+        class BoundedTemplate(Template):
+            _CHEETAH_shareCacheRegions = True
+            _CHEETAH_cacheRegionRegistry = CacheRegionRegistry(store)
+        klass = Template.compile('#cache varyBy=$id\n$id $count()#end cache',
+                                 baseclass=BoundedTemplate)
+        calls = []
+        def render(id):
+            def count():
+                calls.append(id)
+                return len(calls)
+            return str(klass(namespaces={'id': id, 'count': count}))
+        self.assertEqual([render(id) for id in (1, 2, 1, 3, 1, 2)],
+                         ['1 1', '2 2', '1 1', '3 3', '1 1', '2 4'])
+        self.assertEqual(store.stats()['entries'], 2)
+
+class FakeMemcachedHandler(SocketServer.StreamRequestHandler):
+    """Implements the part of the memcached text protocol that
+    MemcachedCacheStore uses.
+    """
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def handle(self):
+        server = self.server
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            cmd, args = parts[0], parts[1:]
+            server.commands.append(cmd)
+            server.lock.acquire()
+            try:
+                if cmd == 'get':
+                    reply = []
+                    for key in args:
+                        item = server.lookup(key)
+                        if item is not None:
+                            reply.append('VALUE %s %d %d\r\n%s'
+                                         % (key, item[0], len(item[1]), item[1]))
+                    self.reply('\r\n'.join(reply + ['END']))
+                elif cmd in ('set', 'add', 'replace'):
+                    key, flags, exptime, length = args[:4]
+                    data = self.rfile.read(int(length) + 2)[:-2]
+                    exists = server.lookup(key) is not None
+                    if ((cmd == 'add' and exists)
+                        or (cmd == 'replace' and not exists)):
+                        self.reply('NOT_STORED')
+                    else:
+                        exptime = int(exptime)
+                        if exptime and exptime <= 60*60*24*30:
+                            exptime += time.time()
+                        server.data[key] = (int(flags), data, exptime)
+                        self.reply('STORED')
+                elif cmd == 'delete':
+                    if server.lookup(args[0]) is not None:
+                        del server.data[args[0]]
+                        self.reply('DELETED')
+                    else:
+                        self.reply('NOT_FOUND')
+                elif cmd == 'flush_all':
+                    server.data.clear()
+                    self.reply('OK')
+                else:
+                    self.reply('ERROR')
+            finally:
+                server.lock.release()
+
+class FakeMemcachedServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', 0), FakeMemcachedHandler)
+        self.data = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.setDaemon(True)
+        thread.start()
+
+    def address(self):
+        return '%s:%d' % self.server_address
+
+    def lookup(self, key):
+        item = self.data.get(key)
+        if item is not None and item[2] and time.time() > item[2]:
+            del self.data[key]
+            item = None
+        return item
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MemcachedCacheStoreTest(MemoryCacheStoreTest):
+    def setUp(self):
+        self.server = FakeMemcachedServer()
+        self.store = MemcachedCacheStore([self.server.address()])
+
+    def tearDown(self):
+        self.store.disconnect()
+        self.server.stop()
+
+    def test_namespace(self):
+        self.store.set('a', 'x')
+        self.assertEqual(self.server.data.keys(), ['cheetah-%s:a' % Version])
+        other = MemcachedCacheStore([self.server.address()], namespace='other')
+        self.assertRaises(KeyError, other.get, 'a')
+        other.disconnect()
+
+    def test_invalidKeys(self):
+        for key in ('a key with spaces', 'k' * 300, u'caf\xe9'):
+            self.store.set(key, 'x')
+            self.assertEqual(self.store.get(key), 'x')
+        for key in self.server.data.keys():
+            self.assert_(len(key) <= 250 and ' ' not in key)
+
+    def test_values(self):
+        for val in ('bytes', u'caf\xe9', {'a': [1, 2]}, 42, ''):
+            self.store.set('a', val)
+            self.assertEqual(self.store.get('a'), val)
+            self.assertEqual(type(self.store.get('a')), type(val))
+
+    def test_compression(self):
+        store = MemcachedCacheStore([self.server.address()],
+                                    compressThreshold=100)
+        store.set('small', 'x' * 100)
+        store.set('big', u'y' * 1000)
+        flags, data, exptime = self.server.data['cheetah-%s:big' % Version]
+        self.assert_(flags & 8 and len(data) < 1000)
+        self.assertEqual(self.server.data['cheetah-%s:small' % Version][0], 0)
+        self.assertEqual(store.get('big'), u'y' * 1000)
+        self.assertEqual(store.get('small'), 'x' * 100)
+        store.disconnect()
+
+    def test_getMultiAndPrefetch(self):
+        self.store.set('a', 'x')
+        self.store.set('b', 'y')
+        del self.server.commands[:]
+        self.assertEqual(self.store.getMulti(['a', 'b', 'c']),
+                         {'a': 'x', 'b': 'y'})
+        self.store.prefetch(['a', 'b', 'c'])
+        self.assertEqual(self.store.get('a'), 'x')
+        self.assertEqual(self.store.get('b'), 'y')
+        self.assertRaises(KeyError, self.store.get, 'c')
+        self.assertEqual(self.server.commands, ['get', 'get'])
+
+        self.store.prefetch(['a'])
+        self.store.set('a', 'z')
+        self.assertEqual(self.store.get('a'), 'z')
+
+    def test_prefetchNotServedStale(self):
+        self.store.set('a', 'x')
+        self.store.prefetch(['a'])
+        self.store.discardPrefetched()
+        self.server.data['cheetah-%s:a' % Version] = (0, 'y', 0)
+        self.assertEqual(self.store.get('a'), 'y')
+
+        self.store.prefetchLifetime = 0.01
+        self.store.prefetch(['a'])
+        self.server.data['cheetah-%s:a' % Version] = (0, 'z', 0)
+        time.sleep(0.02)
+        self.assertEqual(self.store.get('a'), 'z')
+
+    def test_connectionClosedOnError(self):
+        self.store.set('a', 'x')
+        def fail(conn):
+            raise ValueError('failed')
+        server = self.store._servers[0]
+        self.assertRaises(ValueError, self.store._call, server, fail)
+        self.assertEqual(server._idle, [])
+        self.assertEqual(self.store.get('a'), 'x')
+
+    def test_multipleServers(self):
+        server = FakeMemcachedServer()
+        try:
+            store = MemcachedCacheStore([self.server.address(), server.address()])
+            keys = [str(i) for i in range(20)]
+            for key in keys:
+                store.set(key, key)
+            self.assert_(self.server.data and server.data)
+            self.assertEqual(store.getMulti(keys), dict(zip(keys, keys)))
+            store.disconnect()
+        finally:
+            server.stop()
+
+    def test_deadServer(self):
+        address = self.server.address()
+        self.store.disconnect()
+        self.server.stop()
+        store = MemcachedCacheStore([address], deadRetry=60)
+        store.set('a', 'x')
+        self.assertRaises(KeyError, store.get, 'a')
+        self.assertRaises(Error, store.add, 'a', 'x')
+        self.assertEqual(store.getMulti(['a']), {})
+        self.server = FakeMemcachedServer()
+
+    def test_threads(self):
+        errors = []
+        def work(n):
+            try:
+                for i in range(50):
+                    self.store.set((n, i), 'x' * i)
+                    self.assertEqual(self.store.get((n, i)), 'x' * i)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.data), 250)
+
+    def test_withTemplate(self):
+        class MemcachedTemplate(Template):
+            _CHEETAH_shareCacheRegions = True
+            _CHEETAH_cacheRegionRegistry = CacheRegionRegistry(self.store)
+        klass = Template.compile(
+            '#cache id="a", timer="5m", stale="1m"\n$v#end cache\n'
+            '#cache id="b"\n$v#end cache\n', baseclass=MemcachedTemplate)
+        self.assertEqual(str(klass(namespaces={'v': 1})), '1\n1\n')
+        del self.server.commands[:]
+        template = klass(namespaces={'v': 2})
+        template.prefetchCache()
+        try:
+            self.assertEqual(str(template), '1\n1\n')
+        finally:
+            template.discardPrefetchedCache()
+        self.assertEqual(self.server.commands, ['get'])
+        self.failIf(self.store._prefetched())
+
+if __name__ == '__main__':
+    unittest.main()
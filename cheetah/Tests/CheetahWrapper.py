@@ -530,6 +530,151 @@ class NoBackup(CFBase):
         self.go("cheetah fill --nobackup --oext txt a.tmpl")
         self.checkNoBackup("a.txt" + BACKUP_SUFFIX)
 
+class Archive(CFBase):
+    def importFromArchive(self, path, moduleName):
+        from Cheetah import TemplateArchive
+        importer = TemplateArchive.install(path)
+        try:
+            mod = __import__(moduleName, {}, {}, ['a'])
+            return str(mod.a())
+        finally:
+            TemplateArchive.uninstall(importer)
+            for name in sys.modules.keys():
+                if name in ('a', 'child') or name.startswith('child.'):
+                    del sys.modules[name]
+
+    def testCompile(self):
+        self.go("cheetah compile -R --archive templates.cta")
+        self.failIf(os.path.exists("a.py"))
+        self.failIf(os.path.exists("child/a.py"))
+        self.assertEqual(self.importFromArchive("templates.cta", "a"),
+                         "Hello, world!\n")
+        self.assertEqual(
+            self.importFromArchive("templates.cta", "child.grandkid.a"),
+            "Hello, world!\n")
+
+    def testOdir(self):
+        self.go("cheetah compile -R --idir child --odir DEST --archive t.cta")
+        self.failIf(os.path.exists("DEST"))
+        self.assertEqual(self.importFromArchive("t.cta", "grandkid.a"),
+                         "Hello, world!\n")
+
+    def testFill(self):
+        self.assertSubprocess("cheetah fill --archive t.cta a.tmpl", nonzero=True)
+
+class Parallel(CFBase):
+    def testCompile(self):
+        self.go("cheetah compile -R --parallel 2")
+        self.checkCompile("a.py")
+        self.checkCompile("child/a.py")
+        self.checkCompile("child/grandkid/a.py")
+
+    def testFill(self):
+        self.go("cheetah fill -R --parallel 2")
+        self.checkFill("a.html")
+        self.checkFill("child/a.html")
+        self.checkFill("child/grandkid/a.html")
+
+    def testArchive(self):
+        self.go("cheetah compile -R --parallel 2 --archive t.cta")
+        self.assertEqual(Archive('testCompile').importFromArchive(
+            "t.cta", "child.grandkid.a"), "Hello, world!\n")
+
+    def testErrors(self):
+        f = open("child/broken.tmpl", "w")
+        f.write("#if\n")
+        f.close()
+        output = self.assertSubprocess("cheetah compile -R --parallel 2",
+                                       nonzero=True)
+        self.failUnless("1 of 4 templates failed: child/broken.tmpl" in output,
+                        output)
+        self.checkCompile("a.py")
+        self.checkCompile("child/grandkid/a.py")
+
+class Incremental(CFBase):
+    def writeFile(self, path, source):
+        f = open(path, "w")
+        f.write(source)
+        f.close()
+
+    def testUnchanged(self):
+        self.go("cheetah compile -R --incremental",
+                expectedOutputSubstring="0 of 3 templates unchanged")
+        self.failUnless(os.path.exists(".cheetah-compile-manifest"))
+        output = self.assertSubprocess("cheetah compile -R --incremental")
+        self.failUnless("3 of 3 templates unchanged" in output, output)
+        self.failIf("Compiling" in output, output)
+        self.checkCompile("child/a.py")
+
+    def testChanged(self):
+        self.go("cheetah compile -R --incremental")
+        self.writeFile("child/a.tmpl", "Hello, world!\nAgain\n")
+        output = self.assertSubprocess("cheetah compile -R --incremental")
+        self.failUnless("2 of 3 templates unchanged" in output, output)
+        self.failUnless("Compiling child/a.tmpl" in output, output)
+        self.checkCompile("child/a.py")
+
+    def testMissingOutput(self):
+        self.go("cheetah compile -R --incremental")
+        os.remove("child/grandkid/a.py")
+        self.go("cheetah compile -R --incremental",
+                expectedOutputSubstring="2 of 3 templates unchanged")
+        self.checkCompile("child/grandkid/a.py")
+
+    def testDependents(self):
+        self.writeFile("child/base.tmpl",
+                       "#def greeting\nHello\n#end def\n")
+        self.writeFile("child/grandkid/a.tmpl",
+                       "#from child.base import base\n#extends base\n"
+                       "#implements respond\n$greeting, world!\n")
+        self.go("cheetah compile -R --incremental")
+        self.writeFile("child/base.tmpl",
+                       "#def greeting\nHello again\n#end def\n")
+        output = self.assertSubprocess("cheetah compile -R --incremental")
+        self.failUnless("2 of 4 templates unchanged" in output, output)
+        self.failUnless("Compiling child/base.tmpl" in output, output)
+        self.failUnless("Compiling child/grandkid/a.tmpl" in output, output)
+
+    def testIncludes(self):
+        self.writeFile("greeting.txt", "Hello")
+        self.writeFile("a.tmpl", '#include raw "greeting.txt"#, world!\n')
+        self.go("cheetah fill --incremental a.tmpl")
+        self.checkFill("a.html")
+        self.writeFile("greeting.txt", "Goodbye")
+        self.go("cheetah fill --incremental a.tmpl",
+                expectedOutputSubstring="0 of 1 templates unchanged")
+
+    def testSettings(self):
+        self.go("cheetah compile -R --incremental")
+        self.go("cheetah compile -R --incremental --settings='useFilters=False'",
+                expectedOutputSubstring="0 of 3 templates unchanged")
+
+    def testManifest(self):
+        self.go("cheetah compile -R --manifest build.manifest")
+        self.failUnless(os.path.exists("build.manifest"))
+        self.failIf(os.path.exists(".cheetah-compile-manifest"))
+        self.go("cheetah compile -R --manifest build.manifest",
+                expectedOutputSubstring="3 of 3 templates unchanged")
+
+    def testErrors(self):
+        self.writeFile("child/broken.tmpl", "#if\n")
+        self.assertSubprocess("cheetah compile -R --incremental --parallel 2",
+                              nonzero=True)
+        output = self.assertSubprocess(
+            "cheetah compile -R --incremental --parallel 2", nonzero=True)
+        self.failUnless("3 of 4 templates unchanged" in output, output)
+
+    def testArchive(self):
+        self.go("cheetah compile -R --incremental --archive t.cta")
+        self.writeFile("a.tmpl", "Hello, archive!\n")
+        output = self.assertSubprocess(
+            "cheetah compile -R --incremental --archive t.cta")
+        self.failUnless("2 of 3 templates unchanged" in output, output)
+        self.assertEqual(Archive('testCompile').importFromArchive("t.cta", "a"),
+                         "Hello, archive!\n")
+        self.assertEqual(Archive('testCompile').importFromArchive(
+            "t.cta", "child.grandkid.a"), "Hello, world!\n")
+
 def listTests(cheetahWrapperFile):
     """cheetahWrapperFile, string, path of this script.
 
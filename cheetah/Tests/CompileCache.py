@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import gc
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from Cheetah.Template import Template
+from Cheetah.Compiler import Compiler
+from Cheetah.CompileCache import DiskCompileCache, LRUCompileCache, PerKeyLocks
+
+class DiskCompileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.cache = DiskCompileCache(self.cacheDir)
+
+        class CachingTemplate(Template):
+            _CHEETAH_compileCache = dict()
+            _CHEETAH_persistentCompileCache = self.cache
+        self.templateClass = CachingTemplate
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir, True)
+
+    def cacheFiles(self):
+        return [f for f in os.listdir(self.cacheDir)
+                if f.endswith(DiskCompileCache.fileExtension)]
+
+    def test_keyIsStable(self):
+        key1 = self.cache.genKey(source='$foo', className='foo')
+        key2 = self.cache.genKey(source='$foo', className='foo')
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, self.cache.genKey(source='$bar', className='foo'))
+        self.assertNotEqual(key1, self.cache.genKey(source='$foo', className='bar'))
+        self.assertNotEqual(key1, self.cache.genKey(source='$foo', className='foo',
+                                                    compilerSettings={'useDottedNotation':False}))
+
+    def test_nonLiteralSettingsAreNotCached(self):
+        key = self.cache.genKey(source='$foo',
+                                compilerSettings={'expressionFilterHooks':[lambda **kw: kw['expr']]})
+        self.assertEqual(key, None)
+
+    def test_fileKeyUsesContents(self):
+        path = os.path.join(self.cacheDir, 'foo.tmpl')
+        open(path, 'w').write('$foo')
+        key1 = self.cache.genKey(file=path)
+        open(path, 'w').write('$bar')
+        self.assertNotEqual(key1, self.cache.genKey(file=path))
+
+    def test_fileKeyUsesPathAndMtime(self):
+        # the generated code has the path and the mtime of the file in it
+        path = os.path.join(self.cacheDir, 'foo.tmpl')
+        otherPath = os.path.join(self.cacheDir, 'bar.tmpl')
+        for p in (path, otherPath):
+            open(p, 'w').write('$foo')
+        os.utime(otherPath, (1000, 1000))
+        os.utime(path, (1000, 1000))
+        key = self.cache.genKey(file=path)
+        self.assertNotEqual(key, self.cache.genKey(file=otherPath))
+        os.utime(path, (2000, 2000))
+        self.assertNotEqual(key, self.cache.genKey(file=path))
+
+    def test_compileStoresAndReuses(self):
+        klass = self.templateClass.compile(source='$foo cached')
+        self.assertEqual(str(klass(namespaces={'foo':1})), '1 cached')
+        self.assertEqual(len(self.cacheFiles()), 1)
+
+        # simulate a process restart by emptying the in-memory cache
+        self.templateClass._CHEETAH_compileCache.clear()
+        klass2 = self.templateClass.compile(source='$foo cached')
+        self.assertNotEqual(klass, klass2)
+        self.assertEqual(klass2._CHEETAH_compilerInstance, None)
+        self.assertEqual(str(klass2(namespaces={'foo':2})), '2 cached')
+
+    def test_reusedCodeHasModuleFilename(self):
+        source = '#def f\n$nothere#slurp\n#end def\n$f()'
+        klass = self.templateClass.compile(source=source)
+        self.templateClass._CHEETAH_compileCache.clear()
+        klass2 = self.templateClass.compile(source=source)
+        self.assertEqual(klass2._CHEETAH_compilerInstance, None)
+        fileName = sys.modules[klass2.__module__].__file__
+        self.assertNotEqual(fileName, sys.modules[klass.__module__].__file__)
+        self.assertEqual(klass2.f.im_func.func_code.co_filename, fileName)
+        self.assertEqual(klass2.respond.im_func.func_code.co_filename, fileName)
+
+    def test_returnCode(self):
+        code = self.templateClass.compile(source='$foo code', returnAClass=False)
+        self.assertEqual(len(self.cacheFiles()), 1)
+        self.assertEqual(code, self.templateClass.compile(source='$foo code',
+                                                          returnAClass=False))
+        klass = self.templateClass.compile(source='$foo code')
+        self.assertEqual(str(klass(namespaces={'foo':1})), '1 code')
+
+    def test_useCacheFalse(self):
+        self.templateClass.compile(source='$foo nocache')
+        self.templateClass._CHEETAH_compileCache.clear()
+        klass = self.templateClass.compile(source='$foo nocache', useCache=False)
+        self.assertNotEqual(klass._CHEETAH_compilerInstance, None)
+
+    def test_corruptEntryIsIgnored(self):
+        self.templateClass.compile(source='$foo corrupt')
+        for name in self.cacheFiles():
+            open(os.path.join(self.cacheDir, name), 'wb').write('garbage')
+        self.templateClass._CHEETAH_compileCache.clear()
+        klass = self.templateClass.compile(source='$foo corrupt')
+        self.assertNotEqual(klass._CHEETAH_compilerInstance, None)
+        self.assertEqual(str(klass(namespaces={'foo':1})), '1 corrupt')
+
+    def test_clear(self):
+        self.templateClass.compile(source='$foo clear')
+        self.cache.clear()
+        self.assertEqual(self.cacheFiles(), [])
+
+class LRUCompileCacheTest(unittest.TestCase):
+    def makeTemplateClass(self, **kw):
+        class CachingTemplate(Template):
+            _CHEETAH_compileCache = LRUCompileCache(**kw)
+        return CachingTemplate
+
+    def test_countersAndCheckoutTime(self):
+        klass = self.makeTemplateClass()
+        cache = klass._CHEETAH_compileCache
+        t1 = klass.compile(source='$foo lru')
+        item = cache[cache.keys()[0]]
+        item.lastCheckoutTime = 0
+        self.assertEqual(klass.compile(source='$foo lru'), t1)
+        self.assert_(item.lastCheckoutTime > 0)
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['bytes'], len(item.code))
+
+    def test_maxEntries(self):
+        klass = self.makeTemplateClass(maxEntries=2)
+        cache = klass._CHEETAH_compileCache
+        t1 = klass.compile(source='$foo 1')
+        t2 = klass.compile(source='$foo 2')
+        for key in cache.keys():
+            if cache[key].klass is t2:
+                cache[key].lastCheckoutTime = 0
+        t3 = klass.compile(source='$foo 3')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.failIf(t2.__module__ in sys.modules)
+        self.assert_(t1.__module__ in sys.modules)
+        self.assertNotEqual(klass.compile(source='$foo 2'), t2)
+
+        # evicted classes must keep working
+        gc.collect()
+        self.assertEqual(str(t2(namespaces={'foo':'x'})), 'x 2')
+
+    def test_maxBytes(self):
+        klass = self.makeTemplateClass(maxBytes=1)
+        cache = klass._CHEETAH_compileCache
+        klass.compile(source='$foo big')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size(), 0)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl(self):
+        klass = self.makeTemplateClass(ttl=60)
+        cache = klass._CHEETAH_compileCache
+        t1 = klass.compile(source='$foo ttl')
+        cache[cache.keys()[0]].lastCheckoutTime -= 120
+        self.assertNotEqual(klass.compile(source='$foo ttl'), t1)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 1)
+
+class SingleFlightCompileTest(unittest.TestCase):
+    def setUp(self):
+        self.compiled = []
+        self.blocked = threading.Event()
+        self.unblock = threading.Event()
+        test = self
+
+        class SlowCompiler(Compiler):
+            def __init__(self, source=None, *args, **kws):
+                Compiler.__init__(self, source, *args, **kws)
+                self._testSource = source
+
+            def compile(self):
+                test.compiled.append(self._testSource)
+                if 'block' in self._testSource:
+                    test.blocked.set()
+                    test.unblock.wait(5)
+                else:
+                    time.sleep(0.05)
+                Compiler.compile(self)
+
+        class CachingTemplate(Template):
+            _CHEETAH_compileCache = dict()
+            _CHEETAH_compilerClass = SlowCompiler
+        self.templateClass = CachingTemplate
+
+    def compileInThreads(self, sources):
+        results = {}
+        def compile(i, source):
+            results[i] = self.templateClass.compile(source=source)
+        threads = [threading.Thread(target=compile, args=(i, source))
+                   for i, source in enumerate(sources)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_sameSourceCompiledOnce(self):
+        threads, results = self.compileInThreads(['$foo same'] * 5)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.compiled, ['$foo same'])
+        self.assertEqual(len(set(results.values())), 1)
+        self.assertEqual(len(Template._CHEETAH_compileLocks), 0)
+
+    def test_otherSourcesAreNotBlocked(self):
+        threads, results = self.compileInThreads(['$foo block'])
+        self.assert_(self.blocked.wait(5) or self.blocked.isSet())
+        try:
+            klass = self.templateClass.compile(source='$foo free')
+            self.assertEqual(str(klass(namespaces={'foo':1})), '1 free')
+        finally:
+            self.unblock.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(str(results[0](namespaces={'foo':1})), '1 block')
+
+    def test_perKeyLocks(self):
+        locks = PerKeyLocks()
+        locks.acquire('a')
+        locks.acquire('a')
+        locks.acquire('b')
+        self.assertEqual(len(locks), 2)
+        locks.release('a')
+        locks.release('a')
+        locks.release('b')
+        self.assertEqual(len(locks), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Cheetah.CompileManifest import CompileManifest, findDependencies
+
+
+class FindDependenciesTest(unittest.TestCase):
+    def test_directives(self):
+        moduleNames, includes = findDependencies(
+            '#extends site.layout.Page\n'
+            '#import os, pages.helpers as helpers\n'
+            '  #from pages import sidebar, footer\n'
+            '#include "header.html"\n'
+            '#include raw source="footer.txt"\n'
+            '#include $dynamic\n'
+            'not #import here\n')
+        self.assertEqual(moduleNames,
+                         ['site.layout.Page', 'os', 'pages.helpers',
+                          'pages', 'pages.sidebar', 'pages.footer'])
+        self.assertEqual(includes, ['header.html', 'footer.txt'])
+
+
+class CompileManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.manifestPath = os.path.join(self.tempDir, 'manifest')
+        self.templates = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+    def write(self, name, source, moduleName=None):
+        path = os.path.join(self.tempDir, name)
+        f = open(path, 'w')
+        f.write(source)
+        f.close()
+        if moduleName:
+            self.templates[path] = moduleName
+        return path
+
+    def build(self, settingsKey=''):
+        """Returns the templates a run would rebuild, and records them as
+        built.
+        """
+        manifest = CompileManifest(self.manifestPath, settingsKey)
+        dirty = manifest.getDirty(self.templates)
+        for src in dirty:
+            manifest.update(src, self.templates)
+        manifest.save()
+        return sorted([os.path.basename(src) for src in dirty])
+
+    def test_unchanged(self):
+        self.write('a.tmpl', 'a', 'a')
+        self.write('b.tmpl', 'b', 'b')
+        self.assertEqual(self.build(), ['a.tmpl', 'b.tmpl'])
+        self.assertEqual(self.build(), [])
+        self.write('b.tmpl', 'b2', 'b')
+        self.assertEqual(self.build(), ['b.tmpl'])
+
+    def test_dependents(self):
+        self.write('layout.tmpl', 'layout', 'site.layout')
+        self.write('page.tmpl', '#extends site.layout\n', 'site.page')
+        self.write('sub.tmpl', '#from page import page\n', 'site.sub')
+        self.write('other.tmpl', 'other', 'site.other')
+        self.build()
+        self.write('layout.tmpl', 'new layout', 'site.layout')
+        self.assertEqual(self.build(), ['layout.tmpl', 'page.tmpl', 'sub.tmpl'])
+        self.write('page.tmpl', '#extends site.layout.layout\n', 'site.page')
+        self.assertEqual(self.build(), ['page.tmpl', 'sub.tmpl'])
+
+    def test_includes(self):
+        self.write('header.txt', 'header')
+        self.write('page.tmpl', '#include "header.txt"\n', 'page')
+        self.build()
+        self.assertEqual(self.build(), [])
+        self.write('header.txt', 'new header')
+        self.assertEqual(self.build(), ['page.tmpl'])
+
+    def test_settingsKey(self):
+        self.write('a.tmpl', 'a', 'a')
+        self.build('useFilters=True')
+        self.assertEqual(self.build('useFilters=True'), [])
+        self.assertEqual(self.build('useFilters=False'), ['a.tmpl'])
+
+    def test_outputExists(self):
+        self.write('a.tmpl', 'a', 'a')
+        self.build()
+        manifest = CompileManifest(self.manifestPath)
+        self.assertEqual(manifest.getDirty(self.templates, lambda src: True),
+                         set())
+        self.assertEqual(manifest.getDirty(self.templates, lambda src: False),
+                         set(self.templates))
+
+    def test_corruptManifest(self):
+        self.write('a.tmpl', 'a', 'a')
+        f = open(self.manifestPath, 'w')
+        f.write('{not json')
+        f.close()
+        self.assertEqual(self.build(), ['a.tmpl'])
+        self.assertEqual(self.build(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Cheetah.Template import Template
+from Cheetah.Compiler import _foldConstantExpr
+
+
+class ConstantFoldingTest(unittest.TestCase):
+    def assertFolds(self, expr, expected):
+        self.assertEquals(_foldConstantExpr(expr), (True, expected))
+
+    def assertDoesNotFold(self, expr):
+        self.assertEquals(_foldConstantExpr(expr), (False, None))
+
+    def test_literals(self):
+        self.assertFolds('1 + 2 * 3', 7)
+        self.assertFolds("'a' + 'b'", 'ab')
+        self.assertFolds("u'a' * 3", u'aaa')
+        self.assertFolds('not True', False)
+        self.assertFolds('(1, -2) + (3,)', (1, -2, 3))
+        self.assertFolds('1 < 2 <= 2', True)
+        self.assertFolds("'a' if 0 else 'b'", 'b')
+        self.assertFolds('0 or None', None)
+
+    def test_nonConstants(self):
+        self.assertDoesNotFold('VFSL([locals()]+SL,"x",True)')
+        self.assertDoesNotFold('[1, 2]')
+        self.assertDoesNotFold('x + 1')
+        self.assertDoesNotFold('1 / 2')
+        self.assertDoesNotFold('2 ** 100000')
+        self.assertDoesNotFold("'x' * 100000")
+        self.assertDoesNotFold('1 // 0')
+        self.assertDoesNotFold("'%s %s' % (1,)")
+        # non-ascii str literals depend on the module's encoding
+        self.assertDoesNotFold(u"'\xe9'")
+
+
+class OptimizeGeneratedCodeTest(unittest.TestCase):
+    settings = {'optimizeGeneratedCode': True}
+
+    def compile(self, source, **settings):
+        compilerSettings = dict(self.settings)
+        compilerSettings.update(settings)
+        klass = Template.compile(source, compilerSettings=compilerSettings,
+                                 keepRefToGeneratedCode=True)
+        return klass, klass._CHEETAH_generatedModuleCode
+
+    def test_mergesStaticText(self):
+        klass, code = self.compile('a ## comment\nb #slurp\nc\n#* x *#d')
+        self.assertEquals(code.count("write(u'''"), 1)
+        self.assertEquals(str(klass()), 'a \nb c\nd')
+
+    def test_deadBranches(self):
+        klass, code = self.compile('#if False\nno\n#elif 1 + 1 == 2\nyes\n#else\nno\n#end if\n'
+                                   '#unless True\nno\n#end unless\n'
+                                   "#if None then 'no' else 'maybe'")
+        self.failUnless('if 0:' in code)
+        self.failUnless('elif 1:' in code)
+        self.assertEquals(str(klass()), 'yes\nmaybe')
+
+    def test_foldedPlaceholdersAndSet(self):
+        klass, code = self.compile('#set x = 6 * 7\n$x $(2 + 3) $*("a" + "b") $None!')
+        self.failUnless('x = 42' in code)
+        self.failUnless('write(_filter(5' in code)
+        self.failIf('CacheRegion(' in code)
+        self.assertEquals(str(klass()), '42 5 ab !')
+
+    def test_hoistsLongText(self):
+        text = 'x' * 50
+        klass, code = self.compile('#def foo\n%s\n#end def\n#def bar\n%s\n#end def\n$foo$bar'
+                                   % (text, text), hoistStrConstsLongerThan=20)
+        self.assertEquals(code.count(text), 1)
+        self.assertEquals(code.count('write(_CHEETAH_strConst1)'), 2)
+        self.assertEquals(str(klass()), (text + '\n') * 2)
+
+    def test_streaming(self):
+        klass, code = self.compile('a ## comment\nb\n$x c\n#stop\nd',
+                                   generateStreamingMethods=True)
+        chunks = list(klass(namespaces={'x':1}).iterRender(flushThreshold=1))
+        self.assertEquals(chunks, ['a \nb\n', '1', ' c\n'])
+
+    def test_disabledByDefault(self):
+        code = Template.compile('#set x = 1 + 2\n#if True\n$x ## c\n#end if\n',
+                                returnAClass=False)
+        self.failUnless('x = 1 + 2' in code)
+        self.failUnless('if True:' in code)
+
+
+class LocalVarFastPathTest(unittest.TestCase):
+    def compile(self, source):
+        klass = Template.compile(source, keepRefToGeneratedCode=True,
+                                 compilerSettings={'useLocalVarFastPath': True})
+        return klass, klass._CHEETAH_generatedModuleCode
+
+    def verify(self, source, namespaces, expected):
+        """Checks the output with and without useLocalVarFastPath.
+        """
+        klass, code = self.compile(source)
+        self.assertEquals(str(klass(namespaces=namespaces)), expected)
+        self.assertEquals(str(Template(source, namespaces=namespaces)), expected)
+        return code
+
+    def test_forLoop(self):
+        code = self.verify('#for $k, $v in $pairs\n$k=$v.title() #end for\n',
+                           {'pairs': [('a', 'x'), ('b', 'y')]}, 'a=X b=Y \n')
+        self.failUnless('AUTOCALL(k)' in code)
+        self.failUnless('VFN(AUTOCALL(v),"title",False)()' in code)
+
+    def test_autocalling(self):
+        class Item:
+            def name(self):
+                return 'item'
+        def one():
+            return 1
+        self.verify('#for $f in $funcs\n$f #end for\n'
+                    '#for $i in $objs\n$i.name $i.name() #end for\n',
+                    {'funcs': [one], 'objs': [Item()]}, '1 \nitem item \n')
+
+    def test_defArgsSetAndCapture(self):
+        code = self.verify('#def foo($a, *args)\n#set b = $a * 2\n'
+                           '#capture c\n$b#end capture\n$a $b $c $args\n#end def\n'
+                           '$foo(1, 2)', {}, '\n1 2 2 (2,)\n')
+        self.failIf('"a"' in code or '"b"' in code or '"c"' in code)
+
+    def test_blockScope(self):
+        # a variable bound in a block might not be bound after it, so it's
+        # looked up with NameMapper, which falls back to the searchList
+        code = self.verify('#if $flag\n#set x = 1\n#end if\n$x '
+                           '#for $y in []\n#end for\n$y',
+                           {'flag': False, 'x': 'sl', 'y': 'sl'}, 'sl sl')
+        self.failUnless('"x"' in code)
+        self.failUnless('"y"' in code)
+
+    def test_del(self):
+        self.verify('#set x = 1\n$x\n#del x\n$x', {'x': 'sl'}, '1\nsl')
+
+    def test_notBeforeBinding(self):
+        self.verify('$x\n#set x = 1\n$x', {'x': 'sl'}, 'sl\n1')
+
+class ProfileRenderingTest(unittest.TestCase):
+    source = ('#def greet($who)\nHello $who!\n#end def\n'
+              '#for $i in range(3)\n$greet($name)\n#end for\n'
+              '#block footer\n$name#end block\n')
+
+    def render(self, source, **settings):
+        klass = Template.compile(source, compilerSettings=settings,
+                                 keepRefToGeneratedCode=True)
+        t = klass(namespaces={'name': 'bob'})
+        return t, str(t), klass._CHEETAH_generatedModuleCode
+
+    def entries(self, profiler):
+        return dict([((entry.kind, entry.name), entry)
+                     for entry in profiler.entries()])
+
+    def test_offByDefault(self):
+        t, output, code = self.render(self.source)
+        self.failIf('profileTimer' in code or '_profiler' in code)
+        self.assertEquals(t.getProfiler().entries(), [])
+
+    def test_methods(self):
+        t, output, code = self.render(self.source, profileRendering=True)
+        self.assertEquals(output, str(Template(self.source, namespaces={'name': 'bob'})))
+        entries = self.entries(t.getProfiler())
+        self.assertEquals(sorted(entries.keys()),
+                          [('method', 'footer'), ('method', 'greet'),
+                           ('method', 'respond')])
+        greet = entries[('method', 'greet')]
+        self.assertEquals((greet.line, greet.col, greet.count), (1, 1, 3))
+        self.assertEquals(entries[('method', 'footer')].line, 7)
+        self.assertEquals(entries[('method', 'respond')].line, None)
+        self.failUnless(entries[('method', 'respond')].total >= greet.total)
+
+    def test_placeholders(self):
+        t, output, code = self.render(self.source, profilePlaceholders=True)
+        entries = self.entries(t.getProfiler())
+        self.failIf(('method', 'greet') in entries)
+        who = entries[('placeholder', '$who')]
+        self.assertEquals((who.line, who.col, who.count), (2, 7, 3))
+        self.assertEquals(entries[('placeholder', '$greet($name)')].line, 5)
+        report = t.getProfiler().report(2)
+        self.failUnless('top 2 placeholders' in report)
+        self.assertEquals(len(report.strip().splitlines()), 4)
+
+        lines = dict(t.getProfiler().byLine())
+        self.assertEquals(sorted([line for source, line in lines]), [2, 5, 8])
+
+    def test_streaming(self):
+        settings = {'profileRendering': True, 'profilePlaceholders': True,
+                    'generateStreamingMethods': True}
+        t, output, code = self.render(self.source, **settings)
+        t.getProfiler().reset()
+        self.assertEquals(''.join(t.iterRender('respond', flushThreshold=1)), output)
+        entries = self.entries(t.getProfiler())
+        self.assertEquals(entries[('placeholder', '$who')].count, 3)
+        self.assertEquals(entries[('method', 'respond')].count, 1)
+
+    def test_classmethodsAreSkipped(self):
+        source = '#@classmethod\n#def foo($bar)\n$bar#end def\n$foo(1)'
+        t, output, code = self.render(source, profileRendering=True,
+                                      profilePlaceholders=True)
+        self.assertEquals(sorted(self.entries(t.getProfiler()).keys()),
+                          [('method', 'respond'), ('placeholder', '$foo(1)')])
+
+    def test_include(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, 'included.tmpl')
+            fp = open(path, 'w')
+            fp.write('[$name]')
+            fp.close()
+            class ProfiledTemplate(Template):
+                _CHEETAH_compilerSettings = {'profileRendering': True,
+                                             'profilePlaceholders': True}
+            t = ProfiledTemplate('a\n#include $path\n', namespaces={'name': 'x', 'path': path})
+            self.assertEquals(str(t), 'a\n[x]')
+            entries = self.entries(t.getProfiler())
+            include = entries[('include', '$path')]
+            self.assertEquals(include.line, 2)
+            # the included template records its timings in the same profiler
+            nested = t._CHEETAH__cheetahIncludes.values()[0]
+            self.failUnless(nested.getProfiler() is t.getProfiler())
+        finally:
+            shutil.rmtree(tempDir, True)
+
+class LazyImportsTest(unittest.TestCase):
+    def compile(self, source, **settings):
+        compilerSettings = {'lazyImports': True}
+        compilerSettings.update(settings)
+        klass = Template.compile(source, compilerSettings=compilerSettings,
+                                 keepRefToGeneratedCode=True)
+        code = klass._CHEETAH_generatedModuleCode
+        return klass, code[:code.index('## CLASSES')]
+
+    def test_staticText(self):
+        klass, header = self.compile('Hello world')
+        for unused in ('import os', 'import time', 'import sys', 'Filters',
+                       'ErrorCatchers', 'CacheRegion', 'NameMapper', 'VFFSL'):
+            self.failIf(unused in header, unused)
+        self.failUnless('from Cheetah.Template import Template' in header)
+        self.assertEquals(str(klass()), 'Hello world')
+
+    def test_usedFeatures(self):
+        klass, header = self.compile('#cache timer="1s"\n$name\n#end cache\n'
+                                     '#errorCatcher Echo\n$missing\n',
+                                     useStackFrames=False)
+        self.failUnless('import Cheetah.ErrorCatchers as ErrorCatchers' in header)
+        self.failUnless('VFSL=valueFromSearchList' in header)
+        self.failUnless('currentTime=time.time' in header)
+        self.failUnless('import time' in header)
+        self.failIf('import os' in header)
+        self.assertEquals(str(klass(namespaces={'name': 'x'})),
+                          'x\n$missing\n')
+
+    def test_moduleGlobalsInPlaceholders(self):
+        klass, header = self.compile('$time.strftime("%Y", $time.gmtime(0)) '
+                                     '#set module x = os.sep\n$x')
+        self.failUnless('import os' in header)
+        self.assertEquals(str(klass()), '1970 \n' + os.sep)
+
+    def test_disabledByDefault(self):
+        code = Template.compile('Hello world', returnAClass=False)
+        self.failUnless('import Cheetah.Filters as Filters' in code)
+        self.failUnless('VFFSL=valueFromFrameOrSearchList' in code)
+
+if __name__ == '__main__':
+    unittest.main()
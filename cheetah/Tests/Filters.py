@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import pickle
 import sys
 import unittest
 
@@ -66,5 +67,75 @@ def foo(self):
         assert template, (template, 'We should have some content here...')
 
 
+class WebSafeFilterTest(unittest.TestCase):
+    '''
+        Test WebSafe, which is implemented in C when _filters.c has been
+        compiled
+    '''
+    def setUp(self):
+        self.filter = Cheetah.Filters.WebSafe().filter
+
+    def test_Escaping(self):
+        self.assertEquals(self.filter('<a href="x">&</a>'),
+                          u'&lt;a href="x"&gt;&amp;&lt;/a&gt;')
+        self.assertEquals(self.filter(u'\u1234 < 1'), u'\u1234 &lt; 1')
+        self.assertEquals(self.filter('nothing to escape'), u'nothing to escape')
+
+    def test_Coercion(self):
+        self.assertEquals(self.filter(None), u'')
+        self.assertEquals(self.filter(1234, rawExpr='$foo'), u'1234')
+        self.assert_(isinstance(self.filter('foo'), unicode))
+        # undecodable strs are passed on as str
+        self.assertEquals(self.filter('\xff<'), '\xff&lt;')
+
+    def test_Also(self):
+        self.assertEquals(self.filter('a "b"', also=' "'),
+                          u'a&nbsp;&quot;b&quot;')
+        self.assertEquals(self.filter('a#b', also='#'), u'a&#35;b')
+
+    def test_AlsoRebound(self):
+        entities = Cheetah.Filters.webSafeEntities
+        Cheetah.Filters.webSafeEntities = {'#': '&num;'}
+        try:
+            self.assertEquals(self.filter('a #b', also='#'), u'a &num;b')
+        finally:
+            Cheetah.Filters.webSafeEntities = entities
+
+    def test_Template(self):
+        template = Cheetah.Template.Template('#filter WebSafe\n$foo#end filter',
+                                             searchList=[{'foo' : '<b>'}])
+        self.assertEquals(str(template), '&lt;b&gt;')
+
+    def test_Subclass(self):
+        class Upper(Cheetah.Filters.WebSafe):
+            def __init__(self, template=None):
+                super(Upper, self).__init__(template)
+                self.calls = 0
+            def filter(self, val, **kw):
+                self.calls += 1
+                return super(Upper, self).filter(val, **kw).upper()
+        upper = Upper('template')
+        self.assertEquals(upper.filter('<b>'), u'&LT;B&GT;')
+        self.assertEquals(upper.template, 'template')
+        self.assertEquals(upper.calls, 1)
+
+    def test_MaxLen(self):
+        maxLen = Cheetah.Filters.MaxLen()
+        self.assertEquals(maxLen.filter('abcd', maxlen=2), u'ab')
+        self.assertEquals(maxLen.template, None)
+
+    def test_Pickle(self):
+        for filterClass in (Cheetah.Filters.Filter, Cheetah.Filters.WebSafe,
+                            Cheetah.Filters.MaxLen):
+            for protocol in (0, 1, 2):
+                f = filterClass('template')
+                f.extra = 1
+                copy = pickle.loads(pickle.dumps(f, protocol))
+                self.assert_(type(copy) is filterClass)
+                self.assertEquals(copy.template, 'template')
+                self.assertEquals(copy.extra, 1)
+                self.assertEquals(copy.filter('<a>'), f.filter('<a>'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,7 +7,8 @@ import os.path
 
 import unittest
 from Cheetah.NameMapper import NotFound, valueForKey, \
-     valueForName, valueFromSearchList, valueFromFrame, valueFromFrameOrSearchList
+     valueForName, valueFromSearchList, valueFromFrame, valueFromFrameOrSearchList, \
+     valueFromFrameOrSearchListCached, autoCall
 
 
 class DummyClass(object):
@@ -526,8 +527,58 @@ class VFFSL_3(VFFSL):
 class VFFSL_4(VFFSL):
     _searchListLength = 4
 
+class VFFSLC(VFFSL):
+    def VFFSL(self, searchList, name, autocall=True):
+        anInt = 1
+        none = 'some'
+        slotCache = self.__dict__.setdefault('_slotCache', {})
+        nameChunks = tuple(name.split('.'))
+        searchList = list(searchList)
+        # the second lookup is served from the slot cache
+        valueFromFrameOrSearchListCached(searchList, slotCache, nameChunks, autocall)
+        return valueFromFrameOrSearchListCached(searchList, slotCache, nameChunks, autocall)
+
+    def test_slotCache(self):
+        slotCache = {}
+        first, second = {'a':1}, {'b':2}
+        searchList = [first, DummyClass(), second]
+        VFFSLC = valueFromFrameOrSearchListCached
+        assert VFFSLC(searchList, slotCache, ('b',)) == 2
+        assert slotCache['b'] == 2
+        assert VFFSLC(searchList, slotCache, ('len',)) == len
+        assert slotCache['len'] == -1
+
+        # a mapping earlier in the searchList gains the name
+        first['b'] = 3
+        assert VFFSLC(searchList, slotCache, ('b',)) == 3
+        assert slotCache['b'] == 0
+        # and loses it again
+        del first['b']
+        assert VFFSLC(searchList, slotCache, ('b',)) == 2
+
+        b = 'local'
+        assert VFFSLC(searchList, slotCache, ('b',)) == 'local'
+
+    def test_notFound(self):
+        slotCache = {}
+        try:
+            valueFromFrameOrSearchListCached([{'a':{}}], slotCache, ('a', 'b'))
+        except NotFound, e:
+            assert str(e) == "cannot find 'b' while searching for 'a.b'", str(e)
+        else:
+            self.fail('NotFound not raised')
+        self.assertRaises(NotFound, valueFromFrameOrSearchListCached,
+                          [{}], slotCache, ('missingName',))
+
+class VFFSLC_2(VFFSLC):
+    _searchListLength = 2
+
+class VFFSLC_4(VFFSLC):
+    _searchListLength = 4
+
 if sys.platform.startswith('java'):
     del VFF, VFFSL, VFFSL_2, VFFSL_3, VFFSL_4
+    del VFFSLC, VFFSLC_2, VFFSLC_4
 
 
 class MapBuiltins(unittest.TestCase):
@@ -540,6 +591,20 @@ class MapBuiltins(unittest.TestCase):
         self.assertEquals(5, t.intify('5'))
 
 
+class AutoCall(unittest.TestCase):
+    def test_callables(self):
+        obj = DummyClass()
+        self.assertEquals(autoCall(obj.meth), 'arff')
+        self.assertEquals(autoCall(lambda: 1), 1)
+
+    def test_nonCallables(self):
+        obj = DummyClass()
+        self.assert_(autoCall(obj) is obj)
+        self.assert_(autoCall(DummyClass) is DummyClass)
+        self.assert_(autoCall(dict) is dict)
+        self.assertEquals(autoCall(1), 1)
+        self.assertEquals(autoCall(None), None)
+
 
 ##################################################
 ## if run from the command line ##
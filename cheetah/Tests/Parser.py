@@ -3,6 +3,7 @@
 import unittest
 
 from Cheetah import Parser
+from Cheetah.Template import Template
 
 class ArgListTest(unittest.TestCase):
     def setUp(self):
@@ -44,6 +45,27 @@ class ArgListTest(unittest.TestCase):
 
         self.assertEquals(expect, self.al.merge())
 
+class PlainTextTest(unittest.TestCase):
+    def render(self, source, **settings):
+        return str(Template(source, searchList=[{'x': 'X'}],
+                            compilerSettings=settings))
+
+    def test_longPlainText(self):
+        text = '<p>100% plain, no tokens</p>\n' * 2000
+        self.assertEquals(text + 'X', self.render(text + '$x'))
+
+    def test_nearMisses(self):
+        source = 'a $ b #! c \\$x \\#if d $1 ## e\n#* f *#g\n$x'
+        self.assertEquals('a $ b #! c $x #if d $1 \ng\nX', self.render(source))
+
+    def test_customTokens(self):
+        source = 'a.b|c ^.x ^|if True|yes^|end if|.|*comment\n'
+        self.assertEquals('a.b|c X yes\n', self.render(source,
+                          cheetahVarStartToken='^.',
+                          directiveStartToken='^|',
+                          directiveEndToken='|',
+                          commentStartToken='.|*'))
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import unittest
+
+from Cheetah.SourceReader import SourceReader
+
+
+class LineIndexTest(unittest.TestCase):
+    sources = ['', 'one line', 'a\n', 'a\nbc\n\nd', 'a\r\nb\rc\n\r\n',
+               '\n\n', 'x\x0cy\nz']
+
+    def bruteForceRowCol(self, src, pos):
+        before = src[:pos]
+        BOL = max(before.rfind('\n'), before.rfind('\r')) + 1
+        row = 1
+        i = 0
+        while i < BOL:
+            if src[i] == '\r' and src[i+1:i+2] == '\n':
+                i += 1
+            if src[i] in '\r\n':
+                row += 1
+            i += 1
+        return row, pos - BOL + 1
+
+    def test_getRowCol(self):
+        for src in self.sources:
+            reader = SourceReader(src)
+            for pos in range(len(src) + 1):
+                if reader.lineNum(pos) is None:
+                    # the middle of a \r\n, after the final line break or
+                    # an empty source
+                    self.failUnless(src[pos-1:pos] in ('\r', '\n', ''),
+                                    (src, pos))
+                    continue
+                self.assertEqual(reader.getRowCol(pos),
+                                 self.bruteForceRowCol(src, pos), (src, pos))
+
+    def test_findBOL(self):
+        for src in self.sources:
+            reader = SourceReader(src)
+            for pos in range(len(src) + 1):
+                before = src[:pos]
+                self.assertEqual(reader.findBOL(pos),
+                                 max(before.rfind('\n'), before.rfind('\r')) + 1)
+
+    def test_splitlines(self):
+        reader = SourceReader('a\r\nb\rc\n\nd')
+        self.assertEqual(reader.splitlines(), ['a', 'b', 'c', '', 'd'])
+        self.assertEqual(reader.getLine(6), 'c')
+        self.assertEqual(reader.getRowColLine(8), (5, 1, 'd'))
+        # only the line breaks the parser knows about split lines
+        self.assertEqual(SourceReader(u'a\x0cb\u2028c').splitlines(),
+                         [u'a\x0cb\u2028c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
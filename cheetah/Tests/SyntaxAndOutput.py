@@ -135,6 +135,8 @@ Template output mismatch:
     #_useNewStyleCompilation = False
 
     _extraCompileKwArgs = None
+    _extraCompilerSettings = None
+    _useIterRender = False
 
     def searchList(self):
         return self._searchList
@@ -156,7 +158,7 @@ Template output mismatch:
             
             templateClass = Template.compile(
                 source=input,
-                compilerSettings=self._getCompilerSettings(),
+                compilerSettings=self._allCompilerSettings(),
                 keepRefToGeneratedCode=True,
                 **extraKwArgs
                 )
@@ -167,19 +169,27 @@ Template output mismatch:
             self.template = templateObj = Template(
                 input,
                 searchList=self.searchList(),
-                compilerSettings=self._getCompilerSettings(),
+                compilerSettings=self._allCompilerSettings(),
                 )
             moduleCode = templateObj._CHEETAH_generatedModuleCode
         if self.DEBUGLEV >= 1:
             print(moduleCode)
         try:
-            output = templateObj.respond() # rather than __str__, because of unicode
+            if self._useIterRender:
+                output = u''.join(templateObj.iterRender('respond', flushThreshold=1))
+            else:
+                output = templateObj.respond() # rather than __str__, because of unicode
             assert output==expectedOutput, self._outputMismatchReport(output, expectedOutput)
         finally:
             templateObj.shutdown()
 
     def _getCompilerSettings(self):
         return {}
+
+    def _allCompilerSettings(self):
+        settings = dict(self._getCompilerSettings() or {})
+        settings.update(self._extraCompilerSettings or {})
+        return settings
             
     def _outputMismatchReport(self, output, expectedOutput):
         if self._debugEOLReplacement and self._EOLreplacement:
@@ -3240,6 +3250,29 @@ def install_eols():
             src += " _extraCompileKwArgs = extraCompileKwArgsForDiffBaseclass"
             exec(src, globals())
 
+        if issubclass(klass, OutputTest):
+            src = r"class %(name)s_CompiledNameLookups(%(name)s): "%locals()
+            src += " _extraCompilerSettings = {'useCompiledNameLookups': True}"
+            exec(src, globals())
+            src = r"class %(name)s_Streaming(%(name)s): "%locals()
+            src += " _extraCompilerSettings = {'generateStreamingMethods': True}; _useIterRender = True"
+            exec(src, globals())
+            src = r"class %(name)s_Optimized(%(name)s): "%locals()
+            src += " _extraCompilerSettings = {'optimizeGeneratedCode': True, 'hoistStrConstsLongerThan': 10}"
+            exec(src, globals())
+            src = r"class %(name)s_LocalVarFastPath(%(name)s): "%locals()
+            src += " _extraCompilerSettings = {'useLocalVarFastPath': True}"
+            exec(src, globals())
+            src = r"class %(name)s_Profiled(%(name)s): "%locals()
+            src += " _extraCompilerSettings = {'profileRendering': True, 'profilePlaceholders': True}"
+            exec(src, globals())
+            src = r"class %(name)s_LazyImports(%(name)s): "%locals()
+            src += " _extraCompilerSettings = {'lazyImports': True}"
+            exec(src, globals())
+            src = r"class %(name)s_AsyncPlaceholders(%(name)s): "%locals()
+            src += " _extraCompilerSettings = {'asyncPlaceholders': True}"
+            exec(src, globals())
+
         del name
         del klass
 
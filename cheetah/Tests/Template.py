@@ -9,6 +9,7 @@ import tempfile
 import shutil
 import unittest
 from Cheetah.Template import Template
+from Cheetah.DummyTransaction import DummyTransaction
 
 majorVer, minorVer = sys.version_info[0], sys.version_info[1]
 versionTuple = (majorVer, minorVer)
@@ -356,6 +357,263 @@ class SubclassSearchListTest(TemplateTest):
         tmpl = Sub('''When we meet, I say "${greeting}"''')
         self.assertEquals(unicode(tmpl), 'When we meet, I say "Hola"')
 
+class IterRenderTest(TemplateTest):
+    def _streamingClass(self, source, **settings):
+        settings['generateStreamingMethods'] = True
+        return Template.compile(source, compilerSettings=settings)
+
+    def test_yieldsChunks(self):
+        klass = self._streamingClass('''#for i in range(3)
+line $i
+#end for
+#if True
+#stop
+#end if
+never''')
+        chunks = list(klass().iterRender(flushThreshold=1))
+        self.assert_(len(chunks) > 1, chunks)
+        self.assertEquals(u''.join(chunks), u'line 0\nline 1\nline 2\n')
+
+    def test_flushThreshold(self):
+        klass = self._streamingClass('a $x b $x c')
+        chunks = list(klass(namespaces={'x':'y'}).iterRender(flushThreshold=1000))
+        self.assertEquals(chunks, [u'a y b y c'])
+
+    def test_matchesStr(self):
+        klass = self._streamingClass('#def foo\nfoo\n#end def\n$foo, $foo()')
+        t = klass()
+        self.assertEquals(u''.join(t.iterRender(flushThreshold=1)), unicode(t))
+        self.assertEquals(u''.join(t.iterRender('foo', flushThreshold=1)), u'foo\n')
+
+    def test_notStreamable(self):
+        klass = self._streamingClass('#def foo\n#return 1\n#end def\nx $foo')
+        self.failIf(hasattr(klass, '_CHEETAH_streaming_foo'))
+        self.assert_(hasattr(klass, '_CHEETAH_streaming_respond'))
+
+        klass = Template.compile('a $x')
+        self.failIf(hasattr(klass, '_CHEETAH_streaming_respond'))
+        self.assertEquals(list(klass(namespaces={'x':1}).iterRender()), [u'a 1'])
+
+    def test_overriddenMethod(self):
+        klass = self._streamingClass('streamed')
+        class Sub(klass):
+            def respond(self, trans=None):
+                return u'overridden'
+        self.assertEquals(list(Sub().iterRender(flushThreshold=1)), [u'overridden'])
+
+    def test_encoding(self):
+        klass = self._streamingClass(u'\u00e9 $x')
+        chunks = list(klass(namespaces={'x':1}).iterRender(encoding='utf-8'))
+        self.assertEquals(''.join(chunks), '\xc3\xa9 1')
+        self.failIf([c for c in chunks if isinstance(c, unicode)])
+
+class OutputBufferTest(TemplateTest):
+    def test_nestedAndLoopedRegions(self):
+        source = ('#def wrap(body, tag="b")\n<$tag>$body</$tag>#slurp\n#end def\n'
+                  '#for i in range(3)\n'
+                  '#capture c\n'
+                  '#call self.wrap\n$i#slurp\n'
+                  '#call self.wrap\n#arg body\n[$i]#slurp\n#arg tag\ni#slurp\n'
+                  '#end call\n'
+                  '#end call\n'
+                  '#end capture\n'
+                  '#cache\ncached$i #slurp\n#end cache\n'
+                  '$c\n#end for\n')
+        t = Template(source)
+        expected = ('cached0 <b>0<i>[0]</i></b>\n'
+                    'cached0 <b>1<i>[1]</i></b>\n'
+                    'cached0 <b>2<i>[2]</i></b>\n')
+        self.assertEquals(str(t), expected)
+        self.assertEquals(str(t), expected)
+        self.failIf(t._CHEETAH__isBuffering)
+        # the two nested #call regions and the #capture needed three buffers,
+        # which were reused for every iteration and the second render
+        self.assertEquals(len(t._CHEETAH__outputBuffers), 3)
+
+    def test_noTransactionPerRegion(self):
+        source = '#capture c\n#call str\nx#slurp\n#end call\n#end capture\n'
+        count = lambda source: Template.compile(
+            source, returnAClass=False).count('DummyTransaction()')
+        self.assertEquals(count(source), count('x'))
+
+    def test_pushPop(self):
+        t = Template('x')
+        trans = DummyTransaction()
+        buf = t._pushOutputBuffer(trans)
+        self.assert_(t._CHEETAH__isBuffering)
+        buf.write(u'a')
+        buf.response().write(u'b')
+        self.assertEquals(t._popOutputBuffer(buf), (u'ab', trans))
+        self.failIf(t._CHEETAH__isBuffering)
+        self.assert_(t._pushOutputBuffer(trans, False) is buf)
+        self.failIf(t._CHEETAH__isBuffering)
+        self.assertEquals(buf.getvalue(), u'')
+
+class Future(object):
+    """The parts of the concurrent.futures/asyncio Future API that
+    Template.renderAsync() uses."""
+    def __init__(self):
+        self._callbacks = []
+        self._done = False
+        self._result = self._exception = None
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        self._done = True
+        for fn in self._callbacks:
+            fn(self)
+
+    def add_done_callback(self, fn):
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise RuntimeError('not done')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+class AsyncRenderTest(TemplateTest):
+    source = ('#def item($id)\n<li>$fetch($id)</li>#slurp\n#end def\n'
+              '#def wrap($body)\n[$body]#slurp\n#end def\n'
+              '$fetch(1) $fetch(2, "<b>")\n'
+              '#capture c\n$item(3)#slurp\n#end capture\n'
+              '#call $wrap\n$fetch(4)#slurp\n#end call\n'
+              '#filter RawOrEncodedUnicode\n$fetch(5, "<i>")#slurp\n#end filter\n'
+              ' $c\n')
+
+    def setUp(self):
+        self.futures = {}
+        def fetch(id, html=''):
+            future = self.futures[id] = Future()
+            return future
+        self.klass = Template.compile(self.source, compilerSettings={
+            'asyncPlaceholders': True})
+        self.t = self.klass(namespaces={'fetch': fetch}, filter='WebSafe')
+
+    def finish(self, ids=None):
+        for id, future in sorted(self.futures.items(), reverse=True):
+            if ids is None or id in ids:
+                future.set_result('%d<' % id)
+
+    def expected(self):
+        # the same as when the values don't have to be waited for
+        t = self.klass(namespaces={'fetch': lambda id, html='': '%d<' % id},
+                       filter='WebSafe')
+        return unicode(t)
+
+    def test_renderAsync(self):
+        output = self.t.renderAsync()
+        # all the calls were made before any was waited for
+        self.assertEquals(sorted(self.futures), [1, 2, 3, 4, 5])
+        self.failIf(output.done())
+        results = []
+        output.add_done_callback(lambda output: results.append(output.result()))
+        self.finish([2, 3, 4, 5])
+        self.assertEquals(results, [])
+        self.failIf(output.done())
+        self.finish([1])
+        self.assert_(output.done())
+        self.assertEquals(results, [self.expected()])
+
+    def test_synchronous(self):
+        output = self.t.respond()
+        self.finish()
+        self.assertEquals(output.result(), self.expected())
+        # str() waits, which futures that block in result() would do
+        self.assertRaises(RuntimeError, str, self.t)
+        self.t.rebind(namespaces={'fetch': lambda id, html='': '%d<' % id})
+        self.assertEquals(unicode(self.t), self.expected())
+
+    def test_error(self):
+        output = self.t.renderAsync()
+        self.finish()
+        self.futures[4]._exception = ValueError('failed')
+        self.assertRaises(ValueError, output.result)
+
+    def test_notDeferred(self):
+        t = Template('$fetch()', namespaces={'fetch': lambda: 1},
+                     compilerSettings={'asyncPlaceholders': True})
+        output = t.renderAsync()
+        self.assert_(output.done())
+        self.assertEquals(output.result(), u'1')
+        self.assertEquals(Template('x').renderAsync().result(), u'x')
+
+    def test_outputEncoding(self):
+        future = Future()
+        t = Template.compile(u'\u00e9 $fetch()', compilerSettings={
+            'asyncPlaceholders': True, 'outputEncoding': 'utf-8'})(
+            namespaces={'fetch': lambda: future})
+        output = t.renderAsync()
+        future.set_result(u'\u00e0')
+        self.assertEquals(output.result(), '\xc3\xa9 \xc3\xa0')
+
+    def test_cache(self):
+        for cacheArgs in ('', ' lock=True'):
+            klass = Template.compile(
+                '#cache%s\n<$fetch(1)>#slurp\n#end cache\n' % cacheArgs,
+                compilerSettings={'asyncPlaceholders': True})
+            t = klass(namespaces={'fetch': lambda id: self.futures[id]},
+                      filter='WebSafe')
+            self.futures[1] = Future()
+            output = t.renderAsync()
+            self.finish()
+            self.assertEquals(output.result(), u'<1&lt;>')
+            # the resolved output was cached, not the DeferredOutput
+            del self.futures[1]
+            self.assertEquals(t.renderAsync().result(), u'<1&lt;>')
+            self.assertEquals(str(t), '<1&lt;>')
+            if cacheArgs:
+                region = t._CHEETAH__cacheRegions.values()[0]
+                self.failIf(region._cacheItems.values()[0].isLeased())
+
+    def test_callTarget(self):
+        calls = []
+        def wrap(body, tag='b'):
+            calls.append(body)
+            return '<%s>%s</%s>' % (tag, body, tag)
+        future = Future()
+        t = Template.compile(
+            '#call $wrap\nA $fetch() B#slurp\n#end call\n'
+            '#call $wrap\n#arg tag\ni#slurp\n#arg body\n$fetch()#slurp\n#end call\n',
+            compilerSettings={'asyncPlaceholders': True})(
+            namespaces={'fetch': lambda: future, 'wrap': wrap})
+        output = t.renderAsync()
+        # the target is only called once its body is done
+        self.assertEquals(calls, [])
+        future.set_result('x')
+        self.assertEquals(output.result(), u'<b>A x B</b><i>x</i>')
+        self.assertEquals(calls, ['A x B', 'x'])
+
+    def test_capture(self):
+        future = Future()
+        t = Template.compile(
+            '#capture c\n$fetch()#slurp\n#end capture\n[$c]#slurp\n',
+            compilerSettings={'asyncPlaceholders': True})(
+            namespaces={'fetch': lambda: future})
+        output = t.renderAsync()
+        future.set_result('x')
+        self.assertEquals(output.result(), u'[x]')
+        # a deferred capture can't be used as text before it is done
+        t = Template.compile(
+            '#capture c\n$fetch()#slurp\n#end capture\n$str($c)',
+            compilerSettings={'asyncPlaceholders': True})(
+            namespaces={'fetch': lambda: Future()})
+        self.assertRaises(TypeError, t.renderAsync)
+
 ##################################################
 ## if run from the command line ##
         
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import linecache
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+import unittest
+
+from Cheetah.Template import Template
+from Cheetah import TemplateArchive
+
+
+class TemplateArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, 'templates.cta')
+        self.importers = []
+        self.sysPath = sys.path[:]
+
+    def tearDown(self):
+        sys.path[:] = self.sysPath
+        for importer in self.importers:
+            TemplateArchive.uninstall(importer)
+            importer.close()
+        for name in sys.modules.keys():
+            if name.startswith('archived_'):
+                del sys.modules[name]
+        shutil.rmtree(self.tempDir, True)
+
+    def write(self, templates, path=None):
+        writer = TemplateArchive.ArchiveWriter(path or self.path)
+        for moduleName, source in templates:
+            className = moduleName.split('.')[-1]
+            writer.add(moduleName, Template.compile(
+                source, returnAClass=False, moduleName=className,
+                className=className))
+        writer.close()
+
+    def install(self, path=None):
+        importer = TemplateArchive.install(path or self.path)
+        self.importers.append(importer)
+        return importer
+
+    def test_import(self):
+        self.write([('archived_a', 'Hello $name'),
+                    ('archived_pkg.sub.b',
+                     '#extends archived_a\n#implements respond\nBye')])
+        reader = TemplateArchive.ArchiveReader(self.path)
+        self.assertEqual(sorted(reader.moduleNames()),
+                         ['archived_a', 'archived_pkg.sub.b'])
+        self.assert_(reader.isPackage('archived_pkg.sub'))
+        reader.close()
+
+        self.install()
+        self.failIf('archived_a' in sys.modules)
+        from archived_pkg.sub.b import b
+        self.assert_('archived_a' in sys.modules)
+        self.assertEqual(str(b()), 'Bye')
+        from archived_a import archived_a
+        self.assertEqual(str(archived_a(namespaces={'name': 'x'})), 'Hello x')
+        self.assert_(sys.modules['archived_pkg'].__path__ == [])
+
+    def test_realPackage(self):
+        # templates compiled into archived_app/templates/ must not hide the
+        # rest of the archived_app package
+        appDir = os.path.join(self.tempDir, 'archived_app')
+        os.mkdir(appDir)
+        for name, code in (('__init__.py', ''), ('models.py', 'x = 1\n')):
+            fp = open(os.path.join(appDir, name), 'w')
+            fp.write(code)
+            fp.close()
+        sys.path.insert(0, self.tempDir)
+        self.write([('archived_app.templates.t', 't')])
+        self.install()
+        import archived_app.models
+        self.assertEqual(archived_app.models.x, 1)
+        self.assertEqual(sys.modules['archived_app'].__path__, [appDir])
+        from archived_app.templates.t import t
+        self.assertEqual(str(t()), 't')
+        self.assertEqual(sys.modules['archived_app.templates'].__path__, [])
+
+    def test_traceback(self):
+        self.write([('archived_broken', '#def f\n$nothere\n#end def\n$f()')])
+        self.install()
+        from archived_broken import archived_broken
+        try:
+            str(archived_broken())
+        except Exception:
+            tb = traceback.format_exc()
+        else:
+            self.fail('expected NotFound')
+        # the line of generated code is shown, so get_source() works
+        self.assert_('"nothere"' in tb)
+        source = self.importers[0].get_source('archived_broken')
+        self.assert_('nothere' in source)
+        fileName = sys.modules['archived_broken'].__file__
+        linecache.checkcache(fileName)
+        self.assert_(linecache.getline(fileName, 1,
+                                       sys.modules['archived_broken'].__dict__))
+
+    def test_laterArchivesWin(self):
+        self.write([('archived_c', 'first')])
+        second = os.path.join(self.tempDir, 'second.cta')
+        self.write([('archived_c', 'second')], path=second)
+        self.install()
+        self.install(second)
+        from archived_c import archived_c
+        self.assertEqual(str(archived_c()), 'second')
+
+    def test_rewriteWhileMapped(self):
+        self.write([('archived_d', 'old')])
+        reader = TemplateArchive.ArchiveReader(self.path)
+        self.write([('archived_d', 'new'), ('archived_e', 'e')])
+        self.assertEqual(reader.moduleNames(), ['archived_d'])
+        self.assert_('old' in reader.getSource('archived_d'))
+        reader.close()
+
+    def test_moduleAndPackageConflict(self):
+        writer = TemplateArchive.ArchiveWriter(self.path)
+        writer.add('archived_f', '')
+        self.assertRaises(TemplateArchive.Error, writer.add, 'archived_f.g', '')
+        writer.abort()
+        self.failIf(os.listdir(self.tempDir))
+
+    def test_badFiles(self):
+        for data in ('', 'not an archive at all, just some text'):
+            fp = open(self.path, 'wb')
+            fp.write(data)
+            fp.close()
+            self.assertRaises(TemplateArchive.Error,
+                              TemplateArchive.ArchiveReader, self.path)
+
+    def test_otherPythonVersion(self):
+        self.write([('archived_g', 'g')])
+        fp = open(self.path, 'r+b')
+        fp.seek(6)
+        fp.write('\0\0\0\0')
+        fp.close()
+        self.assertRaises(TemplateArchive.Error,
+                          TemplateArchive.ArchiveReader, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
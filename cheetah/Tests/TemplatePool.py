@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from Cheetah.Template import Template
+from Cheetah.TemplatePool import TemplatePool
+from Cheetah import Filters
+
+class RebindTest(unittest.TestCase):
+    def test_searchList(self):
+        t = Template('#set global $g = $name\n$name $g', searchList=[{'name': 'a'}])
+        self.assertEquals(str(t), 'a a')
+        self.assert_(t.rebind(searchList=[{'name': 'b'}]) is t)
+        self.assertEquals(str(t), 'b b')
+        t.rebind(namespaces={'name': 'c'})
+        self.assertEquals(str(t), 'c c')
+        t.rebind()
+        self.failIf(t.getVar('g', None))
+        self.failIf(t.getVar('name', None))
+
+    def test_prioritizeSearchListOverSelf(self):
+        t = Template('$respond', searchList=[{'respond': 'a'}],
+                     compilerSettings={'prioritizeSearchListOverSelf': True})
+        self.assertEquals(str(t), 'a')
+        t.rebind(searchList=[{'respond': 'b'}])
+        self.assertEquals(str(t), 'b')
+
+    def test_resetsState(self):
+        t = Template('<$x>', searchList=[{'x': '&'}])
+        t._CHEETAH__currentFilter = Filters.WebSafe(t).filter
+        t._CHEETAH__isBuffering = True
+        t.rebind(searchList=[{'x': '&'}])
+        self.assertEquals(str(t), '<&>')
+        self.failIf(t._CHEETAH__isBuffering)
+
+    def test_include(self):
+        t = Template('[#include source=$inc#]', searchList=[{'inc': '$name', 'name': 'a'}])
+        self.assertEquals(str(t), '[a]')
+        t.rebind(searchList=[{'inc': '$name', 'name': 'b'}])
+        self.assertEquals(str(t), '[b]')
+        # one template per distinct source isn't kept between renders
+        for i in range(5):
+            t.rebind(searchList=[{'inc': '$name %d' % i, 'name': 'c'}])
+            self.assertEquals(str(t), '[c %d]' % i)
+        t.rebind()
+        self.assertEquals(t._CHEETAH__cheetahIncludes, {})
+
+    def test_includeFileAttributes(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'inc.tmpl')
+            f = open(path, 'w')
+            f.write('#if not hasattr(self, "who")\n'
+                    '#silent self.who = $name\n#end if\n$who')
+            f.close()
+            t = Template('[#include $path#]', searchList=[{'path': path, 'name': 'a'}])
+            t.rebind(searchList=[{'path': path, 'name': 'a'}])
+            self.assertEquals(str(t), '[a]')
+            t.rebind(searchList=[{'path': path, 'name': 'b'}])
+            self.assertEquals(str(t), '[b]')
+        finally:
+            shutil.rmtree(dir)
+
+class TemplatePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.klass = Template.compile(
+            '#if hasattr(self, "seen")\n#silent self.fail()\n#end if\n'
+            '$name#silent self.seen = $name')
+
+    def test_reuse(self):
+        pool = TemplatePool(self.klass, maxSize=1)
+        t = pool.acquire(searchList=[{'name': 'a'}])
+        self.assertEquals(str(t), 'a')
+        self.assertEquals(t.seen, 'a')
+        pool.release(t)
+        self.assertEquals(len(pool), 1)
+        self.failIf(hasattr(t, 'seen'))
+        self.failIf(t.getVar('name', None))
+
+        t2 = pool.acquire(namespaces={'name': 'b'})
+        self.assert_(t2 is t)
+        self.assertEquals(str(t2), 'b')
+        t3 = pool.acquire()
+        self.failIf(t3 is t)
+        pool.release(t2)
+        pool.release(t3)
+        self.assertEquals(len(pool), 1)
+        pool.clear()
+        self.assertEquals(len(pool), 0)
+
+    def test_render(self):
+        pool = TemplatePool(self.klass, filter='WebSafe')
+        self.assertEquals(pool.render(searchList=[{'name': '<a>'}]), '&lt;a&gt;')
+        self.assertEquals(pool.render(searchList=[{'name': 'b'}],
+                                      methodName='respond'), 'b')
+        self.assertEquals(len(pool), 1)
+
+    def test_renderError(self):
+        pool = TemplatePool(self.klass)
+        self.assertRaises(Exception, pool.render)
+        self.assertEquals(len(pool), 1)
+        self.assertEquals(pool.render(searchList=[{'name': 'a'}]), 'a')
+
+    def test_getInstancePool(self):
+        pool = self.klass.getInstancePool()
+        self.assert_(pool is self.klass.getInstancePool())
+        self.assertEquals(pool.maxSize, self.klass._CHEETAH_instancePoolSize)
+        subclass = self.klass.subclass('#implements respond\nsub $name')
+        self.failIf(subclass.getInstancePool() is pool)
+        self.assertEquals(subclass.getInstancePool().render(
+            searchList=[{'name': 'a'}]), 'sub a')
+
+    def test_threads(self):
+        pool = TemplatePool(self.klass, maxSize=4)
+        errors = []
+        def render(i):
+            for j in range(50):
+                name = '%d-%d' % (i, j)
+                if pool.render(searchList=[{'name': name}]) != name:
+                    errors.append(name)
+        threads = [threading.Thread(target=render, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(errors, [])
+        self.assert_(len(pool) <= 4)
+
+class RenderBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.klass = Template.compile('#def greet\nHi $name#slurp\n#end def\n$name!')
+        self.records = [{'name': 'n%d' % i} for i in range(200)]
+        self.expected = ['n%d!' % i for i in range(200)]
+
+    def test_sequential(self):
+        outputs = self.klass.renderBatch(iter(self.records))
+        self.assertEquals(list(outputs), self.expected)
+
+    def test_options(self):
+        outputs = self.klass.renderBatch([{'name': '<a>'}, [{'x': 1}, {'name': 'b'}]],
+                                         methodName='greet', filter='WebSafe')
+        self.assertEquals(list(outputs), ['Hi &lt;a&gt;', 'Hi b'])
+
+    def test_processes(self):
+        outputs = self.klass.renderBatch(iter(self.records), processes=2, chunkSize=3)
+        self.assertEquals(list(outputs), self.expected)
+        self.assertEquals(list(self.klass.renderBatch([], processes=2)), [])
+
+    def test_attributesNotShared(self):
+        klass = Template.compile(
+            '#if $varExists("code")\n#silent self.coupon = $code\n#end if\n'
+            '$name:$getattr(self, "coupon", "-")')
+        records = [{'name': 'a', 'code': 'X'}, {'name': 'b'}] * 3
+        expected = ['a:X', 'b:-'] * 3
+        self.assertEquals(list(klass.renderBatch(records)), expected)
+        self.assertEquals(list(klass.renderBatch(records, processes=1, chunkSize=2)),
+                          expected)
+
+    def test_processesError(self):
+        records = self.records[:10] + [{}]
+        outputs = self.klass.renderBatch(records, processes=2, chunkSize=3)
+        self.assertRaises(Exception, list, outputs)
+
+
+if __name__ == '__main__':
+    unittest.main()
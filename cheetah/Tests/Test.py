@@ -24,6 +24,15 @@ from Cheetah.Tests import Regressions
 from Cheetah.Tests import Unicode
 from Cheetah.Tests import CheetahWrapper
 from Cheetah.Tests import Analyzer
+from Cheetah.Tests import CompileCache
+from Cheetah.Tests import Compiler
+from Cheetah.Tests import Benchmark
+from Cheetah.Tests import CacheRegion
+from Cheetah.Tests import CacheStore
+from Cheetah.Tests import TemplateArchive
+from Cheetah.Tests import CompileManifest
+from Cheetah.Tests import SourceReader
+from Cheetah.Tests import TemplatePool
 
 SyntaxAndOutput.install_eols()
 
@@ -38,6 +47,15 @@ suites = [
    unittest.findTestCases(Misc),
    unittest.findTestCases(Parser),
    unittest.findTestCases(Analyzer),
+   unittest.findTestCases(CompileCache),
+   unittest.findTestCases(Compiler),
+   unittest.findTestCases(Benchmark),
+   unittest.findTestCases(CacheRegion),
+   unittest.findTestCases(CacheStore),
+   unittest.findTestCases(TemplateArchive),
+   unittest.findTestCases(CompileManifest),
+   unittest.findTestCases(SourceReader),
+   unittest.findTestCases(TemplatePool),
 ]
 
 if not sys.platform.startswith('java'):
@@ -232,6 +232,55 @@ class InlineSpanishTest(unittest.TestCase):
         self.assertTrue(unicode(template))
 
 
+class OutputEncodingTest(unittest.TestCase):
+    source = (u'#def wrap(body)\n<é>$body</é>#slurp\n#end def\n'
+              u'à $name\n'
+              u'#capture c\nü$name#slurp\n#end capture\n'
+              u'#cache\n[$c]\n#end cache\n'
+              u'#call $wrap\n$name#slurp\n#end call\n'
+              u'<%= u"\\u00ff" %>\n')
+    expected = (u'à José\n[üJosé]\n'
+                u'<é>José</é>ÿ\n')
+
+    def compile(self, **settings):
+        settings.setdefault('outputEncoding', 'utf-8')
+        return Template.compile(self.source, compilerSettings=settings)
+
+    def test_respond(self):
+        t = self.compile()(namespaces={'name': u'José'})
+        rc = t.respond()
+        self.assert_(isinstance(rc, str))
+        self.assertEquals(rc, self.expected.encode('utf-8'))
+        self.assertEquals(str(t), rc)
+        self.assertEquals(unicode(t), self.expected)
+
+    def test_byteStringValues(self):
+        t = self.compile()(namespaces={'name': u'José'.encode('utf-8')})
+        self.assertEquals(t.respond(), self.expected.encode('utf-8'))
+
+    def test_otherEncoding(self):
+        t = self.compile(outputEncoding='latin-1')(namespaces={'name': u'José'})
+        self.assertEquals(t.respond(), self.expected.encode('latin-1'))
+
+    def test_iterRender(self):
+        t = self.compile(generateStreamingMethods=True)(
+            namespaces={'name': u'José'})
+        chunks = list(t.iterRender(flushThreshold=1))
+        self.failIf([c for c in chunks if not isinstance(c, str)])
+        self.assertEquals(''.join(chunks), self.expected.encode('utf-8'))
+
+    def test_staticTextIsEncoded(self):
+        code = Template.compile(self.source, returnAClass=False,
+                                compilerSettings={'outputEncoding': 'utf-8'})
+        self.failUnless(r"write('''\xc3\xa0 ''')" in code)
+
+    def test_mixedChunks(self):
+        response = DummyTransaction.DummyResponse(encoding='utf-8')
+        response.write('\xc3\xa9')
+        response.write(u'é')
+        response.write(u'')
+        self.assertEquals(response.getvalue(), '\xc3\xa9\xc3\xa9')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -34,6 +34,8 @@ extern "C" {
 typedef struct {
     PyObject_HEAD
     /* type specific fields */
+    PyObject *dict;          /* instance attributes, e.g. 'template' */
+    PyObject *weakreflist;
 } PyFilter;
 
 /*
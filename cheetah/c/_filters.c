@@ -1,9 +1,13 @@
 /*
  * C-version of the src/Filters.py module
  *
+ * Provides Filter, the baseclass of the Cheetah filters, and WebSafe.  See
+ * the docstrings in Filters.py for details on their behaviour.
+ *
  * (c) 2009, R. Tyler Ballance <tyler@slide.com>
  */
 #include <Python.h>
+#include <stddef.h>
 
 #include "Cheetah.h"
 
@@ -17,27 +21,418 @@ typedef enum { false, true } bool;
 extern "C" {
 #endif
 
+/*
+ * Replicates Filter.filter() from Filters.py: None becomes u'', unicode
+ * objects are returned as is and everything else is passed to unicode(),
+ * falling back to str() if that raises a UnicodeDecodeError.
+ */
+static PyObject *coerceToUnicode(PyObject *val, PyObject *strFunc)
+{
+    PyObject *result;
+
+    if (val == Py_None) {
+        return PyUnicode_FromUnicode(NULL, 0);
+    }
+    if (PyUnicode_Check(val)) {
+        Py_INCREF(val);
+        return val;
+    }
+    result = PyObject_Unicode(val);
+    if (result == NULL && PyErr_ExceptionMatches(PyExc_UnicodeDecodeError)) {
+        /* pass the str on and let DummyTransaction worry about it */
+        PyErr_Clear();
+        if (strFunc != NULL) {
+            return PyObject_CallFunctionObjArgs(strFunc, val, NULL);
+        }
+        return PyObject_Str(val);
+    }
+    return result;
+}
+
+/*
+ * Unpacks the arguments of filter(self, val, encoding=None, str=str, **kw).
+ * Returns borrowed references.
+ */
+static bool parseFilterArgs(PyObject *args, PyObject *kwargs,
+        PyObject **val, PyObject **strFunc)
+{
+    Py_ssize_t nargs = PyTuple_GET_SIZE(args);
+
+    *val = NULL;
+    *strFunc = NULL;
+    if (nargs > 3) {
+        PyErr_Format(PyExc_TypeError,
+                "filter() takes at most 3 arguments (%zd given)", nargs);
+        return false;
+    }
+    if (nargs > 0) {
+        *val = PyTuple_GET_ITEM(args, 0);
+    }
+    if (nargs == 3) {
+        *strFunc = PyTuple_GET_ITEM(args, 2);
+    }
+    if (kwargs != NULL) {
+        if (*val == NULL) {
+            *val = PyDict_GetItemString(kwargs, "val");
+        }
+        if (*strFunc == NULL) {
+            *strFunc = PyDict_GetItemString(kwargs, "str");
+        }
+    }
+    if (*val == NULL) {
+        PyErr_SetString(PyExc_TypeError, "filter() requires a value to filter");
+        return false;
+    }
+    return true;
+}
+
+/*
+ * Escapes '&', '<' and '>' in a single pass.  The first pass only counts the
+ * characters that need escaping, so values without any are returned without
+ * copying them.
+ */
+#define ESCAPED_EXTRA_LENGTH(c) \
+    ((c) == '&' ? 4 : (((c) == '<' || (c) == '>') ? 3 : 0))
+
+#define ESCAPE_CHARS(CHAR_TYPE, src, srcLen, dest) \
+    { \
+        Py_ssize_t i; \
+        CHAR_TYPE *out = (dest); \
+        for (i = 0; i < (srcLen); i++) { \
+            CHAR_TYPE c = (src)[i]; \
+            switch (c) { \
+                case '&': \
+                    *out++ = '&'; *out++ = 'a'; *out++ = 'm'; *out++ = 'p'; \
+                    *out++ = ';'; \
+                    break; \
+                case '<': \
+                    *out++ = '&'; *out++ = 'l'; *out++ = 't'; *out++ = ';'; \
+                    break; \
+                case '>': \
+                    *out++ = '&'; *out++ = 'g'; *out++ = 't'; *out++ = ';'; \
+                    break; \
+                default: \
+                    *out++ = c; \
+            } \
+        } \
+    }
+
+static PyObject *escapeUnicode(PyObject *s)
+{
+    Py_UNICODE *src = PyUnicode_AS_UNICODE(s);
+    Py_ssize_t len = PyUnicode_GET_SIZE(s);
+    Py_ssize_t extra = 0, i;
+    PyObject *result;
+
+    for (i = 0; i < len; i++) {
+        extra += ESCAPED_EXTRA_LENGTH(src[i]);
+    }
+    if (!extra) {
+        Py_INCREF(s);
+        return s;
+    }
+    result = PyUnicode_FromUnicode(NULL, len + extra);
+    if (result == NULL) {
+        return NULL;
+    }
+    ESCAPE_CHARS(Py_UNICODE, src, len, PyUnicode_AS_UNICODE(result));
+    return result;
+}
+
+static PyObject *escapeString(PyObject *s)
+{
+    char *src = PyString_AS_STRING(s);
+    Py_ssize_t len = PyString_GET_SIZE(s);
+    Py_ssize_t extra = 0, i;
+    PyObject *result;
+
+    for (i = 0; i < len; i++) {
+        extra += ESCAPED_EXTRA_LENGTH(src[i]);
+    }
+    if (!extra) {
+        Py_INCREF(s);
+        return s;
+    }
+    result = PyString_FromStringAndSize(NULL, len + extra);
+    if (result == NULL) {
+        return NULL;
+    }
+    ESCAPE_CHARS(char, src, len, PyString_AS_STRING(result));
+    return result;
+}
+
+/*
+ * Returns Filters.py's webSafeEntities.  It is looked up on every call, like
+ * the Python version does, so rebinding Filters.webSafeEntities works.
+ */
+static PyObject *getWebSafeEntities(void)
+{
+    PyObject *filtersModule, *entities;
+
+    filtersModule = PyImport_ImportModuleNoBlock("Cheetah.Filters");
+    if (filtersModule == NULL) {
+        return NULL;
+    }
+    entities = PyObject_GetAttrString(filtersModule, "webSafeEntities");
+    Py_DECREF(filtersModule);
+    return entities;
+}
+
+/*
+ * Returns the entity for the character k: the entry in entities, or a
+ * numeric character reference.
+ */
+static PyObject *entityFor(PyObject *entities, PyObject *k)
+{
+    PyObject *v;
+    long ord;
+
+    v = PyObject_GetItem(entities, k);
+    if (v != NULL) {
+        return v;
+    }
+    if (!PyErr_ExceptionMatches(PyExc_KeyError)) {
+        return NULL;
+    }
+    PyErr_Clear();
+    if (PyUnicode_Check(k) && PyUnicode_GET_SIZE(k) == 1) {
+        ord = (long)PyUnicode_AS_UNICODE(k)[0];
+    } else if (PyString_Check(k) && PyString_GET_SIZE(k) == 1) {
+        ord = (long)(unsigned char)PyString_AS_STRING(k)[0];
+    } else {
+        PyErr_Format(PyExc_TypeError,
+                "expected a character in 'also', but %.200s found",
+                Py_TYPE(k)->tp_name);
+        return NULL;
+    }
+    return PyString_FromFormat("&#%ld;", ord);
+}
+
+/*
+ * Replaces each character of chars (or item of the iterable chars) in s with
+ * its entity, using successive replace() calls exactly like the Python
+ * version does.  Steals the reference to s.
+ */
+static PyObject *replaceEntities(PyObject *s, PyObject *chars)
+{
+    PyObject *entities, *iter, *k, *v, *tmp;
+
+    entities = getWebSafeEntities();
+    if (entities == NULL) {
+        Py_DECREF(s);
+        return NULL;
+    }
+    iter = PyObject_GetIter(chars);
+    if (iter == NULL) {
+        Py_DECREF(entities);
+        Py_DECREF(s);
+        return NULL;
+    }
+    while (s != NULL && (k = PyIter_Next(iter)) != NULL) {
+        v = entityFor(entities, k);
+        if (v == NULL) {
+            Py_CLEAR(s);
+        } else {
+            tmp = PyObject_CallMethod(s, "replace", "(OO)", k, v);
+            Py_DECREF(v);
+            Py_DECREF(s);
+            s = tmp;
+        }
+        Py_DECREF(k);
+    }
+    Py_DECREF(iter);
+    Py_DECREF(entities);
+    if (PyErr_Occurred()) {
+        Py_XDECREF(s);
+        return NULL;
+    }
+    return s;
+}
+
+/*
+ * The replace() based fallback for '&', '<' and '>', for objects that are
+ * neither unicode nor str.  Doesn't steal the reference to s.
+ */
+static PyObject *replaceSpecialChars(PyObject *s)
+{
+    static const char *chars[] = {"&", "<", ">"};
+    static const char *entities[] = {"&amp;", "&lt;", "&gt;"};
+    PyObject *tmp;
+    int i;
+
+    Py_INCREF(s);
+    for (i = 0; s != NULL && i < 3; i++) {
+        tmp = PyObject_CallMethod(s, "replace", "(ss)", chars[i], entities[i]);
+        Py_DECREF(s);
+        s = tmp;
+    }
+    return s;
+}
+
+/*
+ * Filter
+ */
+static int filter_init(PyFilter *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *template = Py_None;
+    static char *kwlist[] = {"template", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O:Filter", kwlist, &template)) {
+        return -1;
+    }
+    return PyObject_SetAttrString((PyObject *)self, "template", template);
+}
+
+static int filter_traverse(PyFilter *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->dict);
+    return 0;
+}
+
+static int filter_clear(PyFilter *self)
+{
+    Py_CLEAR(self->dict);
+    return 0;
+}
+
+static void filter_dealloc(PyFilter *self)
+{
+    PyObject_GC_UnTrack(self);
+    if (self->weakreflist != NULL) {
+        PyObject_ClearWeakRefs((PyObject *)self);
+    }
+    filter_clear(self);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *filter_getdict(PyFilter *self, void *closure)
+{
+    if (self->dict == NULL) {
+        self->dict = PyDict_New();
+        if (self->dict == NULL) {
+            return NULL;
+        }
+    }
+    Py_INCREF(self->dict);
+    return self->dict;
+}
+
+static int filter_setdict(PyFilter *self, PyObject *value, void *closure)
+{
+    PyObject *tmp;
+
+    if (value == NULL || !PyDict_Check(value)) {
+        PyErr_SetString(PyExc_TypeError, "__dict__ must be set to a dictionary");
+        return -1;
+    }
+    tmp = self->dict;
+    Py_INCREF(value);
+    self->dict = value;
+    Py_XDECREF(tmp);
+    return 0;
+}
+
+/*
+ * Pickles the filter as a call to its class with its template, followed by
+ * its __dict__, which the default reduction can't do for protocols 0 and 1
+ * as the class isn't a Python class.
+ */
+static PyObject *py_filter_reduce(PyFilter *self)
+{
+    PyObject *dict, *template;
+
+    dict = filter_getdict(self, NULL);
+    if (dict == NULL) {
+        return NULL;
+    }
+    template = PyDict_GetItemString(dict, "template");
+    if (template == NULL) {
+        template = Py_None;
+    }
+    return Py_BuildValue("(O(O)N)", Py_TYPE(self), template, dict);
+}
 
 static PyObject *py_filter(PyObject *self, PyObject *args, PyObject *kwargs)
 {
-    Py_RETURN_FALSE;
+    PyObject *val, *strFunc;
+
+    if (!parseFilterArgs(args, kwargs, &val, &strFunc)) {
+        return NULL;
+    }
+    return coerceToUnicode(val, strFunc);
+}
+
+/*
+ * WebSafe
+ */
+static PyObject *py_websafe_filter(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *val, *strFunc, *s, *escaped, *also = NULL;
+
+    if (!parseFilterArgs(args, kwargs, &val, &strFunc)) {
+        return NULL;
+    }
+    s = coerceToUnicode(val, strFunc);
+    if (s == NULL) {
+        return NULL;
+    }
+    if (PyUnicode_Check(s)) {
+        escaped = escapeUnicode(s);
+    } else if (PyString_Check(s)) {
+        escaped = escapeString(s);
+    } else {
+        /* a custom str() returned something else, so use its replace() */
+        escaped = replaceSpecialChars(s);
+    }
+    Py_DECREF(s);
+    if (escaped == NULL) {
+        return NULL;
+    }
+
+    if (kwargs != NULL) {
+        also = PyDict_GetItemString(kwargs, "also");
+    }
+    if (also != NULL) {
+        return replaceEntities(escaped, also);
+    }
+    return escaped;
 }
 
-static const char _filtersdoc[] = "\
-\n\
-";
 static struct PyMethodDef py_filtermethods[] = {
     {"filter", (PyCFunction)(py_filter), METH_VARARGS | METH_KEYWORDS,
-            PyDoc_STR("Filter stuff")},
+            PyDoc_STR("Pass Unicode strings through unmolested, converting "
+                      "everything else to unicode and None to u''.")},
+    {"__reduce__", (PyCFunction)(py_filter_reduce), METH_NOARGS,
+            PyDoc_STR("Helper for pickle.")},
+    {NULL},
+};
+
+static struct PyMethodDef py_websafemethods[] = {
+    {"filter", (PyCFunction)(py_websafe_filter), METH_VARARGS | METH_KEYWORDS,
+            PyDoc_STR("Escape HTML entities in $placeholders.")},
+    {NULL},
+};
+
+static PyGetSetDef py_filtergetset[] = {
+    {"__dict__", (getter)filter_getdict, (setter)filter_setdict, NULL, NULL},
+    {NULL},
+};
+
+static const char _filtersdoc[] = "\
+C versions of the Filter and WebSafe classes from Cheetah.Filters\n\
+";
+
+static PyMethodDef py_modulemethods[] = {
     {NULL},
 };
+
 static PyTypeObject PyFilterType = {
     PyObject_HEAD_INIT(NULL)
     0,                         /*ob_size*/
-    "_filters.Filter",             /*tp_name*/
-    sizeof(PyFilter), /*tp_basicsize*/
+    "Cheetah._filters.Filter", /*tp_name*/
+    sizeof(PyFilter),          /*tp_basicsize*/
     0,                         /*tp_itemsize*/
-    0,                         /*tp_dealloc*/
+    (destructor)filter_dealloc, /*tp_dealloc*/
     0,                         /*tp_print*/
     0,                         /*tp_getattr*/
     0,                         /*tp_setattr*/
@@ -49,43 +444,82 @@ static PyTypeObject PyFilterType = {
     0,                         /*tp_hash */
     0,                         /*tp_call*/
     0,                         /*tp_str*/
-    0,                         /*tp_getattro*/
-    0,                         /*tp_setattro*/
+    PyObject_GenericGetAttr,   /*tp_getattro*/
+    PyObject_GenericSetAttr,   /*tp_setattro*/
     0,                         /*tp_as_buffer*/
-    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
-    "Filter object",           /* tp_doc */
-    0,                     /* tp_traverse */
-    0,                     /* tp_clear */
-    0,                     /* tp_richcompare */
-    0,                     /* tp_weaklistoffset */
-    0,                     /* tp_iter */
-    0,                     /* tp_iternext */
-    py_filtermethods,             /* tp_methods */
-#if 0
-    py_filtermembers,             /* tp_members */
-    0,                         /* tp_getset */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC, /*tp_flags*/
+    "A baseclass for the Cheetah Filters.", /* tp_doc */
+    (traverseproc)filter_traverse, /* tp_traverse */
+    (inquiry)filter_clear,     /* tp_clear */
+    0,                         /* tp_richcompare */
+    offsetof(PyFilter, weakreflist), /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    py_filtermethods,          /* tp_methods */
+    0,                         /* tp_members */
+    py_filtergetset,           /* tp_getset */
     0,                         /* tp_base */
     0,                         /* tp_dict */
     0,                         /* tp_descr_get */
     0,                         /* tp_descr_set */
-    0,                         /* tp_dictoffset */
-    (initproc)Noddy_init,      /* tp_init */
-    0,                         /* tp_alloc */
-    NULL,                 /* tp_new */
-#endif
+    offsetof(PyFilter, dict),  /* tp_dictoffset */
+    (initproc)filter_init,     /* tp_init */
+    PyType_GenericAlloc,       /* tp_alloc */
+    PyType_GenericNew,         /* tp_new */
+    PyObject_GC_Del,           /* tp_free */
+};
+
+static PyTypeObject PyWebSafeType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "Cheetah._filters.WebSafe", /*tp_name*/
+    sizeof(PyFilter),          /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    0,                         /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC, /*tp_flags*/
+    "Escape HTML entities in $placeholders.", /* tp_doc */
+    (traverseproc)filter_traverse, /* tp_traverse */
+    (inquiry)filter_clear,     /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    py_websafemethods,         /* tp_methods */
+    0,                         /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base, set in init_filters() */
 };
 
-PyMODINIT_FUNC init_filters()
+PyMODINIT_FUNC init_filters(void)
 {
-    PyObject *module = Py_InitModule3("_filters", py_filtermethods, _filtersdoc);
+    PyObject *module = Py_InitModule3("_filters", py_modulemethods, _filtersdoc);
+    if (module == NULL)
+        return;
 
-    PyFilterType.tp_new = PyType_GenericNew;
     if (PyType_Ready(&PyFilterType) < 0)
         return;
+    PyWebSafeType.tp_base = &PyFilterType;
+    if (PyType_Ready(&PyWebSafeType) < 0)
+        return;
 
     Py_INCREF(&PyFilterType);
-
     PyModule_AddObject(module, "Filter", (PyObject *)(&PyFilterType));
+    Py_INCREF(&PyWebSafeType);
+    PyModule_AddObject(module, "WebSafe", (PyObject *)(&PyWebSafeType));
 }
 
 #ifdef __cplusplus
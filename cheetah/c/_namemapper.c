@@ -393,6 +393,193 @@ done:
     return theValue;
 }
 
+/* ***************************************************************************
+ * valueFromFrameOrSearchListCached() is used by templates compiled with the
+ * useCompiledNameLookups setting.  The name arrives pre-split as a tuple of
+ * strings and slotCache maps each root name to the index of the searchList
+ * namespace that satisfied it (-1 for globals/builtins), so later lookups of
+ * the same name skip the namespaces that came before it.  Mappings in the
+ * skipped part of the searchList are still checked, as they are cheap to
+ * test and commonly gain names while rendering (e.g. #set global).
+ * *************************************************************************** */
+
+static int PyNamemapper_hasKeyObject(PyObject *obj, PyObject *key, char *keyStr)
+{
+    if (PyDict_Check(obj)) {
+        if (PyDict_GetItem(obj, key) != NULL) {
+            return TRUE;
+        }
+        return PyObject_HasAttr(obj, key);
+    }
+    return PyNamemapper_hasKey(obj, keyStr);
+}
+
+static PyObject *valueForNameChunksInNameSpace(PyObject *nameSpace, PyObject *nameTuple,
+        char *nameChunks[], int numChunks, int executeCallables)
+{
+    PyObject *theValue, *dot, *fullName;
+    PyObject *excType, *excValue, *excTraceback;
+
+    theValue = PyNamemapper_valueForName(nameSpace, nameChunks, numChunks, executeCallables);
+    if (theValue == NULL && PyErr_Occurred()
+            && PyErr_GivenExceptionMatches(PyErr_Occurred(), NotFound)) {
+        PyErr_Fetch(&excType, &excValue, &excTraceback);
+        dot = Py_BuildValue("s", ".");
+        fullName = dot ? PyObject_CallMethod(dot, "join", "(O)", nameTuple) : NULL;
+        PyErr_Clear();
+        PyErr_Restore(excType, excValue, excTraceback);
+        if (fullName != NULL) {
+#ifdef IS_PYTHON3
+            wrapInternalNotFoundException(PyUnicode_AsUTF8(fullName), nameSpace);
+#else
+            wrapInternalNotFoundException(PyString_AsString(fullName), nameSpace);
+#endif
+        }
+        Py_XDECREF(fullName);
+        Py_XDECREF(dot);
+    }
+    return theValue;
+}
+
+static PyObject *namemapper_autoCall(PyObject *self, PyObject *obj)
+{
+    if (PyCallable_Check(obj) && (isInstanceOrClass(obj) == 0)) {
+        return PyObject_CallObject(obj, NULL);
+    }
+    Py_INCREF(obj);
+    return obj;
+}
+
+static PyObject *namemapper_valueFromFrameOrSearchListCached(PYARGS)
+{
+    /* python function args */
+    PyObject *searchList, *slotCache, *nameTuple;
+    int executeCallables = 0;
+    PyObject *localsDict = NULL;
+    PyObject *globalsDict = NULL;
+
+    /* locals */
+    char *nameChunks[MAXCHUNKS];
+    int numChunks, i, slot, numNameSpaces, scanTo;
+    PyObject *key, *seq = NULL, *nameSpace = NULL, *slotObj = NULL;
+    PyObject **nameSpaces;
+    PyObject *theValue = NULL;
+
+    static char *kwlist[] = {"searchList", "slotCache", "nameChunks",
+                             "executeCallables", "locals", "globals", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO!O!|iOO", kwlist,
+                &searchList, &PyDict_Type, &slotCache, &PyTuple_Type, &nameTuple,
+                &executeCallables, &localsDict, &globalsDict)) {
+        return NULL;
+    }
+
+    numChunks = (int)PyTuple_GET_SIZE(nameTuple);
+    if (numChunks == 0 || numChunks >= (MAXCHUNKS-1)) {
+        PyErr_SetString(TooManyPeriods, "invalid number of name chunks");
+        return NULL;
+    }
+    for (i=0; i < numChunks; i++) {
+#ifdef IS_PYTHON3
+        nameChunks[i] = PyUnicode_AsUTF8(PyTuple_GET_ITEM(nameTuple, i));
+#else
+        nameChunks[i] = PyString_AsString(PyTuple_GET_ITEM(nameTuple, i));
+#endif
+        if (nameChunks[i] == NULL) {
+            return NULL;
+        }
+    }
+    key = PyTuple_GET_ITEM(nameTuple, 0);
+
+    if (localsDict == NULL || localsDict == Py_None) {
+        localsDict = PyEval_GetLocals();
+    }
+    if (globalsDict == NULL || globalsDict == Py_None) {
+        globalsDict = PyEval_GetGlobals();
+    }
+
+    if (localsDict && PyNamemapper_hasKeyObject(localsDict, key, nameChunks[0])) {
+        return valueForNameChunksInNameSpace(localsDict, nameTuple,
+                nameChunks, numChunks, executeCallables);
+    }
+
+    seq = PySequence_Fast(searchList, "This searchList is not iterable!");
+    if (seq == NULL) {
+        return NULL;
+    }
+    numNameSpaces = (int)PySequence_Fast_GET_SIZE(seq);
+    nameSpaces = PySequence_Fast_ITEMS(seq);
+
+    slotObj = PyDict_GetItem(slotCache, key);
+    if (slotObj != NULL) {
+        slot = (int)PyLong_AsLong(slotObj);
+        scanTo = (slot < 0 || slot >= numNameSpaces) ? numNameSpaces : slot;
+        for (i=0; i < scanTo; i++) {
+            if (PyDict_Check(nameSpaces[i]) && PyDict_GetItem(nameSpaces[i], key)) {
+                /* an earlier mapping has gained this name */
+                scanTo = -1;
+                break;
+            }
+        }
+        if (scanTo >= 0 && slot < numNameSpaces) {
+            if (slot >= 0) {
+                nameSpace = nameSpaces[slot];
+            } else if (globalsDict && PyDict_GetItem(globalsDict, key)) {
+                nameSpace = globalsDict;
+            } else if (PyDict_GetItem(PyEval_GetBuiltins(), key)) {
+                nameSpace = PyEval_GetBuiltins();
+            }
+            if (nameSpace && PyNamemapper_hasKeyObject(nameSpace, key, nameChunks[0])) {
+                theValue = valueForNameChunksInNameSpace(nameSpace, nameTuple,
+                        nameChunks, numChunks, executeCallables);
+                goto done;
+            }
+            if (PyErr_Occurred()) {
+                goto done;
+            }
+        }
+    }
+
+    for (i=0; i < numNameSpaces; i++) {
+        if (PyNamemapper_hasKeyObject(nameSpaces[i], key, nameChunks[0])) {
+            slotObj = PyLong_FromLong(i);
+            if (slotObj == NULL || PyDict_SetItem(slotCache, key, slotObj) < 0) {
+                Py_XDECREF(slotObj);
+                goto done;
+            }
+            Py_DECREF(slotObj);
+            theValue = valueForNameChunksInNameSpace(nameSpaces[i], nameTuple,
+                    nameChunks, numChunks, executeCallables);
+            goto done;
+        }
+        if (PyErr_Occurred()) {
+            goto done;
+        }
+    }
+
+    if (globalsDict && PyNamemapper_hasKeyObject(globalsDict, key, nameChunks[0])) {
+        nameSpace = globalsDict;
+    } else if (PyNamemapper_hasKeyObject(PyEval_GetBuiltins(), key, nameChunks[0])) {
+        nameSpace = PyEval_GetBuiltins();
+    }
+    if (nameSpace) {
+        slotObj = PyLong_FromLong(-1);
+        if (slotObj == NULL || PyDict_SetItem(slotCache, key, slotObj) < 0) {
+            Py_XDECREF(slotObj);
+            goto done;
+        }
+        Py_DECREF(slotObj);
+        theValue = valueForNameChunksInNameSpace(nameSpace, nameTuple,
+                nameChunks, numChunks, executeCallables);
+        goto done;
+    }
+    setNotFoundException(nameChunks[0], searchList);
+
+done:
+    Py_DECREF(seq);
+    return theValue;
+}
+
 static PyObject *namemapper_valueFromFrame(PyObject *self, PyObject *args, PyObject *keywds)
 {
     /* python function args */
@@ -445,6 +632,8 @@ static struct PyMethodDef namemapper_methods[] = {
   {"valueFromSearchList", (PyCFunction)namemapper_valueFromSearchList,  METH_VARARGS|METH_KEYWORDS},
   {"valueFromFrame", (PyCFunction)namemapper_valueFromFrame,  METH_VARARGS|METH_KEYWORDS},
   {"valueFromFrameOrSearchList", (PyCFunction)namemapper_valueFromFrameOrSearchList,  METH_VARARGS|METH_KEYWORDS},
+  {"valueFromFrameOrSearchListCached", (PyCFunction)namemapper_valueFromFrameOrSearchListCached,  METH_VARARGS|METH_KEYWORDS},
+  {"autoCall", (PyCFunction)namemapper_autoCall,  METH_O},
   {NULL,         NULL}
 };
 